@@ -126,7 +126,8 @@ def positiveint(flag):
 
 config.read(limit=int, soft_mem_limit=int, hard_mem_limit=int, port=int,
             multi_user=positiveint, serialize_jobs=positiveint,
-            strict=positiveint, code=exec)
+            strict=positiveint, code=exec, shared_arrays=positiveint,
+            agg_queue_size=int, buffer_size=int)
 
 if config.directory.custom_tmp:
     os.environ['TMPDIR'] = config.directory.custom_tmp
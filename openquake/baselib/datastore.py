@@ -273,6 +273,8 @@ class DataStore(collections.abc.MutableMapping):
         if self.mode == 'r' and not os.path.exists(self.filename):
             raise IOError('File not found: %s' % self.filename)
         self.hdf5 = ()  # so that `key in self.hdf5` is valid
+        self.buffers = {}  # key -> (arrays, attrs), see .extend
+        self.nbytes = 0  # size of the buffered arrays
         self.open(self.mode)
 
     def open(self, mode):
@@ -304,6 +306,8 @@ class DataStore(collections.abc.MutableMapping):
         """
         Return a dataset by using h5py.File.__getitem__
         """
+        if self.buffers:
+            self.flush_buffers(name)
         try:
             return h5py.File.__getitem__(self.hdf5, name)
         except KeyError:
@@ -372,7 +376,7 @@ class DataStore(collections.abc.MutableMapping):
         return dict(dset.attrs)
 
     def create_dset(self, key, dtype, shape=(None,), compression=None,
-                    fillvalue=0, attrs=None):
+                    fillvalue=0, attrs=None, nrows=None):
         """
         Create a one-dimensional HDF5 dataset.
 
@@ -381,12 +385,15 @@ class DataStore(collections.abc.MutableMapping):
         :param shape: shape of the dataset, possibly extendable
         :param compression: the kind of HDF5 compression to use
         :param attrs: dictionary of attributes of the dataset
+        :param nrows: expected final size of an extendable dataset, if known
         :returns: a HDF5 dataset
         """
         return hdf5.create(
-            self.hdf5, key, dtype, shape, compression, fillvalue, attrs)
+            self.hdf5, key, dtype, shape, compression, fillvalue, attrs,
+            nrows)
 
-    def create_dframe(self, key, nametypes, compression=None, **kw):
+    def create_dframe(self, key, nametypes, compression=None, nrows=None,
+                      **kw):
         """
         Create a HDF5 datagroup readable as a pandas DataFrame
 
@@ -396,6 +403,8 @@ class DataStore(collections.abc.MutableMapping):
             list of pairs (name, dtype) or (name, array) or DataFrame
         :param compression:
             the kind of HDF5 compression to use
+        :param nrows:
+            expected final number of rows, used to set the chunk size
         :param kw:
             extra attributes to store
         """
@@ -412,7 +421,7 @@ class DataStore(collections.abc.MutableMapping):
             else:
                 dt = value
             dset = hdf5.create(self.hdf5, f'{key}/{name}', dt, (None,),
-                               compression)
+                               compression, nrows=nrows)
             if is_array:
                 hdf5.extend(dset, value)
             names.append(name)
@@ -465,11 +474,60 @@ class DataStore(collections.abc.MutableMapping):
             fname = prefix + ('-%s' % postfix if postfix else '') + '.' + fmt
         return self.export_path(fname, export_dir)
 
+    def extend(self, key, array, **attrs):
+        """
+        Extend the dataset associated to the given key, like
+        :func:`openquake.baselib.hdf5.extend`, but buffering the array in
+        memory: the datasets are extended with large writes when the
+        buffers exceed `config.memory.buffer_size` bytes, and when the
+        datastore is flushed or closed. This is much more efficient
+        than calling `hdf5.extend` many times with small arrays.
+
+        :param key: name of an extendable dataset
+        :param array: an array of length L
+        :param attrs: attributes to set on the dataset
+        """
+        if len(array) == 0:
+            return
+        if key not in self.buffers:
+            self.buffers[key] = [], {}
+        arrays, dic = self.buffers[key]
+        arrays.append(numpy.asarray(array))
+        dic.update(attrs)
+        self.nbytes += arrays[-1].nbytes
+        if self.nbytes > config.memory.buffer_size:
+            self.flush_buffers(partial=True)
+
+    def flush_buffers(self, key='/', partial=False):
+        """
+        Write the arrays buffered by .extend for the given key (and the
+        keys below it). If partial is True, write only full chunks and
+        keep the rest in memory, so that the writes are chunk-aligned.
+        """
+        prefix = key.strip('/') + '/'
+        for k in list(self.buffers):
+            if key != '/' and k != key.strip('/') and not k.startswith(
+                    prefix):
+                continue
+            arrays, attrs = self.buffers.pop(k)
+            array = numpy.concatenate(arrays)
+            dset = self.hdf5[k]
+            n = len(array)
+            if partial and dset.chunks:
+                n = max(n - (len(dset) + n) % dset.chunks[0], 0)
+            if n:
+                hdf5.extend(dset, array[:n], **attrs)
+            if n < len(array):
+                self.buffers[k] = [array[n:]], attrs
+        self.nbytes = sum(arr.nbytes for arrays, _ in self.buffers.values()
+                          for arr in arrays)
+
     def flush(self):
         """Flush the underlying hdf5 file"""
         if self.parent != ():
             self.parent.flush()
         if self.hdf5:  # is open
+            self.flush_buffers()
             self.hdf5.flush()
 
     def close(self):
@@ -478,6 +536,7 @@ class DataStore(collections.abc.MutableMapping):
             self.parent.flush()
             self.parent.close()
         if self.hdf5:  # is open
+            self.flush_buffers()
             self.hdf5.flush()
             self.hdf5.close()
             self.hdf5 = ()
@@ -539,12 +598,13 @@ class DataStore(collections.abc.MutableMapping):
         data = bytes(numpy.asarray(self[key][()]))
         return io.BytesIO(gzip.decompress(data))
 
-    def read_df(self, key, index=None, sel=(), slc=slice(None)):
+    def read_df(self, key, index=None, sel=(), slc=slice(None), fields=()):
         """
         :param key: name of the structured dataset
         :param index: pandas index (or multi-index), possibly None
         :param sel: dictionary used to select subsets of the dataset
         :param slc: slice object to extract a slice of the dataset
+        :param fields: if given, read only such fields of a structured dataset
         :returns: pandas DataFrame associated to the dataset
         """
         dset = self.getitem(key)
@@ -560,8 +620,9 @@ class DataStore(collections.abc.MutableMapping):
             else:
                 return pandas.DataFrame(dic).set_index(index)
 
+        names = fields or dset.dtype.names
         dtlist = []
-        for name in dset.dtype.names:
+        for name in names:
             dt = dset.dtype[name]
             if dt.shape:  # vector field
                 templ = name + '_%d' * len(dt.shape)
@@ -570,7 +631,7 @@ class DataStore(collections.abc.MutableMapping):
             else:  # scalar field
                 dtlist.append((name, dt))
         data = numpy.zeros(len(dset), dtlist)
-        for name in dset.dtype.names:
+        for name in names:
             arr = dset[name]
             dt = dset.dtype[name]
             if dt.shape:  # vector field
@@ -614,6 +675,8 @@ class DataStore(collections.abc.MutableMapping):
     def __getitem__(self, key):
         if self.hdf5 == ():  # the datastore is closed
             raise ValueError('Cannot find %s in %s' % (key, self))
+        if self.buffers:
+            self.flush_buffers(key)
         try:
             val = self.hdf5[key]
         except KeyError:
@@ -641,6 +704,7 @@ class DataStore(collections.abc.MutableMapping):
                                (key, exc, self.filename))
 
     def __delitem__(self, key):
+        self.buffers.pop(key, None)
         del self.hdf5[key]
 
     def __enter__(self):
@@ -660,6 +724,8 @@ class DataStore(collections.abc.MutableMapping):
                     parent=self.parent,
                     calc_id=self.calc_id,
                     hdf5=(),
+                    buffers={},
+                    nbytes=0,
                     filename=self.filename)
 
     def __iter__(self):
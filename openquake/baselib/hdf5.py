@@ -58,8 +58,25 @@ def maybe_encode(value):
     return value
 
 
+def get_chunks(dtype, shape, nrows):
+    """
+    :param dtype: dtype of an extendable dataset
+    :param shape: shape of the dataset, starting with None
+    :param nrows: expected final number of rows of the dataset
+    :returns: a chunk shape with chunks between 64 KB and 1 MB
+
+    >>> get_chunks(numpy.float32, (None,), 1_000_000_000)
+    (262144,)
+    >>> get_chunks(numpy.float32, (None, 3), 10)
+    (5461, 3)
+    """
+    rowsize = numpy.dtype(dtype).itemsize * int(numpy.prod(shape[1:]))
+    nbytes = min(max(nrows * rowsize // 1000, 2 ** 16), 2 ** 20)
+    return (max(nbytes // rowsize, 1),) + tuple(shape[1:])
+
+
 def create(hdf5, name, dtype, shape=(None,), compression=None,
-           fillvalue=0, attrs=None):
+           fillvalue=0, attrs=None, nrows=None):
     """
     :param hdf5: a h5py.File object
     :param name: an hdf5 key string
@@ -67,11 +84,13 @@ def create(hdf5, name, dtype, shape=(None,), compression=None,
     :param shape: shape of the dataset (can be extendable)
     :param compression: None or 'gzip' are recommended
     :param attrs: dictionary of attributes of the dataset
+    :param nrows: expected final size of an extendable dataset, if known
     :returns: a HDF5 dataset
     """
     if shape[0] is None:  # extendable dataset
+        chunks = get_chunks(dtype, shape, nrows) if nrows else True
         dset = hdf5.create_dataset(
-            name, (0,) + shape[1:], dtype, chunks=True, maxshape=shape,
+            name, (0,) + shape[1:], dtype, chunks=chunks, maxshape=shape,
             compression=compression)
     else:  # fixed-shape dataset
         dset = hdf5.create_dataset(name, shape, dtype, fillvalue=fillvalue,
@@ -114,6 +133,25 @@ def extend(dset, array, **attrs):
     return newlength
 
 
+def memmap(dset):
+    """
+    Read a dataset lazily, by memory-mapping the underlying file. This is
+    possible only for contiguous, uncompressed datasets with the same layout
+    on disk and in memory; otherwise the dataset is read in memory.
+
+    :param dset: an h5py dataset
+    :returns: a copy-on-write array, changes are not saved on the file
+    """
+    offset = dset.id.get_offset()
+    if (offset is None or dset.chunks or dset.file.driver != 'sec2' or
+            dset.id.get_type().get_size() != dset.dtype.itemsize):
+        return dset[()]
+    if dset.file.mode == 'r+':
+        dset.file.flush()  # make sure the data are on disk
+    mm = numpy.memmap(dset.file.filename, dset.dtype, 'c', offset, dset.shape)
+    return mm.view(numpy.ndarray)  # pickled as a regular array
+
+
 class LiteralAttrs(object):
     """
     A class to serialize a set of parameters in HDF5 format. The goal is to
@@ -715,7 +753,7 @@ def _read_csv(fileobj, compositedt):
 def read_csv(fname, dtypedict={None: float}, renamedict={}, sep=',',
              index=None):
     """
-    :param fname: a CSV file with an header and float fields
+    :param fname: a CSV file with an header and float fields (or file object)
     :param dtypedict: a dictionary fieldname -> dtype, None -> default
     :param renamedict: aliases for the fields to rename
     :param sep: separator (default comma)
@@ -723,7 +761,11 @@ def read_csv(fname, dtypedict={None: float}, renamedict={}, sep=',',
     :returns: an ArrayWrapper, unless there is an index
     """
     attrs = {}
-    with open(fname, encoding='utf-8-sig') as f:
+    if hasattr(fname, 'read'):  # already open
+        fileobj, fname = fname, getattr(fname, 'name', fname)
+    else:
+        fileobj = open(fname, encoding='utf-8-sig')
+    with fileobj as f:
         while True:
             first = next(f)
             if first.startswith('#'):
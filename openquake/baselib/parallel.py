@@ -185,12 +185,19 @@ import re
 import ast
 import sys
 import time
+import shutil
+import queue
+import heapq
 import socket
 import signal
 import pickle
+import tempfile
+import numbers
 import inspect
 import logging
 import operator
+import itertools
+import threading
 import traceback
 import collections
 from unittest import mock
@@ -205,7 +212,7 @@ except ImportError:
     def setproctitle(title):
         "Do nothing"
 
-from openquake.baselib import config, hdf5, workerpool, version
+from openquake.baselib import config, hdf5, workerpool, version, zeromq
 from openquake.baselib.zeromq import zmq, Socket
 from openquake.baselib.performance import (
     Monitor, memory_rss, init_performance)
@@ -277,12 +284,24 @@ class Pickled(object):
     of the pickled bytestring.
 
     :param obj: the object to pickle
+    :param frames: if True, keep the big arrays out-of-band, so that they
+                   can be sent as separate zmq frames without copying them
+    :param shared: if given, a :class:`SharedArrays` instance where to
+                   store the big arrays
     """
-    def __init__(self, obj):
+    buffers = ()  # out-of-band buffers, if any
+
+    def __init__(self, obj, frames=False, shared=None):
         self.clsname = obj.__class__.__name__
         self.calc_id = str(getattr(obj, 'calc_id', ''))  # for monitors
         try:
-            self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            if shared is not None:
+                self.pik, *buffers = zeromq.dumps(obj)
+                self.buffers = [shared.share(buf) for buf in buffers]
+            elif frames:
+                self.pik, *self.buffers = zeromq.dumps(obj)
+            else:
+                self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
         except TypeError as exc:  # can't pickle, show the obj in the message
             raise TypeError('%s: %s' % (exc, obj))
 
@@ -292,11 +311,13 @@ class Pickled(object):
             self.clsname, self.calc_id, humansize(len(self)))
 
     def __len__(self):
-        """Length of the pickled bytestring"""
-        return len(self.pik)
+        """Length of the pickled bytestring plus the out-of-band buffers"""
+        return len(self.pik) + sum(buf.nbytes for buf in self.buffers)
 
     def unpickle(self):
         """Unpickle the underlying object"""
+        if self.buffers:
+            return zeromq.loads([self.pik] + self.buffers)
         return pickle.loads(self.pik)
 
 
@@ -322,7 +343,7 @@ def get_pickled_sizes(obj):
         sizes, key=lambda pair: pair[1], reverse=True)
 
 
-def pickle_sequence(objects):
+def pickle_sequence(objects, shared=None):
     """
     Convert an iterable of objects into a list of pickled objects.
     If the iterable contains copies, the pickling will be done only once.
@@ -330,6 +351,7 @@ def pickle_sequence(objects):
     pickled again.
 
     :param objects: a sequence of objects to pickle
+    :param shared: if given, a :class:`SharedArrays` instance
     """
     cache = {}
     out = []
@@ -339,11 +361,99 @@ def pickle_sequence(objects):
             if isinstance(obj, Pickled):  # already pickled
                 cache[obj_id] = obj
             else:  # pickle the object
-                cache[obj_id] = Pickled(obj)
+                cache[obj_id] = Pickled(obj, shared=shared)
         out.append(cache[obj_id])
     return out
 
 
+def _memmap(fname):
+    # a copy-on-write view over the array stored in the .npy file
+    return numpy.load(fname, mmap_mode='c').view(numpy.ndarray)
+
+
+class SharedArray(object):
+    """
+    Lightweight handle to an array stored by :class:`SharedArrays`;
+    when unpickled, it becomes a memory-mapped array.
+    """
+    nbytes = 0  # only the file name is sent
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def __reduce__(self):
+        return _memmap, (self.fname,)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.fname)
+
+
+class SharedArrays(object):
+    """
+    Store the big arrays passed to the tasks in .npy files in shared memory
+    (/dev/shm, if available) so that the workers can memory-map them
+    instead of receiving a pickled copy. Each array is stored once, even if
+    it is passed to many tasks; the files are reference-counted and removed
+    when the last task using them ends.
+    """
+    def __init__(self):
+        shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        self.dirname = tempfile.mkdtemp(prefix='oq-shared-', dir=shm)
+        self.arrays = {}  # id(array) -> (array, fname)
+        self.refs = collections.Counter()  # fname -> number of tasks
+        self.taskfiles = {}  # task_no -> fnames
+        self.fnames = []  # fnames used by the task being pickled
+        self.nfiles = 0
+        self.nbytes = 0
+
+    def share(self, array):
+        """
+        :param array: an array to share
+        :returns: a :class:`SharedArray` instance
+        """
+        try:
+            _, fname = self.arrays[id(array)]
+        except KeyError:
+            fname = os.path.join(self.dirname, '%d.npy' % self.nfiles)
+            numpy.save(fname, array)
+            self.nfiles += 1
+            self.arrays[id(array)] = array, fname
+            self.nbytes += array.nbytes
+        if fname not in self.fnames:
+            self.fnames.append(fname)
+        return SharedArray(fname)
+
+    def register(self, task_no):
+        """
+        Increase the reference counts of the files used by the given task
+        """
+        self.taskfiles[task_no] = self.fnames
+        for fname in self.fnames:
+            self.refs[fname] += 1
+        self.fnames = []
+
+    def release(self, task_no):
+        """
+        Decrease the reference counts of the files used by the given task
+        and remove the files not used anymore
+        """
+        for fname in self.taskfiles.pop(task_no, ()):
+            self.refs[fname] -= 1
+            if self.refs[fname] == 0:
+                os.remove(fname)
+                del self.refs[fname]
+                for key, (_, fn) in list(self.arrays.items()):
+                    if fn == fname:
+                        del self.arrays[key]
+
+    def close(self):
+        """
+        Remove all the files
+        """
+        shutil.rmtree(self.dirname, ignore_errors=True)
+        self.arrays.clear()
+
+
 class FakePickle:
     def __init__(self, sentbytes):
         self.sentbytes = sentbytes
@@ -366,17 +476,18 @@ class Result(object):
 
     def __init__(self, val, mon, tb_str='', msg=''):
         if isinstance(val, dict):
-            self.pik = Pickled(val)
+            self.pik = Pickled(val, frames=True)
             self.nbytes = {k: len(Pickled(v)) for k, v in val.items()}
         elif isinstance(val, tuple) and callable(val[0]):
             self.func = val[0]
+            self.weight = get_weight(val[1])
             self.pik = pickle_sequence(val[1:])
             self.nbytes = {'args': sum(len(p) for p in self.pik)}
         elif msg == 'TASK_ENDED':
             self.pik = Pickled(None)
             self.nbytes = {}
         else:
-            self.pik = Pickled(val)
+            self.pik = Pickled(val, frames=True)
             self.nbytes = {'tot': len(self.pik)}
         self.mon = mon
         self.tb_str = tb_str
@@ -473,7 +584,8 @@ def safely_call(func, args, task_no=0, mon=dummy_mon):
     if mon.inject:
         args += (mon,)
     sentbytes = 0
-    with Socket(mon.backurl, zmq.PUSH, 'connect') as zsocket:
+    compress = int(config.distribution.get('compress_min_size', '0'))
+    with Socket(mon.backurl, zmq.PUSH, 'connect', compress) as zsocket:
         msg = check_mem_usage()  # warn if too much memory is used
         if msg:
             zsocket.send(Result(None, mon, msg=msg))
@@ -524,6 +636,10 @@ class IterResult(object):
     :param hdf5path:
         a path where to store persistently the performance info
      """
+    # if positive, aggregate the results in a separate thread consuming
+    # a queue of that size, while the main thread receives and submits
+    agg_queue_size = config.distribution.get('agg_queue_size', 0)
+
     def __init__(self, iresults, taskname, argnames, sent, h5):
         self.iresults = iresults
         self.name = taskname
@@ -583,10 +699,59 @@ class IterResult(object):
     def reduce(self, agg=operator.add, acc=None):
         if acc is None:
             acc = AccumDict()
+        if self.agg_queue_size > 0 and self.iresults != ():
+            return self._reduce_threaded(agg, acc)
         for result in self:
             acc = agg(acc, result)
         return acc
 
+    def _reduce_threaded(self, agg, acc):
+        # the aggregation runs in a consumer thread, so that a slow agg
+        # function does not stop the main thread from submitting tasks
+        aggmon = Monitor('aggregating %s' % self.name)
+        q = queue.Queue(self.agg_queue_size)
+        out = dict(acc=acc, exc=None)
+
+        def consume():
+            while True:
+                result = q.get()
+                if result is StopIteration:
+                    break
+                elif out['exc'] is None:  # else discard the results
+                    try:
+                        with aggmon:
+                            out['acc'] = agg(out['acc'], result)
+                    except Exception as exc:
+                        out['exc'] = exc
+
+        thread = threading.Thread(target=consume)
+        thread.start()
+        depths = []
+        waiting = 0
+        try:
+            for result in self:
+                depths.append(q.qsize())
+                t0 = time.time()
+                q.put(result)  # blocks if the queue is full
+                waiting += time.time() - t0
+                if out['exc']:
+                    break
+        finally:
+            q.put(StopIteration)
+            thread.join()
+        if out['exc']:
+            raise out['exc']
+        if depths:
+            # the time is spent waiting for a free slot in the queue
+            logging.info('Aggregation queue depth: mean=%.1f, max=%d',
+                         numpy.mean(depths), max(depths))
+            qmon = Monitor('waiting for the aggregation queue')
+            qmon.duration = waiting
+            qmon.counts = len(depths)
+            qmon.flush(self.h5)
+            aggmon.flush(self.h5)
+        return out['acc']
+
     @classmethod
     def sum(cls, iresults):
         """
@@ -628,6 +793,71 @@ def getargnames(task_func):
         return inspect.getfullargspec(task_func.__call__).args[1:]
 
 
+def get_weight(arg0):
+    """
+    :returns: the numeric .weight attribute of arg0, or 1 if missing
+    """
+    weight = getattr(arg0, 'weight', 1)
+    return weight if isinstance(weight, numbers.Real) else 1
+
+
+class TaskQueue(object):
+    """
+    A queue of tasks returning the most expensive task first, i.e.
+    implementing a Longest Processing Time scheduling. The cost of a task
+    is its weight times the time per unit of weight learned from the
+    completed tasks of the same function. The subtasks generated by
+    :func:`split_task` have already a weight in seconds.
+
+    :param lpt: if False, return the tasks in FIFO order
+    """
+    def __init__(self, lpt=True):
+        self.lpt = lpt
+        self.heaps = {}  # (fname, subtask) -> [(-weight, idx, func, args)]
+        self.counter = itertools.count()
+        self.rates = AccumDict(accum=numpy.zeros(2))  # fname -> (dt, w)
+
+    def __len__(self):
+        return sum(len(heap) for heap in self.heaps.values())
+
+    def push(self, func, args, weight=1, subtask=False):
+        """
+        Add a task to the queue
+        """
+        item = (-weight if self.lpt else 0, next(self.counter), func, args)
+        heapq.heappush(self.heaps.setdefault(
+            (func.__name__, subtask), []), item)
+
+    def cost(self, fname, weight, subtask=False):
+        """
+        :returns: the estimated duration of a task (in arbitrary units)
+        """
+        if subtask or fname not in self.rates:
+            return weight
+        dt, w = self.rates[fname]
+        return weight * dt / w
+
+    def pop(self):
+        """
+        :returns: the triple (func, args, weight) of the costliest task
+        """
+        best = None
+        for key, heap in self.heaps.items():
+            if heap:  # the first element of the heap has the max weight
+                prio = self.cost(key[0], -heap[0][0], key[1]), -heap[0][1]
+                if best is None or prio > best[0]:
+                    best = prio, key
+        negweight, _, func, args = heapq.heappop(self.heaps[best[1]])
+        return func, args, -negweight, best[1][1]
+
+    def learn(self, fname, weight, duration):
+        """
+        Update the time per unit of weight of the given function
+        """
+        if weight > 0:
+            self.rates[fname] += numpy.array([duration, weight])
+
+
 class Starmap(object):
     pids = ()
     running_tasks = []  # currently running tasks
@@ -640,6 +870,10 @@ class Starmap(object):
         except AttributeError:
             num_cores = psutil.cpu_count()
     CT = num_cores * 2
+    # number of tasks per core submitted in advance
+    prefetch = int(config.distribution.get('prefetch_tasks', '1'))
+    # if true, pass the big arrays to the processpool via shared memory
+    shared_arrays = config.distribution.get('shared_arrays', 0)
 
     @classmethod
     def init(cls, distribute=None):
@@ -727,7 +961,8 @@ class Starmap(object):
         self.task_args = task_args
         self.progress = progress
         self.h5 = h5
-        self.task_queue = []
+        self.task_queue = TaskQueue(lpt=self.distribute != 'no')
+        self.task_weight = {}  # task_no -> (fname, weight)
         try:
             self.num_tasks = len(self.task_args)
         except TypeError:  # generators have no len
@@ -741,6 +976,7 @@ class Starmap(object):
         self.monitor.backurl = None  # overridden later
         self.tasks = []  # populated by .submit
         self.task_no = 0
+        self.shared = None  # SharedArrays instance, set by .submit
         self.t0 = time.time()
         if self.distribute in 'zmq dask celery':  # add a check
             errors = ['The workerpool on %s is down' % host
@@ -778,6 +1014,8 @@ class Starmap(object):
             monitor.backurl = 'tcp://%s:%s' % (
                 config.dbserver.host, self.socket.port)
             monitor.version = version
+            if self.shared_arrays and self.distribute == 'processpool':
+                self.shared = SharedArrays()
         OQ_TASK_NO = os.environ.get('OQ_TASK_NO')
         if OQ_TASK_NO is not None and self.task_no != int(OQ_TASK_NO):
             self.task_no += 1
@@ -787,7 +1025,7 @@ class Starmap(object):
             pickled = isinstance(args[0], Pickled)
             if not pickled:
                 assert not isinstance(args[-1], Monitor)  # sanity check
-                args = pickle_sequence(args)
+                args = pickle_sequence(args, self.shared)
             if func is None:
                 fname = self.task_func.__name__
                 argnames = self.argnames[:-1]
@@ -795,6 +1033,8 @@ class Starmap(object):
                 fname = func.__name__
                 argnames = getargnames(func)[:-1]
             self.sent[fname] += {a: len(p) for a, p in zip(argnames, args)}
+            if self.shared:
+                self.shared.register(self.task_no)
         res = submit[dist](self, func, args, monitor)
         self.task_no += 1
         self.tasks.append(res)
@@ -807,8 +1047,9 @@ class Starmap(object):
             for args in self.task_args:
                 self.submit(args)
         else:  # build a task queue in advance
-            self.task_queue = [(self.task_func, args)
-                               for args in self.task_args]
+            for args in self.task_args:
+                self.task_queue.push(
+                    self.task_func, args, get_weight(args[0]))
         return self.get_results()
 
     def get_results(self):
@@ -828,21 +1069,20 @@ class Starmap(object):
         return iter(self.submit_all())
 
     def _submit_many(self, howmany):
+        n = 0
         for _ in range(howmany):
             if self.task_queue:
-                # remove in LIFO order
-                func, args = self.task_queue[0]
-                del self.task_queue[0]
+                # remove the most expensive task
+                func, args, weight, subtask = self.task_queue.pop()
+                if not subtask:  # used to learn the cost per unit weight
+                    self.task_weight[self.task_no] = func.__name__, weight
                 self.submit(args, func=func)
-                self.todo += 1
+                n += 1
+        return n
 
     def _loop(self):
         self.busytime = AccumDict(accum=[])  # pid -> time
-        if self.task_queue:
-            first_args = self.task_queue[:self.num_cores]
-            self.task_queue[:] = self.task_queue[self.num_cores:]
-            for func, args in first_args:
-                self.submit(args, func=func)
+        self._submit_many(self.num_cores * self.prefetch)
         if not hasattr(self, 'socket'):  # no submit was ever made
             return ()
 
@@ -853,24 +1093,39 @@ class Starmap(object):
 
         isocket = iter(self.socket)
         self.todo = len(self.tasks)
-        while self.todo:
-            self.log_percent()
-            res = next(isocket)
-            if self.calc_id != res.mon.calc_id:
-                logging.warning('Discarding a result from job %s, since this '
-                                'is job %d', res.mon.calc_id, self.calc_id)
-            elif res.msg == 'TASK_ENDED':
-                self.busytime += {res.workerid: res.mon.duration}
-                self.todo -= 1
-                self._submit_many(1)
-                logging.debug('%d tasks running, %d in queue',
-                              self.todo, len(self.task_queue))
-                yield res
-            elif res.func:  # add subtask
-                self.task_queue.append((res.func, res.pik))
-                self._submit_many(1)
-            else:
-                yield res
+        try:
+            while self.todo:
+                self.log_percent()
+                res = next(isocket)
+                if self.calc_id != res.mon.calc_id:
+                    logging.warning(
+                        'Discarding a result from job %s, since this '
+                        'is job %d', res.mon.calc_id, self.calc_id)
+                elif res.msg == 'TASK_ENDED':
+                    self.busytime += {res.workerid: res.mon.duration}
+                    self.todo -= 1
+                    if res.mon.task_no in self.task_weight:
+                        self.task_queue.learn(
+                            *self.task_weight.pop(res.mon.task_no),
+                            res.mon.duration)
+                    self.todo += self._submit_many(1)
+                    if self.shared:  # after the submit, to reuse the files
+                        self.shared.release(res.mon.task_no)
+                    logging.debug('%d tasks running, %d in queue',
+                                  self.todo, len(self.task_queue))
+                    yield res
+                elif res.func:  # add subtask
+                    self.task_queue.push(res.func, res.pik, res.weight,
+                                         subtask=True)
+                    self.todo += self._submit_many(1)
+                else:
+                    yield res
+        finally:
+            if self.shared:
+                self.shared.close()
+                if self.shared.nbytes:
+                    logging.info('Shared %s in %d arrays', humansize(
+                        self.shared.nbytes), self.shared.nfiles)
         self.log_percent()
         self.socket.__exit__(None, None, None)
         self.tasks.clear()
@@ -927,6 +1182,25 @@ def split_task(func, *args, duration=1000,
         yield (func, block) + args[1:-1]
     yield func(*(blocks[-1],) + args[1:])
 
+
+def split_remaining(elements, remaining, duration, elapsed,
+                    weight=operator.attrgetter('weight')):
+    """
+    Split the elements that a task could not process in blocks which are
+    expected to run in less than the given duration; the speed is estimated
+    from the elements already processed.
+
+    :param elements: the elements sent to the task
+    :param remaining: the elements not processed
+    :param duration: the maximum duration of a task
+    :param elapsed: the time spent in processing the other elements
+    :returns: a list of WeightedSequences
+    """
+    rem = set(map(id, remaining))
+    done_weight = sum(weight(el) for el in elements if id(el) not in rem)
+    max_weight = max(done_weight * duration / elapsed, 1)
+    return list(block_splitter(remaining, max_weight, weight))
+
 #                             start/stop workers                             #
 
 
@@ -41,6 +41,13 @@ task_info_dt = numpy.dtype(
      ('weight', numpy.float32), ('duration', numpy.float32),
      ('received', numpy.int64), ('mem_gb', numpy.float32)])
 
+# per-process cache of the objects unpickled by Monitor.read, i.e.
+# a dictionary (calc_id, tmpfile, key) -> (mtime, object); the objects
+# are kept alive across the tasks of the same calculation and the cache
+# is cleared when another calculation is read or the memory is scarce
+_read_cache = {}
+READ_CACHE_MAX_MEM = 80  # percentage of used memory triggering eviction
+
 
 def init_performance(hdf5file, swmr=False):
     """
@@ -288,15 +295,33 @@ class Monitor(object):
 
     def read(self, key):
         """
+        Read an object from the _tmp.hdf5 file. Pickled objects are cached
+        in the worker process, so that they are unpickled only once per
+        calculation; the hits and misses of the cache are recorded in the
+        performance view with operations "reading <key> [cache hit]" and
+        "reading <key> [cache miss]" respectively.
+
         :param key: key in the _tmp.hdf5 file
         :return: unpickled object
         """
         tmp = self.filename[:-5] + '_tmp.hdf5'
+        ckey = (self.calc_id, tmp, key)
+        mtime = os.path.getmtime(tmp)
+        cached = _read_cache.get(ckey)
+        if cached and cached[0] == mtime:
+            with self('reading %s [cache hit]' % key, measuremem=False):
+                return cached[1]
+        if (psutil.virtual_memory().percent > READ_CACHE_MAX_MEM or
+                any(k[:2] != ckey[:2] for k in _read_cache)):
+            _read_cache.clear()
         with hdf5.File(tmp, 'r') as f:
             data = f[key][()]
-            if data.shape:
-                return data
-            return pickle.loads(data)
+        if data.shape:  # arrays are not cached, they could be mutated
+            return data
+        with self('reading %s [cache miss]' % key, measuremem=False):
+            obj = pickle.loads(data)
+        _read_cache[ckey] = (mtime, obj)
+        return obj
 
     def __repr__(self):
         calc_id = ' #%s ' % self.calc_id if self.calc_id else ' '
@@ -19,9 +19,10 @@
 import re
 import os
 import sys
-import unittest
+import unittest.mock
 import tempfile
 import numpy
+from openquake.baselib import hdf5, config
 from openquake.baselib.datastore import DataStore, read
 
 
@@ -61,6 +62,18 @@ class DataStoreTestCase(unittest.TestCase):
         self.dstore['a/b'] = 42
         self.assertTrue('a/b' in self.dstore)
 
+    def test_memmap(self):
+        dt = numpy.dtype([('id', 'S4'), ('tag', numpy.uint8),
+                          ('value', numpy.float32)])
+        arr = numpy.array([(b'a1', 1, 10.), (b'a2', 2, 20.)], dt)
+        self.dstore['arr'] = arr
+        mm = hdf5.memmap(self.dstore.getitem('arr'))
+        numpy.testing.assert_equal(mm, arr)
+        mm['tag'] = 0  # copy-on-write, the file is not changed
+        numpy.testing.assert_equal(self.dstore['arr']['tag'], [1, 2])
+        df = self.dstore.read_df('arr', fields=['value'])
+        self.assertEqual(list(df.columns), ['value'])
+
     def test_export_path(self):
         path = self.dstore.export_path('hello.txt', tempfile.mkdtemp())
         mo = re.search(r'hello_\d+', path)
@@ -150,3 +163,24 @@ class DataStoreTestCase(unittest.TestCase):
         df = self.dstore.read_df('test')
         numpy.testing.assert_equal(df['val_'].loc[0], [1])
         numpy.testing.assert_equal(df['val_'].loc[1], [2, 3])
+
+    def test_extend(self):
+        self.dstore.create_dframe('df', [('sid', numpy.uint32)], nrows=1000)
+        dset = self.dstore.hdf5['df/sid']
+        self.assertEqual(dset.chunks, (16384,))
+        self.dstore.extend('df/sid', numpy.arange(3), nbytes=12)
+        self.dstore.extend('df/sid', numpy.arange(3, 5))
+        self.assertEqual(len(dset), 0)  # still buffered
+
+        # reading the datagroup writes the buffered arrays
+        df = self.dstore.read_df('df')
+        self.assertEqual(list(df.sid), [0, 1, 2, 3, 4])
+        self.assertEqual(dset.attrs['nbytes'], 12)
+
+        # when the buffer_size is exceeded only full chunks are written
+        with unittest.mock.patch.dict(config.memory, buffer_size=100_000):
+            self.dstore.extend('df/sid', numpy.arange(40_000))
+        self.assertEqual(len(dset), 16384 * 2)
+        self.dstore.flush()
+        self.assertEqual(len(dset), 40_005)
+        self.assertEqual(self.dstore.buffers, {})
@@ -24,7 +24,8 @@ import unittest
 import itertools
 import tempfile
 import numpy
-from openquake.baselib import parallel, general, hdf5, workerpool, performance
+from openquake.baselib import (
+    parallel, general, hdf5, workerpool, performance, zeromq)
 
 try:
     import celery
@@ -58,6 +59,11 @@ def supertask(text, monitor):
             yield get_length, k * v
 
 
+def sum_slice(array, slc, monitor):
+    return {'tot': array[slc].sum(), 'shared': isinstance(array, numpy.ndarray)
+            and array.base is not None}
+
+
 def countletters(text1, text2, monitor):
     for block in general.block_splitter(text1 + text2, 5):
         yield get_length, ''.join(block)
@@ -139,6 +145,33 @@ class StarmapTestCase(unittest.TestCase):
             self.assertGreater(dic[b'supertask'], 0)
         shutil.rmtree(tmpdir)
 
+    def test_shared_arrays(self):
+        array = numpy.ones(1000000)
+        allargs = [(array, slice(i, i + 250000))
+                   for i in range(0, 1000000, 250000)]
+        with mock.patch.object(parallel.Starmap, 'shared_arrays', True):
+            smap = parallel.Starmap(sum_slice, allargs,
+                                    distribute='processpool')
+            res = list(smap)
+        self.assertEqual(sum(r['tot'] for r in res), 1000000)
+        self.assertTrue(all(r['shared'] for r in res))  # memory-mapped
+        self.assertEqual(smap.shared.nfiles, 1)  # stored once
+        self.assertFalse(os.path.exists(smap.shared.dirname))  # cleaned
+
+    def test_agg_thread(self):
+        tmpdir = tempfile.mkdtemp()
+        tmp = os.path.join(tmpdir, 'calc_1.hdf5')
+        performance.init_performance(tmp)
+        allargs = [('aaabb',), ('cc',), ('dddd',)]
+        with mock.patch.object(parallel.IterResult, 'agg_queue_size', 2), \
+                hdf5.File(tmp, 'a') as h5:
+            res = parallel.Starmap(get_length, allargs, h5=h5).reduce()
+            self.assertEqual(res, {'n': 11})
+            ops = set(h5['performance_data']['operation'])
+            self.assertIn(b'aggregating get_length', ops)
+            self.assertIn(b'waiting for the aggregation queue', ops)
+        shutil.rmtree(tmpdir)
+
     def test_countletters(self):
         data = [('hello', 'world'), ('ciao', 'mondo')]
         smap = parallel.Starmap(countletters, data)
@@ -149,6 +182,30 @@ class StarmapTestCase(unittest.TestCase):
         parallel.Starmap.shutdown()
 
 
+class TaskQueueTestCase(unittest.TestCase):
+    def test_lpt(self):
+        queue = parallel.TaskQueue()
+        for weight in [1, 5, 3]:
+            queue.push(get_length, ('x' * weight,), weight)
+        queue.push(gfunc, ('y',), 4)
+        weights = [queue.pop()[2] for _ in range(2)]
+        self.assertEqual(weights, [5, 4])  # costliest first
+
+        # get_length turns out to be 10 times slower than gfunc
+        queue.learn('get_length', 5, 50)
+        queue.learn('gfunc', 4, 4)
+        queue.push(gfunc, ('z',), 6)
+        weights = [queue.pop()[2] for _ in range(len(queue))]
+        self.assertEqual(weights, [3, 1, 6])
+
+    def test_fifo(self):
+        queue = parallel.TaskQueue(lpt=False)
+        for weight in [1, 5, 3]:
+            queue.push(get_length, (weight,), weight)
+        args = [queue.pop()[1] for _ in range(len(queue))]
+        self.assertEqual(args, [(1,), (5,), (3,)])
+
+
 class ThreadPoolTestCase(unittest.TestCase):
     def test(self):
         with mock.patch.dict(os.environ, {'OQ_DISTRIBUTE': 'threadpool'}):
@@ -162,6 +219,32 @@ class ThreadPoolTestCase(unittest.TestCase):
                 parallel.Starmap.shutdown()
 
 
+class FramesTestCase(unittest.TestCase):
+    def test_dumps_loads(self):
+        big = numpy.arange(100000, dtype=numpy.float32).reshape(1000, 100)
+        obj = {'big': big, 'small': numpy.arange(3), 'name': 'x'}
+        frames = zeromq.dumps(obj)
+        self.assertEqual(len(frames), 2)  # metadata + the big array
+        self.assertIs(frames[1], big)  # no copy
+        got = zeromq.loads(frames[:1] + [frames[1].tobytes()])
+        numpy.testing.assert_equal(got['big'], big)
+        self.assertEqual(got['name'], 'x')
+
+        # compression
+        frames = zeromq.dumps(obj, compress=1)
+        self.assertLess(len(frames[1]), big.nbytes)
+        got = zeromq.loads(frames)
+        numpy.testing.assert_equal(got['big'], big)
+        got['big'][0, 0] = 1  # the array is writeable
+
+    def test_result(self):
+        big = numpy.ones((2, 100000))
+        res = parallel.Result({'big': big.T}, performance.Monitor())
+        self.assertEqual(len(res.pik.buffers), 1)
+        self.assertGreater(len(res.pik), big.nbytes)
+        numpy.testing.assert_equal(res.get()['big'], big.T)
+
+
 def sum_chunk(slc, hdf5path):
     with hdf5.File(hdf5path, 'r') as f:
         return f['array'][slc].sum()
@@ -15,10 +15,13 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import os
 import time
 import unittest
+import tempfile
 import pickle
 import numpy
+from openquake.baselib import performance
 from openquake.baselib.performance import Monitor
 
 
@@ -60,3 +63,27 @@ class MonitorTestCase(unittest.TestCase):
 
     def test_pickleable(self):
         pickle.loads(pickle.dumps(self.mon))
+
+    def test_read_cache(self):
+        fname = tempfile.mktemp(suffix='.hdf5')
+        mon = Monitor('test_read_cache')
+        mon.filename = fname
+        mon.calc_id = 1
+        mon.save('obj', {'a': 1})
+        mon.save('arr', numpy.arange(3))
+        try:
+            obj1 = mon.read('obj')
+            obj2 = mon.read('obj')
+            self.assertIs(obj1, obj2)  # the object is cached
+            self.assertEqual(list(mon.read('arr')), [0, 1, 2])
+            counts = {child.operation: child.counts
+                      for child in mon.children}
+            self.assertEqual(counts, {'reading obj [cache miss]': 1,
+                                      'reading obj [cache hit]': 1})
+            mon.calc_id = 2  # a different calculation clears the cache
+            obj3 = mon.read('obj')
+            self.assertIsNot(obj3, obj1)
+            self.assertEqual(len(performance._read_cache), 1)
+        finally:
+            performance._read_cache.clear()
+            os.remove(fname[:-5] + '_tmp.hdf5')
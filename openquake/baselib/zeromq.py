@@ -15,13 +15,20 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import io
 import re
 import zmq
 import time
+import zlib
+import pickle
 import logging
+import numpy
 
 context = zmq.Context()
 
+# arrays bigger than this number of bytes are sent in separate frames
+FRAME_MIN_SIZE = 65536
+
 # from integer socket_type to string
 SOCKTYPE = {zmq.REQ: 'REQ', zmq.REP: 'REP',
             zmq.PUSH: 'PUSH', zmq.PULL: 'PULL',
@@ -56,6 +63,74 @@ def connect(end_point, socket_type):
     return sock
 
 
+class FramePickler(pickle.Pickler):
+    """
+    A pickler storing the big numeric arrays out-of-band in a list of
+    buffers, to be sent as separate zmq frames without copying them.
+
+    :param file: file object where to write the pickled metadata
+    :param buffers: list where to collect the buffers
+    :param compress: if positive, compress the buffers bigger than that
+    """
+    def __init__(self, file, buffers, compress=0):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.buffers = buffers
+        self.compress = compress
+
+    def persistent_id(self, obj):
+        if (type(obj) is numpy.ndarray and obj.nbytes >= FRAME_MIN_SIZE
+                and not obj.dtype.hasobject):
+            buf = numpy.ascontiguousarray(obj)
+            zipped = bool(self.compress) and buf.nbytes >= self.compress
+            if zipped:
+                buf = zlib.compress(buf, 1)
+            self.buffers.append(buf)
+            return len(self.buffers) - 1, obj.dtype, obj.shape, zipped
+
+
+class FrameUnpickler(pickle.Unpickler):
+    """
+    An unpickler rebuilding the arrays stored out-of-band by
+    :class:`FramePickler`. The arrays are views over the buffers, so
+    there is no copy, unless the buffers were compressed.
+
+    :param file: file object containing the pickled metadata
+    :param buffers: list of buffers (bytes, arrays or zmq frames)
+    """
+    def __init__(self, file, buffers):
+        super().__init__(file)
+        self.buffers = buffers
+
+    def persistent_load(self, pid):
+        idx, dtype, shape, zipped = pid
+        buf = self.buffers[idx]
+        if zipped:
+            buf = bytearray(zlib.decompress(buf))
+        elif isinstance(buf, numpy.ndarray):
+            return buf
+        return numpy.frombuffer(buf, dtype).reshape(shape)
+
+
+def dumps(obj, compress=0):
+    """
+    :param obj: object to serialize
+    :param compress: if positive, compress the buffers bigger than that
+    :returns: a list of frames, the pickled metadata followed by the buffers
+    """
+    buffers = []
+    f = io.BytesIO()
+    FramePickler(f, buffers, compress).dump(obj)
+    return [f.getvalue()] + buffers
+
+
+def loads(frames):
+    """
+    :param frames: a list of frames as returned by :func:`dumps`
+    :returns: the deserialized object
+    """
+    return FrameUnpickler(io.BytesIO(frames[0]), frames[1:]).load()
+
+
 class Socket(object):
     """
     A Socket class to be used with code like the following::
@@ -75,8 +150,13 @@ class Socket(object):
     :param socket_type: zmq socket type (integer)
     :param mode: default 'bind', accepts also 'connect'
     :param timeout: default 15000 ms, used when polling the underlying socket
+    :param compress: if positive, compress the array frames bigger than that
+
+    The objects are sent as multipart messages: the big arrays are sent
+    in separate frames without copying them (see :func:`dumps`).
     """
-    def __init__(self, end_point, socket_type, mode, timeout=15000):
+    def __init__(self, end_point, socket_type, mode, timeout=15000,
+                 compress=0):
         assert socket_type in (zmq.REP, zmq.REQ, zmq.PULL, zmq.PUSH)
         assert mode in ('bind', 'connect'), mode
         if mode == 'bind':
@@ -85,6 +165,7 @@ class Socket(object):
         self.socket_type = socket_type
         self.mode = mode
         self.timeout = timeout
+        self.compress = compress
         self.running = False
 
     def __enter__(self):
@@ -133,13 +214,19 @@ class Socket(object):
         while self.running:
             try:
                 if self.zsocket.poll(self.timeout):
-                    yield self.zsocket.recv_pyobj()
+                    yield self.recv()
                 elif self.socket_type == zmq.PULL:
                     logging.debug('Waiting on %s:%d', self, self.port)
             except zmq.ZMQError:
                 # sending SIGTERM raises ZMQError
                 break
 
+    def recv(self):
+        """
+        Receive a multipart message and return the underlying object
+        """
+        return loads(self.zsocket.recv_multipart(copy=False))
+
     def send(self, obj):
         """
         Send an object to the remote server; block and return the reply
@@ -149,13 +236,20 @@ class Socket(object):
             the Python object to send
         """
         try:
-            self.zsocket.send_pyobj(obj)
+            frames = dumps(obj, self.compress)
+            if len(frames) == 1:
+                self.zsocket.send(frames[0])
+            else:
+                # wait until zmq has released the buffers, so that the
+                # caller can safely modify the arrays after the send
+                self.zsocket.send_multipart(
+                    frames, copy=False, track=True).wait()
         except Exception as exc:
             # usual for objects bigger than 4 GB
             raise exc.__class__('%s: %r' % (exc, obj))
         self.num_sent += 1
         if self.socket_type == zmq.REQ:
-            return self.zsocket.recv_pyobj()
+            return self.recv()
 
     def __repr__(self):
         return '<%s %s %s>' % (self.__class__.__name__,
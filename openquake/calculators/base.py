@@ -32,6 +32,7 @@ from openquake.baselib import (
 from openquake.baselib import parallel
 from openquake.baselib.performance import Monitor, init_performance
 from openquake.hazardlib import InvalidFile, site, stats
+from openquake.hazardlib.geo import geodetic
 from openquake.hazardlib.site_amplification import Amplifier
 from openquake.hazardlib.site_amplification import AmplFunction
 from openquake.hazardlib.calc.filters import SourceFilter, getdefault
@@ -246,6 +247,7 @@ class BaseCalculator(metaclass=abc.ABCMeta):
                 if pre_execute:
                     self.pre_execute()
                 self.result = self.execute()
+                self.datastore.flush()  # write the buffered arrays
                 if self.result is not None:
                     self.post_execute(self.result)
                 self.export(kw.get('exports', ''))
@@ -374,6 +376,25 @@ def check_time_event(oqparam, occupancy_periods):
              ', '.join(occupancy_periods)))
 
 
+assoc_stats_dt = numpy.dtype([('max_distance', F32), ('mean_distance', F32),
+                              ('num_assoc', U32), ('num_discarded', U32)])
+
+
+def store_assoc_stats(dstore, kind, lons1, lats1, lons2, lats2,
+                      num_discarded=0):
+    """
+    Store the statistics about the distances (in km) of the associated
+    objects (assets or site model records) from the sites,
+    as `assoc_stats/<kind>`.
+    """
+    dists = geodetic.geodetic_distance(lons1, lats1, lons2, lats2)
+    if len(dists) == 0:
+        return
+    dstore['assoc_stats/' + kind] = numpy.array(
+        [(dists.max(), dists.mean(), len(dists), num_discarded)],
+        assoc_stats_dt)
+
+
 def check_amplification(ampl_df, sitecol):
     """
     Make sure the amplification codes in the site collection match the
@@ -635,6 +656,11 @@ class HazardCalculator(BaseCalculator):
                 readinput.get_sitecol_assetcol(
                     oq, haz_sitecol, self.crmodel.loss_types))
             self.datastore['sitecol'] = self.sitecol
+            sids = self.assetcol['site_id']
+            store_assoc_stats(
+                self.datastore, 'assets', self.assetcol['lon'],
+                self.assetcol['lat'], self.sitecol.complete.lons[sids],
+                self.sitecol.complete.lats[sids], len(discarded))
             if len(discarded):
                 self.datastore['discarded'] = discarded
                 if 'scenario' in oq.calculation_mode:
@@ -814,8 +840,11 @@ class HazardCalculator(BaseCalculator):
                 assoc_dist = (oq.region_grid_spacing * 1.414
                               if oq.region_grid_spacing else 5)  # Graeme's 5km
                 sm = readinput.get_site_model(oq)
-                self.sitecol.complete.assoc(sm, assoc_dist)
+                complete = self.sitecol.complete
+                sm = complete.assoc(sm, assoc_dist)
                 self.datastore['sitecol'] = self.sitecol
+                store_assoc_stats(self.datastore, 'site_model', complete.lons,
+                                  complete.lats, sm['lon'], sm['lat'])
 
         # store amplification functions if any
         self.af = None
@@ -1148,7 +1177,7 @@ def import_gmfs(dstore, oqparam, sids):
     return eids
 
 
-def create_gmf_data(dstore, M, sec_imts=(), data=None):
+def create_gmf_data(dstore, M, sec_imts=(), data=None, nrows=None):
     """
     Create and possibly populate the datasets in the gmf_data group
     """
@@ -1160,7 +1189,7 @@ def create_gmf_data(dstore, M, sec_imts=(), data=None):
         items.append((col, F32 if data is None else data[col]))
     for imt in sec_imts:
         items.append((str(imt), F32 if n == 0 else data[imt]))
-    dstore.create_dframe('gmf_data', items, 'gzip')
+    dstore.create_dframe('gmf_data', items, 'gzip', nrows)
     if data is not None:
         df = pandas.DataFrame(dict(items))
         avg_gmf = numpy.zeros((2, n, M + len(sec_imts)), F32)
@@ -16,7 +16,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import io
+import os
+import copy
+import json
+import hashlib
 import time
+import shutil
+import pickle
 import psutil
 import pprint
 import logging
@@ -26,8 +32,9 @@ try:
     from PIL import Image
 except ImportError:
     Image = None
-from openquake.baselib import parallel, hdf5, config
-from openquake.baselib.python3compat import encode
+from openquake.baselib import (
+    parallel, hdf5, config, datastore, __version__)
+from openquake.baselib.python3compat import encode, decode
 from openquake.baselib.general import (
     AccumDict, DictArray, block_splitter, groupby, humansize,
     get_nbytes_msg)
@@ -40,9 +47,11 @@ from openquake.hazardlib.calc.filters import split_source, SourceFilter
 from openquake.hazardlib.calc.hazard_curve import classical as hazclassical
 from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.commonlib import calc, util, readinput
+from openquake.commonlib.source_reader import get_checksum
 from openquake.calculators import getters
 from openquake.calculators import base
 
+U8 = numpy.uint8
 U16 = numpy.uint16
 U32 = numpy.uint32
 F32 = numpy.float32
@@ -61,6 +70,112 @@ def get_source_id(src):  # used in submit_tasks
     return src.source_id.split(':')[0]
 
 
+class CostModel(object):
+    """
+    Coefficients (seconds per unit of weight) per source typology and set
+    of GSIMs, fitted on the calc_times of the previous calculations and
+    stored in the file cost_model.json in the oqdata directory.
+
+    :param fname: path of the JSON file (default CostModel.fname)
+    """
+    fname = None  # if None, use cost_model.json in the oqdata directory
+
+    def __init__(self, fname=None):
+        self.fname = fname or self.fname or os.path.join(
+            datastore.get_datadir(), 'cost_model.json')
+        self.sums = self._read()  # key -> [tot_time, tot_weight]
+        tot = numpy.array(list(self.sums.values())).sum(axis=0)
+        # used for the unknown keys; 1 means using the weight as it is
+        self.mean_coeff = tot[0] / tot[1] if len(self.sums) else 1.
+
+    @staticmethod
+    def get_key(src, gsims):
+        """
+        :returns: a string code|gsim1 gsim2 ...
+        """
+        names = sorted(set(gsim.__class__.__name__ for gsim in gsims))
+        return '%s|%s' % (decode(src.code), ' '.join(names))
+
+    def predict(self, src, gsims):
+        """
+        :returns: the expected calculation time of the source in seconds
+        """
+        key = self.get_key(src, gsims)
+        if key in self.sums:
+            tot_time, tot_weight = self.sums[key]
+            return src.weight * tot_time / tot_weight
+        return src.weight * self.mean_coeff
+
+    def _read(self):
+        try:
+            with open(self.fname) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _lock(self, timeout=10):
+        # portable lock file containing a token identifying the owner;
+        # a lock older than the timeout is considered stale (left by a
+        # killed process) and taken over
+        lock = self.fname + '.lock'
+        token = '%d %s' % (os.getpid(), time.time())
+        while True:
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(lock)
+                except FileNotFoundError:  # just released
+                    continue
+                if age > timeout:
+                    logging.warning('Removing the stale lock %s', lock)
+                    try:
+                        os.remove(lock)
+                    except FileNotFoundError:  # removed by another process
+                        pass
+                else:
+                    time.sleep(.1)
+            else:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(token)
+                return lock, token
+
+    def _unlock(self, lock, token):
+        # remove the lock only if it is still owned by this process
+        try:
+            with open(lock) as f:
+                owned = f.read() == token
+        except FileNotFoundError:
+            return
+        if owned:
+            os.remove(lock)
+
+    def update(self, src_groups, gsims_by_grp, calc_times):
+        """
+        Update the coefficients with the calc_times of a calculation
+        and save them
+        """
+        weights = {}  # src.id -> [key, weight]; split sources share the id
+        for grp_id, sg in enumerate(src_groups):
+            for src in sg:
+                if src.id in calc_times and src.num_ruptures:
+                    key = self.get_key(src, gsims_by_grp[grp_id])
+                    weights.setdefault(src.id, [key, 0.])[1] += src.weight
+        lock, token = self._lock()
+        try:  # re-read the file, it may have been updated by other calcs
+            self.sums = self._read()
+            for src_id, (key, weight) in weights.items():
+                tot = self.sums.setdefault(key, [0., 0.])
+                tot[0] += float(calc_times[src_id][2])
+                tot[1] += float(weight)
+            tmp = self.fname + '.%d' % os.getpid()
+            with open(tmp, 'w') as f:
+                json.dump(self.sums, f)
+            os.replace(tmp, self.fname)  # atomic, readers see a full file
+        finally:
+            self._unlock(lock, token)
+
+
 def get_extreme_poe(array, imtls):
     """
     :param array: array of shape (L, G) with L=num_levels, G=num_gsims
@@ -141,15 +256,17 @@ def store_ctxs(dstore, rupdata, grp_id):
     rupdata['nsites'] = numpy.array([len(s) for s in rupdata['sids_']])
     rupdata['grp_id'] = numpy.repeat(grp_id, nr)
     nans = numpy.repeat(numpy.nan, nr)
-    for par in dstore['rup']:
+    # NB: dstore.hdf5 is used, since dstore['rup'] would write the buffers
+    for par in dstore.hdf5['rup']:
         n = 'rup/' + par
         if par.endswith('_'):
             if par in rupdata:
                 dstore.hdf5.save_vlen(n, rupdata[par])
             else:  # add nr empty rows
-                dstore[n].resize((len(dstore[n]) + nr,))
+                dset = dstore.hdf5[n]
+                dset.resize((len(dset) + nr,))
         else:
-            hdf5.extend(dstore[n], rupdata.get(par, nans))
+            dstore.extend(n, rupdata.get(par, nans))
 
 
 #  ########################### task functions ############################ #
@@ -212,12 +329,121 @@ def preclassical(srcs, srcfilter, params, monitor):
     return dic
 
 
+def compose(pmap, other, mutex):
+    """
+    Compose two probability maps of the same group, by summing them
+    in the case of mutually exclusive sources
+    """
+    if mutex:
+        pmap += other
+    else:
+        pmap |= other
+    return pmap
+
+
+def read_pmaps(fnames):
+    """
+    Read and remove the pickle files containing probability maps
+
+    :yields: pairs (ProbabilityMap, source IDs of the sources computed)
+    """
+    for fname in fnames:
+        with open(fname, 'rb') as f:
+            yield pickle.load(f)
+        os.remove(fname)
+
+
+def _claim_pmaps(dname, fanin):
+    # claim `fanin` pmap files by renaming them; the renaming is atomic,
+    # so a file cannot be claimed by two tasks running at the same time
+    claimed = []
+    for fname in os.listdir(dname):
+        if fname.endswith('.pik'):
+            path = os.path.join(dname, fname)
+            try:
+                os.rename(path, path + '.claimed')
+            except FileNotFoundError:  # already claimed
+                continue
+            claimed.append(path + '.claimed')
+            if len(claimed) == fanin:
+                return claimed
+    for path in claimed:  # not enough files, release them
+        os.rename(path, path[:-8])
+    return []
+
+
+def store_pmap(dic, params, mutex, monitor):
+    """
+    Store the pmap in `params['pmaps_dir']`, to be composed with the
+    ones stored by the other tasks of the same group.
+
+    :returns: an empty list or a combine_pmaps subtask in a list
+    """
+    extra = dic['extra']
+    dname = os.path.join(params['pmaps_dir'], str(extra['grp_id']))
+    os.makedirs(dname, exist_ok=True)
+    fname = os.path.join(dname, '%d.pik' % monitor.task_no)
+    with open(fname + '.tmp', 'wb') as f:
+        pickle.dump((dic['pmap'], extra['done']), f, pickle.HIGHEST_PROTOCOL)
+    os.rename(fname + '.tmp', fname)  # make it visible atomically
+    dic['pmap'] = {}
+    extra['done'] = []  # the sources will be in the combined pmap
+    fnames = _claim_pmaps(dname, params['reduction_fanin'])
+    if fnames:
+        return [(combine_pmaps, fnames, extra.copy(), mutex)]
+    return []
+
+
+def combine_pmaps(fnames, extra, mutex, monitor):
+    """
+    Compose the probability maps stored by tasks of the same group
+
+    :returns: a dictionary with keys pmap, calc_times, rup_data, extra
+    """
+    with monitor('combining pmaps'):
+        pmaps = read_pmaps(fnames)
+        pmap, done = next(pmaps)
+        for other, srcids in pmaps:
+            pmap = compose(pmap, other, mutex)
+            done.extend(srcids)
+    extra['task_no'] = monitor.task_no
+    extra['done'] = done
+    return dict(pmap=pmap, calc_times={}, rup_data={}, extra=extra)
+
+
 def classical(srcs, rlzs_by_gsim, params, monitor):
     """
-    Read the SourceFilter and call the classical calculator in hazardlib
+    Read the SourceFilter and call the classical calculator in hazardlib.
+    If the parameter `task_duration` is exceeded, yield the partial
+    result and then the unprocessed sources as subtasks. If
+    `params['pmaps_dir']` is set, the pmap is not sent to the master but
+    stored, to be composed with others in a combine_pmaps subtask.
     """
     srcfilter = monitor.read('srcfilter')
-    return hazclassical(srcs, srcfilter, rlzs_by_gsim, params, monitor)
+    t0 = time.time()
+    dic = hazclassical(srcs, srcfilter, rlzs_by_gsim, params, monitor)
+    subtasks = []
+    remaining = dic['extra'].pop('remaining')
+    rem = set(map(id, remaining))
+    # the sources computed, used when checkpointing
+    dic['extra']['done'] = [
+        src.source_id for src in srcs if id(src) not in rem]
+    if remaining:
+        blocks = parallel.split_remaining(
+            srcs, remaining, params['task_duration'], time.time() - t0)
+        for block in blocks:
+            if isinstance(srcs, SourceGroup):  # keep the group attributes
+                grp = copy.copy(srcs)
+                grp.sources = block
+                block = grp
+            subtasks.append((classical, block, rlzs_by_gsim, params))
+    if params.get('pmaps_dir') and dic['pmap']:
+        mutex = getattr(srcs, 'src_interdep', None) == 'mutex'
+        subtasks.extend(store_pmap(dic, params, mutex, monitor))
+    # the master must wait for the subtasks before saving the group
+    dic['extra']['num_subtasks'] = len(subtasks)
+    yield dic
+    yield from subtasks
 
 
 class Hazard:
@@ -272,6 +498,258 @@ class Hazard:
                 sorted(self.data), grp_extreme_dt)
 
 
+class Checkpoint(object):
+    """
+    Helper class saving periodically the partial probability maps in the
+    _poes dataset, together with the IDs of the sources already computed,
+    so that a failed calculation can be resumed with `oq engine --resume`.
+
+    :param haz: a :class:`Hazard` instance
+    :param src_groups: the source groups of the calculation
+    :param interval: the minimum number of seconds between two checkpoints
+    """
+    # values of checkpoint/grp_status; 0 means nothing saved
+    PARTIAL, COMPLETE, INVALID = 1, 2, 3
+
+    def __init__(self, haz, src_groups, interval):
+        self.haz = haz
+        self.src_groups = src_groups
+        self.interval = interval
+        self.t0 = time.time()
+        self.done = AccumDict(accum=set())  # grp_id -> source IDs
+        # (grp_id, source_id) -> index in checkpoint/done_src; NB: the
+        # split sources have the same .id but different .source_id
+        self.index = {}
+        self.nsrcs = 0
+        for grp_id, sg in enumerate(src_groups):
+            for src in sg:
+                self.index[grp_id, src.source_id] = self.nsrcs
+                self.nsrcs += 1
+        self.completed = set()  # grp_ids
+
+    def complete(self, grp_id):
+        """
+        Mark the given group as complete
+        """
+        self.haz.datastore['checkpoint/grp_status'][grp_id] = self.COMPLETE
+        self.haz.datastore.flush()
+        self.done.pop(grp_id, None)
+        self.completed.add(grp_id)
+
+    def store(self, grp_id, pmap):
+        """
+        Store the pmap of a complete group in the _poes dataset and mark
+        the group as complete; the group is invalid while it is being
+        written, so that it is recomputed if the calculation dies
+        """
+        self.haz.datastore['checkpoint/grp_status'][grp_id] = self.INVALID
+        self.haz.datastore.flush()
+        if pmap:
+            self.haz.store_poes(grp_id, pmap)
+        self.complete(grp_id)
+
+    def save(self, pmaps):
+        """
+        Save the partial pmaps if more than `interval` seconds passed
+        since the last checkpoint
+        """
+        if not self.interval or time.time() - self.t0 < self.interval:
+            return
+        dstore = self.haz.datastore
+        status = dstore['checkpoint/grp_status']
+        done = dstore['checkpoint/done_src']
+        for grp_id, pmap in pmaps.items():
+            if not isinstance(grp_id, (int, numpy.integer)):
+                continue
+            # a group is invalid while it is being written, so that
+            # it is ignored if the calculation dies in the middle
+            status[grp_id] = self.INVALID
+            dstore.flush()
+            arr = numpy.array([pmap[sid].array for sid in pmap])
+            dstore['_poes'][self.haz.slice_by_g[grp_id]] = arr.transpose(
+                2, 0, 1)
+            idxs = sorted(self.index[grp_id, srcid]
+                          for srcid in self.done[grp_id])
+            if idxs:
+                done[idxs] = 1
+            dstore.flush()
+            status[grp_id] = self.PARTIAL
+        dstore.flush()
+        self.t0 = time.time()
+
+    def resume(self, calc_id):
+        """
+        Read the checkpoint of the given calculation and store the
+        complete groups; the source IDs of the sources already computed
+        in the partial groups are added to .done.
+
+        :returns: the partial pmaps, a dictionary grp_id -> ProbabilityMap
+        """
+        with util.read(calc_id) as parent:
+            if 'checkpoint' not in parent:
+                raise RuntimeError('The calculation %d has no checkpoint'
+                                   % calc_id)
+            status = parent['checkpoint/grp_status'][:]
+            done = parent['checkpoint/done_src'][:]
+            if (len(status) != len(self.src_groups) or
+                    len(done) != self.nsrcs):
+                raise RuntimeError('The calculation %d has a different '
+                                   'source model' % calc_id)
+            pmaps = {}
+            for grp_id in numpy.where(status)[0]:
+                if status[grp_id] == self.INVALID:
+                    continue
+                arr = parent['_poes'][self.haz.slice_by_g[grp_id]]
+                self.haz.init(pmaps, grp_id)
+                for i, sid in enumerate(self.haz.sids):
+                    pmaps[grp_id][sid].array[:] = arr[:, i].T
+                if status[grp_id] == self.COMPLETE:
+                    self.store(grp_id, pmaps.pop(grp_id))
+                else:
+                    self.done[grp_id].update(
+                        src.source_id for src in self.src_groups[grp_id]
+                        if done[self.index[grp_id, src.source_id]])
+        logging.info('Resuming the calculation %d: %d complete groups, '
+                     '%d partial groups', calc_id,
+                     (status == self.COMPLETE).sum(), len(pmaps))
+        return pmaps
+
+    def todo(self, grp_id, sg):
+        """
+        :returns: None if the group is complete, otherwise the group
+                  without the sources already computed
+        """
+        if grp_id in self.completed:
+            return
+        done = self.done.get(grp_id)
+        if done:
+            sg = copy.copy(sg)
+            sg.sources = [src for src in sg if src.source_id not in done]
+        return sg
+
+
+class PmapCache(object):
+    """
+    Directory-based cache of the probability maps of the source groups,
+    shared across calculations. The keys are built from the checksums
+    of the sources, the GSIMs, the site collection and the parameters
+    affecting the hazard curves, so that a group is recomputed only if
+    something relevant changed. When the size of the directory exceeds
+    `maxsize` the least recently used entries are removed.
+
+    :param dirname: the cache directory
+    :param maxsize: the maximum size of the cache in bytes
+    :param haz: a :class:`Hazard` instance
+    :param oq: an OqParam instance
+    :param sitecol: the site collection of the calculation
+    """
+    # parameters affecting the pmaps, apart from the sources and gsims
+    params = ('truncation_level', 'maximum_distance', 'pointsource_distance',
+              'investigation_time', 'minimum_intensity', 'minimum_magnitude',
+              'ps_grid_spacing', 'shift_hypo', 'collapse_level',
+              'split_sources', 'inputs.reqv', 'inputs.amplification')
+
+    def __init__(self, dirname, maxsize, haz, oq, sitecol):
+        self.dirname = dirname
+        self.maxsize = maxsize
+        self.haz = haz
+        os.makedirs(dirname, exist_ok=True)
+        self.evict()  # in case maxsize was reduced
+        common = [__version__, sorted(oq.imtls.items()),
+                  sitecol.array.tobytes()]
+        for par in self.params:
+            if par.startswith('inputs.'):  # hash the content of the file(s)
+                fnames = oq.inputs.get(par[7:], {})
+                if isinstance(fnames, str):
+                    fnames = {'': fnames}
+                for key, fname in sorted(fnames.items()):
+                    with open(fname, 'rb') as f:
+                        common.append((key, f.read()))
+            else:
+                common.append(repr(getattr(oq, par)))
+        self.common = pickle.dumps(common, protocol=4)
+        self.keys = {}  # grp_id -> key
+        self.cached = set()  # grp_ids read from the cache
+
+    def key(self, grp_id, sg):
+        """
+        :returns: the key of the given group
+        """
+        # NB: the checksums are computed here, so that reading the sources
+        # is not slowed down when the cache is disabled
+        checksums = [(src.source_id, get_checksum(src)) for src in sg]
+        attrs = [getattr(sg, attr, None) for attr in (
+            'src_interdep', 'rup_interdep', 'grp_probability', 'cluster')]
+        gsims = list(map(repr, self.haz.rlzs_by_gsim_list[grp_id]))
+        hash_ = hashlib.sha1(self.common)
+        hash_.update(pickle.dumps([checksums, attrs, gsims], protocol=4))
+        self.keys[grp_id] = key = hash_.hexdigest()
+        return key
+
+    def get(self, grp_id, sg):
+        """
+        :returns: the cached pmap of the group (possibly empty) or None
+        """
+        key = self.key(grp_id, sg)
+        fname = os.path.join(self.dirname, key + '.npy')
+        try:
+            arr = numpy.load(fname)
+            os.utime(fname)  # mark the entry as recently used
+        except (FileNotFoundError, ValueError):  # missing or truncated
+            return
+        if not len(arr):  # the group does not affect the sites
+            self.cached.add(grp_id)
+            return {}
+        pmap = {}
+        self.haz.init(pmap, grp_id)
+        pmap = pmap[grp_id]
+        if arr.shape != (len(pmap),) + pmap[self.haz.sids[0]].array.shape:
+            return
+        for i, sid in enumerate(self.haz.sids):
+            pmap[sid].array[:] = arr[i]
+        self.cached.add(grp_id)
+        return pmap
+
+    def put(self, grp_id, pmap):
+        """
+        Store the pmap of the given group (if cacheable) and evict the
+        least recently used entries if the cache is too big
+        """
+        key = self.keys.get(grp_id)
+        if key is None:
+            return
+        arr = numpy.array([pmap[sid].array for sid in pmap])
+        fname = os.path.join(self.dirname, key + '.npy')
+        tmp = '%s.%d.tmp' % (fname, os.getpid())
+        with open(tmp, 'wb') as f:
+            numpy.save(f, arr)
+        os.rename(tmp, fname)  # make it visible atomically
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries exceeding the maximum size
+        """
+        entries = []
+        for fname in os.listdir(self.dirname):
+            if fname.endswith('.npy'):
+                path = os.path.join(self.dirname, fname)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:  # removed by another calculation
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        tot = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if tot <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            tot -= size
+
+
 @base.calculators.add('classical', 'preclassical', 'ucerf_classical')
 class ClassicalCalculator(base.HazardCalculator):
     """
@@ -307,27 +785,54 @@ class ClassicalCalculator(base.HazardCalculator):
             eff_rups, eff_sites, sorted(srcids))
         self.rel_ruptures[extra.pop('trt')] += eff_rups
         grp_id = extra['grp_id']
-        self.counts[grp_id] -= 1
+        # a task exceeding the task_duration sends its partial result
+        # before spawning the subtasks for the remaining sources
+        self.counts[grp_id] += extra.pop('num_subtasks', 0) - 1
         if self.oqparam.disagg_by_src:
             # store the poes for the given source
             pmap.grp_id = grp_id
             acc[extra['source_id'].split(':')[0]] = pmap
 
         self.maxradius = max(self.maxradius, extra.pop('maxradius'))
+        done = extra.pop('done')  # IDs of the sources in the pmap
+        # partial results of a mutex group are additive
+        mutex = self.csm.src_groups[grp_id].src_interdep == 'mutex'
         with self.monitor('aggregate curves'):
             if pmap:
                 self.haz.init(acc, grp_id)
-                acc[grp_id] |= pmap
+                acc[grp_id] = compose(acc[grp_id], pmap, mutex)
 
         # store rup_data if there are few sites
-        if self.few_sites and len(dic['rup_data']['src_id']):
+        if self.few_sites and len(dic['rup_data'].get('src_id', ())):
             with self.monitor('saving rup_data'):
                 store_ctxs(self.datastore, dic['rup_data'], grp_id)
 
+        if self.counts[grp_id] == 0 and self.params.get('pmaps_dir'):
+            # compose the pmaps stored by the tasks and not combined yet
+            dname = os.path.join(self.params['pmaps_dir'], str(grp_id))
+            if os.path.exists(dname):
+                fnames = [os.path.join(dname, fname)
+                          for fname in os.listdir(dname)
+                          if fname.endswith('.pik')]
+                with self.monitor('aggregate curves'):
+                    for pmap, srcids in read_pmaps(fnames):
+                        self.haz.init(acc, grp_id)
+                        acc[grp_id] = compose(acc[grp_id], pmap, mutex)
+                        done.extend(srcids)
+
         if self.counts[grp_id] == 0:
             with self.monitor('saving probability maps'):
-                if grp_id in acc:
-                    self.haz.store_poes(grp_id, acc.pop(grp_id))
+                pmap = acc.pop(grp_id, {})
+                if self.checkpoint:
+                    self.checkpoint.store(grp_id, pmap)
+                elif pmap:
+                    self.haz.store_poes(grp_id, pmap)
+                if self.pmap_cache:
+                    self.pmap_cache.put(grp_id, pmap)
+        elif self.checkpoint:
+            self.checkpoint.done[grp_id].update(done)
+            with self.monitor('saving checkpoint'):
+                self.checkpoint.save(acc)
         return acc
 
     def create_dsets(self):
@@ -362,7 +867,9 @@ class ClassicalCalculator(base.HazardCalculator):
                 else:
                     dt = F32
                 descr.append((param, dt))
-            self.datastore.create_dframe('rup', descr, 'gzip')
+            nrups = sum(src.num_ruptures for sg in self.csm.src_groups
+                        for src in sg)
+            self.datastore.create_dframe('rup', descr, 'gzip', nrows=nrups)
         self.by_task = {}  # task_no => src_ids
         self.maxradius = 0
         self.Ns = len(self.csm.source_info)
@@ -462,7 +969,19 @@ class ClassicalCalculator(base.HazardCalculator):
             self.datastore.swmr_on()  # fixes HDF5 error in build_hazard
             return
 
+        self.checkpoint = None
+        checkpointing = oq.checkpoint_interval or oq.resume_calc_id
+        if checkpointing and (oq.disagg_by_src or self.few_sites):
+            logging.warning('Checkpointing is not supported with '
+                            'disagg_by_src or few sites, ignoring it')
+            checkpointing = False
         self.create_dsets()  # create the rup/ datasets BEFORE swmr_on()
+        if checkpointing:
+            self.datastore.create_dset(
+                'checkpoint/grp_status', U8, (len(self.csm.src_groups),))
+            self.datastore.create_dset(
+                'checkpoint/done_src', U8,
+                (sum(len(sg) for sg in self.csm.src_groups),))
         grp_ids = numpy.arange(len(self.csm.src_groups))
         self.calc_times = AccumDict(accum=numpy.zeros(3, F32))
         weights = [rlz.weight for rlz in self.realizations]
@@ -471,17 +990,54 @@ class ClassicalCalculator(base.HazardCalculator):
         srcidx = {rec[0]: i for i, rec in enumerate(
             self.csm.source_info.values())}
         self.haz = Hazard(self.datastore, self.full_lt, pgetter, srcidx)
+        self.pmap_cache = None
+        if oq.pmap_cache_dir and (oq.disagg_by_src or self.few_sites or
+                                  oq.is_ucerf()):
+            # NB: the UCERF sources are read from an HDF5 file which is
+            # not part of the cache keys
+            logging.warning('The pmap cache is not supported with UCERF, '
+                            'disagg_by_src or few sites, ignoring it')
+        elif oq.pmap_cache_dir:
+            self.pmap_cache = PmapCache(
+                os.path.join(oq.input_dir,
+                             os.path.expanduser(oq.pmap_cache_dir)),
+                oq.pmap_cache_size * 1024 ** 2,
+                self.haz, oq, self.sitecol)
+        acc = {}  # grp_id -> partial pmaps from a previous run
+        if checkpointing:
+            self.checkpoint = Checkpoint(
+                self.haz, self.csm.src_groups, oq.checkpoint_interval)
+            if oq.resume_calc_id:
+                acc = self.checkpoint.resume(oq.resume_calc_id)
         blocks = list(block_splitter(grp_ids, self.groups_per_block))
-        for b, block in enumerate(blocks, 1):
-            args = self.get_args(block, self.haz)
-            logging.info('Sending %d tasks', len(args))
-            smap = parallel.Starmap(classical, args, h5=self.datastore.hdf5)
-            smap.monitor.save('srcfilter', self.src_filter())
-            self.datastore.swmr_on()
-            smap.h5 = self.datastore.hdf5
-            pmaps = smap.reduce(self.agg_dicts)
-            logging.debug("busy time: %s", smap.busytime)
-            self.haz.store_disagg(pmaps)
+        try:
+            for b, block in enumerate(blocks, 1):
+                args = self.get_args(block, self.haz)
+                logging.info('Sending %d tasks', len(args))
+                smap = parallel.Starmap(
+                    classical, args, h5=self.datastore.hdf5)
+                smap.monitor.save('srcfilter', self.src_filter())
+                self.datastore.swmr_on()
+                smap.h5 = self.datastore.hdf5
+                cached = self.pmap_cache.cached if self.pmap_cache else ()
+                pmaps = smap.reduce(self.agg_dicts, AccumDict({
+                    grp_id: acc.pop(grp_id) for grp_id in block
+                    if grp_id in acc and grp_id not in cached}))
+                logging.debug("busy time: %s", smap.busytime)
+                for grp_id in block:
+                    # resumed groups with nothing to compute
+                    if grp_id in pmaps and self.checkpoint:
+                        pmap = pmaps.pop(grp_id)
+                        self.checkpoint.store(grp_id, pmap)
+                        if self.pmap_cache:
+                            self.pmap_cache.put(grp_id, pmap)
+                self.haz.store_disagg(pmaps)
+        finally:  # remove the pickled pmaps even if the calculation fails
+            if 'pmaps_dir' in self.params:
+                shutil.rmtree(self.params['pmaps_dir'], ignore_errors=True)
+        if self.pmap_cache:
+            logging.info('Read %d group(s) from the pmap cache %s',
+                         len(self.pmap_cache.cached), self.pmap_cache.dirname)
         if not oq.hazard_calculation_id:
             self.haz.store_disagg()
         self.store_info(psd)
@@ -489,6 +1045,10 @@ class ClassicalCalculator(base.HazardCalculator):
 
     def store_info(self, psd):
         self.store_rlz_info(self.rel_ruptures)
+        if self.oqparam.use_cost_model and self.calc_times:
+            # fit the cost model on this calculation
+            CostModel().update(self.csm.src_groups,
+                               self.haz.rlzs_by_gsim_list, self.calc_times)
         source_ids = self.store_source_info(self.calc_times)
         if self.by_task:
             logging.info('Storing by_task information')
@@ -565,7 +1125,14 @@ class ClassicalCalculator(base.HazardCalculator):
             min_weight=oq.min_weight,
             collapse_level=oq.collapse_level, hint=hint,
             max_sites_disagg=oq.max_sites_disagg,
-            split_sources=oq.split_sources, af=self.af)
+            split_sources=oq.split_sources, af=self.af,
+            # disagg_by_src needs a single result per source
+            task_duration=None if oq.disagg_by_src else oq.task_duration)
+        if oq.reduction_fanin > 1 and not oq.disagg_by_src:
+            # directory where the tasks store the pmaps to combine
+            self.params['pmaps_dir'] = os.path.splitext(
+                self.datastore.filename)[0] + '_pmaps'
+            self.params['reduction_fanin'] = oq.reduction_fanin
         return psd
 
     def get_args(self, grp_ids, hazard):
@@ -576,26 +1143,51 @@ class ClassicalCalculator(base.HazardCalculator):
         allargs = []
         src_groups = self.csm.src_groups
         tot_weight = 0
+        min_weight = oq.min_weight
+        if oq.use_cost_model:  # the weights are the predicted times
+            model = CostModel()
+            min_weight *= model.mean_coeff
+            costs = {}  # src.id -> predicted time
+
+            def weight(src):
+                return costs[src.id]
+        else:
+            weight = get_weight
+        groups = {}  # grp_id -> group with the sources to compute
         for grp_id in grp_ids:
-            rlzs_by_gsim = hazard.rlzs_by_gsim_list[grp_id]
             sg = src_groups[grp_id]
+            pmap = self.pmap_cache.get(grp_id, sg) if self.pmap_cache else None
+            if pmap is not None:  # reuse the pmap of a previous calculation
+                if self.checkpoint:
+                    self.checkpoint.store(grp_id, pmap)
+                elif pmap:
+                    hazard.store_poes(grp_id, pmap)
+                continue
+            if self.checkpoint:  # discard the sources already computed
+                sg = self.checkpoint.todo(grp_id, sg)
+            if sg:
+                groups[grp_id] = sg
+        if not groups:  # everything was computed in a previous run
+            return allargs
+        for grp_id, sg in groups.items():
+            rlzs_by_gsim = hazard.rlzs_by_gsim_list[grp_id]
             for src in sg:
                 src.ngsims = len(rlzs_by_gsim)
-                tot_weight += src.weight
+                if oq.use_cost_model:
+                    costs[src.id] = model.predict(src, rlzs_by_gsim)
+                tot_weight += weight(src)
                 if src.code == b'C' and src.num_ruptures > 20_000:
                     msg = ('{} is suspiciously large, containing {:_d} '
                            'ruptures with complex_fault_mesh_spacing={} km')
                     spc = oq.complex_fault_mesh_spacing
                     logging.info(msg.format(src, src.num_ruptures, spc))
-        assert tot_weight
-        max_weight = max(tot_weight / self.ct, oq.min_weight)
+        max_weight = max(tot_weight / self.ct, min_weight)
         self.params['max_weight'] = max_weight
         logging.info('tot_weight={:_d}, max_weight={:_d}'.format(
             int(tot_weight), int(max_weight)))
         self.counts = AccumDict(accum=0)
-        for grp_id in grp_ids:
+        for grp_id, sg in groups.items():
             rlzs_by_gsim = hazard.rlzs_by_gsim_list[grp_id]
-            sg = src_groups[grp_id]
             if sg.atomic:
                 # do not split atomic groups
                 self.counts[grp_id] += 1
@@ -603,12 +1195,12 @@ class ClassicalCalculator(base.HazardCalculator):
             else:  # regroup the sources in blocks
                 blks = (groupby(sg, get_source_id).values() if oq.disagg_by_src
                         else block_splitter(
-                                sg, max_weight, get_weight, sort=True))
+                                sg, max_weight, weight, sort=True))
                 blocks = list(blks)
                 self.counts[grp_id] += len(blocks)
                 for block in blocks:
                     logging.debug('Sending %d source(s) with weight %d',
-                                  len(block), sum(src.weight for src in block))
+                                  len(block), sum(map(weight, block)))
                     allargs.append((block, rlzs_by_gsim, self.params))
         return allargs
 
@@ -35,21 +35,41 @@ def classical_damage(riskinputs, param, monitor):
         dictionary of extra parameters
     :param monitor:
         :class:`openquake.baselib.performance.Monitor` instance
-    :yields:
-        dictionaries asset_ordinal -> damage(R, L, D)
+    :returns:
+        a dictionary asset_ordinal -> damage(R, L, D)
     """
     crmodel = monitor.read('crmodel')
-    for ri in riskinputs:
-        R = ri.hazard_getter.num_rlzs
-        L = len(crmodel.lti)
-        D = len(crmodel.damage_states)
-        result = AccumDict(accum=numpy.zeros((R, L, D), F32))
-        for out in ri.gen_outputs(crmodel, monitor):
-            r = out.rlzi
-            for l, loss_type in enumerate(crmodel.loss_types):
-                for a, frac in zip(ri.assets['ordinal'], out[loss_type]):
-                    result[a][r, l] = frac
-        yield result
+    with monitor('getting hazard', measuremem=False):
+        # hazard curves of shape (N, R, H) for the N sites in the block
+        hcurves = numpy.array([
+            [pc.array[:, 0] for pc in ri.hazard_getter.get_hazard()]
+            for ri in riskinputs])
+    R = hcurves.shape[1]
+    L = len(crmodel.lti)
+    D = len(crmodel.damage_states)
+    assets = numpy.concatenate([ri.assets for ri in riskinputs])
+    # index of the site of each asset, in the range 0..N-1
+    sidx = numpy.repeat(numpy.arange(len(riskinputs)),
+                        [len(ri.assets) for ri in riskinputs])
+    result = AccumDict(accum=numpy.zeros((R, L, D), F32))
+    mon = monitor('computing risk', measuremem=False)
+    for li, loss_type in enumerate(crmodel.loss_types):
+        for taxo in numpy.unique(assets['taxonomy']):
+            idx, = numpy.where(assets['taxonomy'] == taxo)
+            rmodels, weights = crmodel.get_rmodels_weights(loss_type, taxo)
+            with mon:
+                # the fractions are computed once per site and realization
+                # and are shared by all the assets of the same taxonomy
+                sids, inv = numpy.unique(sidx[idx], return_inverse=True)
+                fracs = [rm.classical_fractions(loss_type, hcurves[sids][
+                    :, :, crmodel.imtls(rm.imt_by_lt[loss_type])])
+                         for rm in rmodels]
+                fracs = fracs[0] if len(fracs) == 1 else numpy.average(
+                    fracs, weights=weights, axis=0)  # shape (N, R, D)
+                damages = fracs[inv] * assets[idx]['number'][:, None, None]
+            for aid, dmg in zip(assets[idx]['ordinal'], damages):
+                result[aid][:, li] = dmg
+    return result
 
 
 @base.calculators.add('classical_damage')
@@ -16,8 +16,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import numpy
+from openquake.hazardlib import InvalidFile
 from openquake.hazardlib.stats import compute_stats
 from openquake.risklib import scientific
+from openquake.risklib.riskmodels import get_values
+from openquake.commonlib import readinput
 from openquake.calculators import base
 
 
@@ -39,34 +42,43 @@ def classical_risk(riskinputs, param, monitor):
     result = dict(loss_curves=[], stat_curves=[])
     weights = [w['default'] for w in param['weights']]
     statnames, stats = zip(*param['stats'])
-    for ri in riskinputs:
-        A = len(ri.assets)
-        L = len(crmodel.lti)
-        R = ri.hazard_getter.num_rlzs
-        loss_curves = numpy.zeros((R, L, A), object)
-        avg_losses = numpy.zeros((R, L, A))
-        for out in ri.gen_outputs(crmodel, monitor):
-            r = out.rlzi
-            for li, loss_type in enumerate(crmodel.loss_types):
-                # loss_curves has shape (A, C)
-                for i, asset in enumerate(ri.assets):
-                    loss_curves[out.rlzi, li, i] = lc = out[loss_type][i]
-                    aid = asset['ordinal']
-                    avg = scientific.average_loss(lc)
-                    avg_losses[r, li, i] = avg
-                    lcurve = (lc['loss'], lc['poe'], avg)
-                    result['loss_curves'].append((li, r, aid, lcurve))
-
-        # compute statistics
-        for li, loss_type in enumerate(crmodel.loss_types):
-            for i, asset in enumerate(ri.assets):
-                avg_stats = compute_stats(avg_losses[:, li, i], stats, weights)
-                losses = loss_curves[0, li, i]['loss']
-                all_poes = numpy.array(
-                    [loss_curves[r, li, i]['poe'] for r in range(R)])
-                poes_stats = compute_stats(all_poes, stats, weights)
+    with monitor('getting hazard', measuremem=False):
+        # hazard curves of shape (N, R, H) for the N sites in the block
+        hcurves = numpy.array([
+            [pc.array[:, 0] for pc in ri.hazard_getter.get_hazard()]
+            for ri in riskinputs])
+    R = hcurves.shape[1]
+    assets = numpy.concatenate([ri.assets for ri in riskinputs])
+    # index of the site of each asset, in the range 0..N-1
+    sidx = numpy.repeat(numpy.arange(len(riskinputs)),
+                        [len(ri.assets) for ri in riskinputs])
+    mon = monitor('computing risk', measuremem=False)
+    for li, loss_type in enumerate(crmodel.loss_types):
+        for taxo in numpy.unique(assets['taxonomy']):
+            idx, = numpy.where(assets['taxonomy'] == taxo)
+            [rm], _ = crmodel.get_rmodels_weights(loss_type, taxo)
+            imt = rm.imt_by_lt[loss_type]
+            with mon:
+                sids, inv = numpy.unique(sidx[idx], return_inverse=True)
+                # all the sites and realizations in a single matrix product
+                lratios, poes = rm.classical_poes(
+                    loss_type, hcurves[sids][:, :, crmodel.imtls(imt)])
+                poes = poes[inv]  # shape (A, R, C)
+                values = get_values(loss_type, assets[idx])
+                losses = numpy.array(lratios) * values[:, None]  # (A, C)
+                # average losses with the trapezoidal rule, shape (A, R)
+                avg = (poes[..., :-1] + poes[..., 1:]) / 2 @ numpy.diff(
+                    lratios) * values[:, None]
+                avg_stats = compute_stats(avg.T, stats, weights)  # (S, A)
+                poes_stats = compute_stats(
+                    poes.transpose(1, 0, 2), stats, weights)  # (S, A, C)
+            for i, aid in enumerate(assets[idx]['ordinal']):
+                if R > 1:
+                    for r in range(R):
+                        result['loss_curves'].append(
+                            (li, r, aid, (losses[i], poes[i, r], avg[i, r])))
                 result['stat_curves'].append(
-                    (li, asset['ordinal'], losses, poes_stats, avg_stats))
+                    (li, aid, losses[i], poes_stats[:, i], avg_stats[:, i]))
     if R == 1:  # the realization is the same as the mean
         del result['loss_curves']
     return result
@@ -87,6 +99,15 @@ class ClassicalRiskCalculator(base.RiskCalculator):
         """
         oq = self.oqparam
         super().pre_execute()
+        if 'taxonomy_mapping' in oq.inputs:
+            tmap = readinput.taxonomy_mapping(
+                oq, self.assetcol.tagcol.taxonomy)
+            for ln in oq.loss_names:
+                if any(len(items) > 1 for items in tmap[ln]):
+                    raise InvalidFile(
+                        '%s: multiple branches in the taxonomy mapping are '
+                        'not supported by classical_risk' %
+                        oq.inputs['taxonomy_mapping'])
         if '_poes' not in self.datastore:  # when building short report
             return
         full_lt = self.datastore['full_lt']
@@ -27,7 +27,7 @@ from openquake.baselib import datastore, hdf5, parallel, general
 from openquake.hazardlib import stats
 from openquake.risklib.scientific import AggLossTable, InsuredLosses
 from openquake.risklib.riskinput import (
-    cache_epsilons, get_assets_by_taxo, get_output)
+    get_epsgetter, get_assets_by_taxo, get_output)
 from openquake.commonlib import logs
 from openquake.calculators import base, event_based, getters
 from openquake.calculators.post_risk import PostRiskCalculator
@@ -56,29 +56,32 @@ def calc_risk(df, param, monitor):
     mon_agg = monitor('aggregating losses', measuremem=False)
     mon_avg = monitor('averaging losses', measuremem=False)
     dstore = datastore.read(param['hdf5path'])
+    haz_by_sid = {s: d for s, d in df.groupby('sid')}
     with monitor('getting assets'):
-        assets_df = dstore.read_df('assetcol/array', 'ordinal')
+        # read only the slice of assets on the sites affected by the GMFs
+        dset = hdf5.memmap(dstore['assetcol/array'])
+        offsets = dstore['assetcol/offsets'][()]
+        start = offsets[min(haz_by_sid)]
+        stop = offsets[max(haz_by_sid) + 1]
+        array = dset[start:stop]
     with monitor('getting crmodel'):
         crmodel = monitor.read('crmodel')
         weights = dstore['weights'][()]
     acc = dict(events_per_sid=0)
     alt = copy.copy(param['alt'])  # avoid issues with OQ_DISTRIBUTE=no
-    tempname = param['tempname']
+    epsgetter = param['epsgetter']
     aggby = param['aggregate_by']
     mal = param['minimum_asset_loss']
-    haz_by_sid = {s: d for s, d in df.groupby('sid')}
-    losses_by_A = numpy.zeros((len(assets_df), len(alt.loss_names)), F32)
+    losses_by_A = numpy.zeros((len(dset), len(alt.loss_names)), F32)
     acc['momenta'] = numpy.zeros((2, param['N'], param['M']))
-    for sid, asset_df in assets_df.groupby('site_id'):
-        try:
-            haz = haz_by_sid[sid]
-        except KeyError:  # no hazard here
+    for sid, haz in haz_by_sid.items():
+        assets = array[offsets[sid] - start:offsets[sid + 1] - start]
+        if len(assets) == 0:  # no assets here
             continue
         gmvs = haz[haz.columns[3:]].to_numpy()  # skip sid, eid, rlz
         with mon_risk:
-            assets = asset_df.to_records()  # fast
             acc['events_per_sid'] += len(haz)
-            assets_by_taxo = get_assets_by_taxo(assets, tempname)  # fast
+            assets_by_taxo = get_assets_by_taxo(assets, epsgetter)  # fast
             out = get_output(crmodel, assets_by_taxo, haz)  # slow
         with mon_agg:
             alt.aggregate(out, mal, aggby)
@@ -193,7 +196,8 @@ class EbriskCalculator(event_based.EventBasedCalculator):
         for name in oq.loss_names:
             descr.append((name, F32))
         self.datastore.create_dframe(
-            'agg_loss_table', descr, K=len(self.aggkey))
+            'agg_loss_table', descr, nrows=self.E * (len(self.aggkey) + 1),
+            K=len(self.aggkey))
         self.param.pop('oqparam', None)  # unneeded
         self.datastore.create_dset('avg_losses-stats', F32, (A, 1, L))
         self.datastore.set_shape_descr(
@@ -210,8 +214,7 @@ class EbriskCalculator(event_based.EventBasedCalculator):
         oq = self.oqparam
         self.set_param(
             hdf5path=self.datastore.filename,
-            tempname=cache_epsilons(
-                self.datastore, oq, self.assetcol, self.crmodel, self.E))
+            epsgetter=get_epsgetter(oq, self.crmodel))
         srcfilter = self.src_filter()
         logging.info(
             'Sending {:_d} ruptures'.format(len(self.datastore['ruptures'])))
@@ -244,8 +247,8 @@ class EbriskCalculator(event_based.EventBasedCalculator):
         with self.monitor('saving agg_loss_table'):
             df = dic['alt']
             for name in df.columns:
-                dset = self.datastore['agg_loss_table/' + name]
-                hdf5.extend(dset, df[name].to_numpy())
+                self.datastore.extend('agg_loss_table/' + name,
+                                      df[name].to_numpy())
         if self.oqparam.avg_losses:
             with self.monitor('saving avg_losses'):
                 self.datastore['avg_losses-stats'][:, 0] += dic['losses_by_A']
@@ -152,6 +152,7 @@ class EventBasedCalculator(base.HazardCalculator):
             logging.info('Sending %s', sg)
             par = self.param.copy()
             par['gsims'] = gsims_by_trt[sg.trt]
+            par['task_duration'] = self.oqparam.task_duration
             for src_group in sg.split(maxweight):
                 allargs.append((src_group, srcfilter, par))
         smap = parallel.Starmap(
@@ -203,16 +204,16 @@ class EventBasedCalculator(base.HazardCalculator):
                 times = result.pop('times')
                 rupids = list(times['rup_id'])
                 self.datastore['gmf_data/time_by_rup'][rupids] = times
-                hdf5.extend(self.datastore['gmf_data/sid'], df.sid.to_numpy())
-                hdf5.extend(self.datastore['gmf_data/eid'], df.eid.to_numpy())
+                self.datastore.extend('gmf_data/sid', df.sid.to_numpy())
+                self.datastore.extend('gmf_data/eid', df.eid.to_numpy())
                 for m in range(len(primary)):
-                    hdf5.extend(self.datastore[f'gmf_data/gmv_{m}'],
-                                df[f'gmv_{m}'])
+                    self.datastore.extend(f'gmf_data/gmv_{m}',
+                                          df[f'gmv_{m}'].to_numpy())
                 for sec_imt in sec_imts:
-                    hdf5.extend(self.datastore[f'gmf_data/{sec_imt}'],
-                                df[sec_imt])
+                    self.datastore.extend(f'gmf_data/{sec_imt}',
+                                          df[sec_imt].to_numpy())
                 sig_eps = result.pop('sig_eps')
-                hdf5.extend(self.datastore['gmf_data/sigma_epsilon'], sig_eps)
+                self.datastore.extend('gmf_data/sigma_epsilon', sig_eps)
                 self.offset += len(df)
         if self.offset >= TWO32:
             raise RuntimeError(
@@ -313,9 +314,11 @@ class EventBasedCalculator(base.HazardCalculator):
         if oq.ground_motion_fields:
             M = len(oq.get_primary_imtls())
             nrups = len(self.datastore['ruptures'])
-            base.create_gmf_data(self.datastore, M, oq.get_sec_imts())
+            # the gmf_data rows are at most E * N, used to size the chunks
+            base.create_gmf_data(self.datastore, M, oq.get_sec_imts(),
+                                 nrows=self.E * N)
             self.datastore.create_dset('gmf_data/sigma_epsilon',
-                                       sig_eps_dt(oq.imtls))
+                                       sig_eps_dt(oq.imtls), nrows=self.E)
             self.datastore.create_dset('gmf_data/events_by_sid', U32, (N,))
             self.datastore.create_dset('gmf_data/time_by_rup',
                                        time_dt, (nrups,), fillvalue=None)
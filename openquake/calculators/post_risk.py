@@ -18,8 +18,8 @@
 
 import os
 import logging
-import itertools
 import numpy
+import pandas
 
 from openquake.baselib import general, datastore, parallel, python3compat
 from openquake.hazardlib.stats import set_rlzs_stats
@@ -68,12 +68,58 @@ def reagg_idxs(num_tags, tagnames):
     """
     shape = list(num_tags.values())
     T = numpy.prod(shape)
-    arr = numpy.arange(T).reshape(shape)
-    ranges = [numpy.arange(n) if t in tagnames else [slice(None)]
-              for t, n in num_tags.items()]
-    for i, idx in enumerate(itertools.product(*ranges)):
-        arr[idx] = i
-    return arr.flatten()
+    # tag indices of each of the T combinations, then the index of the
+    # combination restricted to the selected tagnames
+    tagidxs = numpy.unravel_index(numpy.arange(T), shape)
+    dims = [d for d, t in enumerate(num_tags) if t in tagnames]
+    return numpy.ravel_multi_index(
+        [tagidxs[d] for d in dims], [shape[d] for d in dims])
+
+
+def get_reagg_idxs(num_tags, tagnames):
+    """
+    :param num_tags: dictionary tagname -> number of tags with that tagname
+    :param tagnames: subset of tagnames of interest
+    :returns: T + 1 indices, the last one for the total
+    """
+    idxs = reagg_idxs(num_tags, tagnames)
+    K = numpy.prod([n for t, n in num_tags.items() if t in tagnames])
+    return numpy.append(idxs, K).astype(U32)  # the total goes into the total
+
+
+def reagg_losses(dstore, idxs, loss_names, chunksize=1_000_000):
+    """
+    Reaggregate the agg_loss_table by reading it in chunks.
+    For each chunk the losses are summed by (event_id, agg_id) with a
+    bincount; the partial sums are then summed together. NB: the partial
+    sums of all the chunks are kept in memory, since the table is not
+    sorted by event, so the memory still grows with the number of
+    distinct (event_id, agg_id) pairs, like the returned DataFrame.
+
+    :param dstore: a DataStore with an agg_loss_table
+    :param idxs: an array mapping the fine agg_ids into the coarse agg_ids
+    :param loss_names: the names of the loss columns
+    :returns: a DataFrame with fields event_id, agg_id and the loss names
+    """
+    K1 = int(idxs.max()) + 1
+    N = len(dstore['agg_loss_table/event_id'])
+    keys = [numpy.zeros(0, numpy.int64)]
+    sums = [numpy.zeros((len(loss_names), 0))]
+    for start in range(0, N, chunksize):
+        slc = slice(start, start + chunksize)
+        eids = dstore['agg_loss_table/event_id'][slc].astype(numpy.int64)
+        kids = idxs[dstore['agg_loss_table/agg_id'][slc]]
+        ukeys, inv = numpy.unique(eids * K1 + kids, return_inverse=True)
+        keys.append(ukeys)
+        sums.append([numpy.bincount(
+            inv, dstore['agg_loss_table/' + ln][slc], len(ukeys))
+                     for ln in loss_names])
+    ukeys, inv = numpy.unique(numpy.concatenate(keys), return_inverse=True)
+    sums = numpy.concatenate(sums, axis=1)  # shape (L, n)
+    dic = {'event_id': U32(ukeys // K1), 'agg_id': U32(ukeys % K1)}
+    for ln, values in zip(loss_names, sums):
+        dic[ln] = F32(numpy.bincount(inv, values, len(ukeys)))
+    return pandas.DataFrame(dic)
 
 
 def get_loss_builder(dstore, return_periods=None, loss_dt=None):
@@ -114,14 +160,43 @@ def get_src_loss_table(dstore, L):
     return zip(*sorted(acc.items()))
 
 
-def post_risk(builder, kr_losses, monitor):
+def sort_losses(alt_df, loss_names, K, R, fname):
+    """
+    Store the losses in the event loss table sorted by (agg_id, rlz_id)
+    in a memory-mapped .npy file of shape (L, N).
+
+    :param alt_df: a DataFrame with fields agg_id, rlz_id and loss names
+    :param loss_names: a list of L loss names
+    :param K: the number of aggregation keys (agg_id=K is the total)
+    :param R: the number of realizations
+    :param fname: the path of the .npy file to create
+    :returns: an array of (K + 1) * R + 1 offsets, one per (agg_id, rlz_id)
     """
+    kr = alt_df.agg_id.to_numpy() * R + alt_df.rlz_id.to_numpy()
+    order = numpy.argsort(kr, kind='stable')
+    counts = numpy.bincount(kr, minlength=(K + 1) * R)
+    offsets = numpy.zeros(len(counts) + 1, int)
+    numpy.cumsum(counts, out=offsets[1:])
+    mm = numpy.lib.format.open_memmap(
+        fname, 'w+', F32, (len(loss_names), len(kr)))
+    for lni, ln in enumerate(loss_names):
+        mm[lni] = alt_df[ln].to_numpy()[order]
+    mm.flush()
+    return offsets
+
+
+def post_risk(builder, fname, krs, offsets, monitor):
+    """
+    :param builder: a LossCurvesMapsBuilder instance
+    :param fname: path to a .npy file with the sorted losses of shape (L, N)
+    :param krs: a list of S pairs (agg_id, rlz_id)
+    :param offsets: S + 1 offsets of contiguous nonempty segments
     :returns: dictionary kr -> L loss curves
     """
-    res = {}
-    for k, r, losses in kr_losses:
-        res[k, r] = builder.build_curves(losses, r)
-    return res
+    losses = numpy.load(fname, mmap_mode='r')[:, offsets[0]:offsets[-1]]
+    curves = builder.build_curves_segments(
+        losses, offsets - offsets[0], [r for k, r in krs])
+    return dict(zip(krs, curves))
 
 
 @base.calculators.add('post_risk')
@@ -173,43 +248,45 @@ class PostRiskCalculator(base.RiskCalculator):
         P = len(builder.return_periods)
         # do everything in process since it is really fast
         rlz_id = self.datastore['events']['rlz_id']
-        alt_df = self.datastore.read_df('agg_loss_table')
         if self.reaggreate:
-            idxs = numpy.concatenate([
-                reagg_idxs(self.num_tags, oq.aggregate_by),
-                numpy.array([K], int)])
-            alt_df['agg_id'] = idxs[alt_df['agg_id'].to_numpy()]
-            alt_df = alt_df.groupby(['event_id', 'agg_id']).sum().reset_index()
+            idxs = get_reagg_idxs(self.num_tags, oq.aggregate_by)
+            with self.monitor('reaggregating losses', measuremem=True):
+                alt_df = reagg_losses(self.datastore, idxs, oq.loss_names)
+        else:
+            alt_df = self.datastore.read_df('agg_loss_table')
         alt_df['rlz_id'] = rlz_id[alt_df.event_id.to_numpy()]
         units = self.datastore['cost_calculator'].get_units(oq.loss_names)
         dist = ('no' if os.environ.get('OQ_DISTRIBUTE') == 'no'
                 else 'processpool')  # use only the local cores
+        # the losses are sorted only once and shared with the workers via
+        # a memory-mapped file: the tasks receive only the group offsets
+        fname = general.gettemp(suffix='.npy')
+        with self.monitor('sorting losses', measuremem=True):
+            offsets = sort_losses(alt_df, oq.loss_names, K, self.R, fname)
+        del alt_df
+        losses = numpy.load(fname, mmap_mode='r')
+        agg_losses = numpy.zeros((K + 1, self.R, self.L), F32)
+        nonempty = offsets[:-1] < offsets[1:]
+        for lni in range(self.L):
+            # sum of the losses in each (agg_id, rlz_id) segment
+            sums = numpy.add.reduceat(losses[lni], offsets[:-1][nonempty])
+            agg_losses[:, :, lni].flat[nonempty] = sums
         smap = parallel.Starmap(post_risk, h5=self.datastore.hdf5,
                                 distribute=dist)
         # producing concurrent_tasks/2 = num_cores tasks
         blocksize = int(numpy.ceil(
             (K + 1) * self.R / (oq.concurrent_tasks // 2 or 1)))
-        kr_losses = []
-        agg_losses = numpy.zeros((K + 1, self.R, self.L), F32)
         agg_curves = numpy.zeros((K + 1, self.R, self.L, P), F32)
-        gb = alt_df.groupby([alt_df.agg_id, alt_df.rlz_id])
-        # NB: in the future we may use multiprocessing.shared_memory
-        for (k, r), df in gb:
-            arr = numpy.zeros((self.L, len(df)), F32)
-            for lni, ln in enumerate(oq.loss_names):
-                arr[lni] = df[ln].to_numpy()
-            agg_losses[k, r] = arr.sum(axis=1)
-            kr_losses.append((k, r, arr))
-            if len(kr_losses) >= blocksize:
-                size = sum(ls.nbytes for k, r, ls in kr_losses)
-                logging.info('Sending %s of losses',
-                             general.humansize(size))
-                smap.submit((builder, kr_losses))
-                kr_losses[:] = []
-        if kr_losses:
-            smap.submit((builder, kr_losses))
+        # the empty segments are discarded, the others are contiguous
+        krs = [divmod(kr, self.R) for kr in numpy.where(nonempty)[0]]
+        offs = numpy.append(offsets[:-1][nonempty], offsets[-1])
+        for i in range(0, len(krs), blocksize):
+            smap.submit((builder, fname, krs[i:i + blocksize],
+                         offs[i:i + blocksize + 1]))
         for (k, r), curve in smap.reduce().items():
             agg_curves[k, r] = curve
+        del losses
+        os.remove(fname)
         self.datastore['agg_losses-rlzs'] = agg_losses * oq.ses_ratio
         set_rlzs_stats(self.datastore, 'agg_losses',
                        agg_id=K + 1, loss_types=oq.loss_names, units=units)
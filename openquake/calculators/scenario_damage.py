@@ -27,6 +27,7 @@ U16 = numpy.uint16
 U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
+MAX_DMG_ROWS = 2 ** 20  # damage rows in a task before flushing them
 
 
 def floats_in(numbers):
@@ -39,16 +40,35 @@ def floats_in(numbers):
 
 def bin_ddd(fractions, n, seed):
     """
-    Converting fractions into discrete damage distributions using bincount
-    and numpy.random.choice
+    Converting fractions into discrete damage distributions by sampling
+    a multinomial distribution for all the events at once, as a sequence
+    of D - 1 conditional binomial distributions.
+
+    :param fractions: an array of shape (E, D)
+    :param n: the number of buildings
+    :param seed: the random seed, typically master_seed + asset ordinal
+    :returns: an array of shape (E, D) of integers summing up to n
+
+    >>> fractions = numpy.array([[.5, .3, .2], [1, 0, 0], [.1, .1, .8]])
+    >>> bin_ddd(fractions, 10, 42)
+    array([[ 4,  3,  3],
+           [10,  0,  0],
+           [ 1,  0,  9]], dtype=uint32)
     """
     n = int(n)
-    D = fractions.shape[1]  # shape (E, D)
-    ddd = numpy.zeros(fractions.shape, U32)
-    numpy.random.seed(seed)
-    for e, frac in enumerate(fractions):
-        ddd[e] = numpy.bincount(
-            numpy.random.choice(D, n, p=frac/frac.sum()), minlength=D)
+    E, D = fractions.shape
+    probs = fractions / fractions.sum(axis=1)[:, None]
+    ddd = numpy.zeros((E, D), U32)
+    rng = numpy.random.RandomState(seed)
+    left = numpy.full(E, n)  # buildings not assigned yet
+    pleft = numpy.ones(E)  # probability not assigned yet
+    for d in range(D - 1):
+        p = numpy.where(
+            pleft > 0, probs[:, d] / numpy.maximum(pleft, 1E-12), 1)
+        ddd[:, d] = rng.binomial(left, numpy.clip(p, 0, 1))
+        left -= ddd[:, d].astype(left.dtype)
+        pleft -= probs[:, d]
+    ddd[:, D - 1] = left
     return ddd
 
 
@@ -70,6 +90,55 @@ def run_sec_sims(damages, haz, sec_sims, seed):
         damages[:, d] = numpy.mean(affected * buildings, axis=0)  # shape E
 
 
+class DamageAccumulator(object):
+    """
+    Sparse columnar accumulator for the damage distributions: only the
+    rows (aid, eid, lid) with some damage are stored, in NumPy buffers
+    growing as needed.
+
+    :param dt: a list of fields aid, eid, lid, followed by the damage states
+    :param size: the initial number of rows
+    """
+    def __init__(self, dt, size=1024):
+        self.array = numpy.zeros(size, dt)
+        self.dsnames = self.array.dtype.names[3:]
+        self.nrows = 0
+
+    def add(self, aid, eids, lid, damages):
+        """
+        :param aid: asset ordinal
+        :param eids: E event IDs
+        :param lid: loss type index
+        :param damages: an array of shape (E, D)
+        """
+        dmg = damages[:, 1:]
+        ok = dmg.sum(axis=1) > 0
+        n = ok.sum()
+        if self.nrows + n > len(self.array):
+            newsize = max(2 * len(self.array), self.nrows + n)
+            array = numpy.zeros(newsize, self.array.dtype)
+            array[:self.nrows] = self.array[:self.nrows]
+            self.array = array
+        arr = self.array[self.nrows:self.nrows + n]
+        arr['aid'] = aid
+        arr['eid'] = eids[ok]
+        arr['lid'] = lid
+        for d, dsname in enumerate(self.dsnames):
+            arr[dsname] = dmg[ok, d]
+        self.nrows += n
+
+    def flush(self):
+        """
+        :returns: the accumulated rows, emptying the accumulator
+        """
+        arr = self.array[:self.nrows].copy()
+        self.nrows = 0
+        return arr
+
+    def __len__(self):
+        return self.nrows
+
+
 def scenario_damage(riskinputs, param, monitor):
     """
     Core function for a damage computation.
@@ -81,31 +150,31 @@ def scenario_damage(riskinputs, param, monitor):
     :param param:
         dictionary of extra parameters
     :returns:
-        a dictionary of arrays
+        a dictionary of arrays; the damage rows are yielded in chunks
     """
     crmodel = monitor.read('crmodel')
     L = len(crmodel.loss_types)
-    D = len(crmodel.damage_states)
     consequences = crmodel.get_consequences()
     # algorithm used to compute the discrete damage distributions
     float_dmg_dist = param['float_dmg_dist']
-    z = numpy.zeros((L, D - 1), F32 if float_dmg_dist else U32)
-    d_event = AccumDict(accum=z)
-    res = {'d_event': d_event, 'd_asset': []}
+    res = {'d_asset': []}
+    csq_eids = []  # event IDs for the consequences
+    csq_by_event = {name: [] for name in consequences}  # arrays (L, E')
     for name in consequences:
         res['avg_' + name] = []
-        res[name + '_by_event'] = AccumDict(accum=numpy.zeros(L, F64))
-        # using F64 here is necessary: with F32 the non-commutativity
-        # of addition would hurt too much with multiple tasks
     seed = param['master_seed']
     num_events = param['num_events']  # per realization
-    acc = []  # (aid, eid, lid, ds...)
+    acc = DamageAccumulator(param['asset_damage_dt'])
     sec_sims = param['secondary_simulations'].items()
     for ri in riskinputs:
         # here instead F32 floats are ok
         for out in ri.gen_outputs(crmodel, monitor):
             r = out.rlzi
             ne = num_events[r]  # total number of events
+            eids = numpy.array(out.eids)
+            csq_eids.append(eids)
+            for name in consequences:
+                csq_by_event[name].append(numpy.zeros((L, len(eids)), F64))
             for lti, loss_type in enumerate(crmodel.loss_types):
                 for asset, fractions in zip(ri.assets, out[loss_type]):
                     aid = asset['ordinal']
@@ -118,12 +187,7 @@ def scenario_damage(riskinputs, param, monitor):
                         damages = bin_ddd(
                             fractions, asset['number'], seed + aid)
                     # damages has shape E', D with E' == len(out.eids)
-                    for e, ddd in enumerate(damages):
-                        dmg = ddd[1:]
-                        if dmg.sum():
-                            eid = out.eids[e]  # (aid, eid, l) is unique
-                            acc.append((aid, eid, lti) + tuple(dmg))
-                            d_event[eid][lti] += ddd[1:]
+                    acc.add(aid, eids, lti, damages)
                     tot = damages.sum(axis=0)  # (E', D) -> D
                     nodamage = asset['number'] * (ne - len(damages))
                     tot[0] += nodamage
@@ -133,11 +197,24 @@ def scenario_damage(riskinputs, param, monitor):
                     for name, values in csq.items():
                         res['avg_%s' % name].append(
                             (lti, r, asset['ordinal'], values.sum(axis=0)))
-                        by_event = res[name + '_by_event']
-                        for eid, value in zip(out.eids, values):
-                            by_event[eid][lti] += value
-    res['aed'] = numpy.array(acc, param['asset_damage_dt'])
-    return res
+                        csq_by_event[name][-1][lti] += values
+            if len(acc) >= param['max_dmg_rows']:
+                yield {'aed': acc.flush()}
+    # aggregate the consequences by event with a bincount
+    if csq_eids:
+        eids, inv = numpy.unique(
+            numpy.concatenate(csq_eids), return_inverse=True)
+    for name, arrays in csq_by_event.items():
+        by_event = res[name + '_by_event'] = AccumDict()
+        if arrays:
+            # using F64 here is necessary: with F32 the non-commutativity
+            # of addition would hurt too much with multiple tasks
+            values = numpy.concatenate(arrays, axis=1)  # shape (L, E')
+            sums = numpy.array([numpy.bincount(inv, vals, len(eids))
+                                for vals in values])  # shape (L, E)
+            by_event.update(zip(eids, sums.T))
+    res['aed'] = acc.flush()
+    yield res
 
 
 @base.calculators.add('scenario_damage', 'event_based_damage')
@@ -168,6 +245,7 @@ class ScenarioDamageCalculator(base.RiskCalculator):
         self.param['asset_damage_dt'] = self.crmodel.asset_damage_dt(
             oq.float_dmg_dist or num_floats)
         self.param['master_seed'] = oq.master_seed
+        self.param['max_dmg_rows'] = MAX_DMG_ROWS
         self.param['num_events'] = numpy.bincount(  # events by rlz
             self.datastore['events']['rlz_id'])
         self.datastore.create_dframe(
@@ -234,11 +312,12 @@ class ScenarioDamageCalculator(base.RiskCalculator):
         tot = self.assetcol['number'].sum()
         dt = F32 if self.param['float_dmg_dist'] else U32
         dbe = numpy.zeros((self.E, L, D), dt)  # shape E, L, D
-        dbe[:, :, 0] = tot
-        for e, dmg_by_lt in result['d_event'].items():
-            for li, dmg in enumerate(dmg_by_lt):
-                dbe[e, li,  0] = tot - dmg.sum()
-                dbe[e, li,  1:] = dmg
+        dd = self.datastore['dd_data']
+        idx = dd['eid'][()] * L + dd['lid'][()]
+        for d, dname in enumerate(dstates[1:], 1):
+            dbe[:, :, d] = numpy.bincount(
+                idx, dd[dname][()], self.E * L).reshape(self.E, L)
+        dbe[:, :, 0] = tot - dbe[:, :, 1:].sum(axis=2)
         self.datastore['dmg_by_event'] = dbe
         self.datastore['avg_portfolio_damage'] = avg_std(
             dbe.astype(float), weights)
@@ -250,7 +329,6 @@ class ScenarioDamageCalculator(base.RiskCalculator):
 
         # consequence distributions
         del result['d_asset']
-        del result['d_event']
         dtlist = [('event_id', U32), ('rlz_id', U16), ('loss', (F32, (L,)))]
         for name, csq in result.items():
             if name.startswith('avg_'):
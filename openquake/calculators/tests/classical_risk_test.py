@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+from openquake.hazardlib import InvalidFile
 from openquake.qa_tests_data.classical_risk import (
     case_2, case_3, case_4, case_5, case_master)
 from openquake.calculators.tests import (
@@ -96,3 +98,17 @@ class ClassicalRiskTestCase(CalculatorTestCase):
         for kind in ('rlzs', 'stats'):
             [fname] = export(('loss_maps-' + kind, 'npz'), self.calc.datastore)
             print('Generated ' + fname)
+
+    def test_multiple_taxonomy_branches(self):
+        # not supported, the error is raised before starting the tasks
+        fname = os.path.join(os.path.dirname(case_master.__file__),
+                             'taxonomy_mapping.csv')
+        self.addCleanup(os.remove, fname)
+        with open(fname, 'w') as f:
+            f.write('taxonomy,conversion,weight\n'
+                    'tax1,tax1,.5\ntax1,tax2,.5\n'
+                    'tax2,tax2,1\ntax3,tax3,1\n')
+        with self.assertRaises(InvalidFile) as ctx:
+            self.run_calc(case_master.__file__, 'job.ini',
+                          taxonomy_mapping_csv='taxonomy_mapping.csv')
+        self.assertIn('multiple branches', str(ctx.exception))
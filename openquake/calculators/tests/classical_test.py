@@ -18,6 +18,9 @@
 
 import os
 import gzip
+import shutil
+import tempfile
+import time
 import unittest
 import numpy
 from openquake.baselib import parallel, general, config
@@ -26,6 +29,7 @@ from openquake.calculators.views import view
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
 from openquake.calculators.getters import get_slice_by_g
+from openquake.calculators.classical import CostModel, Hazard, Checkpoint
 from openquake.calculators.tests import CalculatorTestCase, NOT_DARWIN
 from openquake.qa_tests_data.classical import (
     case_1, case_2, case_3, case_4, case_5, case_6, case_7, case_8, case_9,
@@ -90,6 +94,7 @@ class ClassicalTestCase(CalculatorTestCase):
 
             slow = view('task:classical:-1', self.calc.datastore)
             self.assertIn('taskno', slow)
+            self.assertIn('predicted', slow)
             self.assertIn('duration', slow)
             self.assertIn('sources', slow)
 
@@ -122,6 +127,34 @@ class ClassicalTestCase(CalculatorTestCase):
             'SA(4.1) is out of the period range defined for [SadighEtAl1997]',
             str(ctx.exception))
 
+    def test_cost_model(self):
+        # the first run fits the cost model, the second one uses it
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        fname = os.path.join(tmpdir, 'cost_model.json')
+        with unittest.mock.patch.object(CostModel, 'fname', fname):
+            self.run_calc(case_1.__file__, 'job.ini')
+            self.assertFalse(os.path.exists(fname))  # use_cost_model=false
+            self.run_calc(case_1.__file__, 'job.ini', use_cost_model='true')
+            [src] = self.calc.csm.get_sources()
+            gsims = self.calc.full_lt.get_rlzs_by_gsim(0)
+            model = CostModel()
+            self.assertIn(model.get_key(src, gsims), model.sums)
+            self.assert_curves_ok(
+                ['hazard_curve-PGA.csv', 'hazard_curve-SA(0.1).csv'],
+                case_1.__file__, use_cost_model='true')
+        self.assertEqual(os.listdir(tmpdir), ['cost_model.json'])
+
+        # a live lock is not removed, a stale lock is taken over
+        lock, token = model._lock()
+        t0 = time.time()
+        lock2, token2 = model._lock(timeout=.5)
+        self.assertGreater(time.time() - t0, .5)
+        model._unlock(lock, token)  # the lock belongs to token2 now
+        self.assertTrue(os.path.exists(lock))
+        model._unlock(lock2, token2)
+        self.assertFalse(os.path.exists(lock))
+
     def test_case_2(self):
         self.run_calc(case_2.__file__, 'job.ini')
 
@@ -295,6 +328,92 @@ hazard_uhs-std.csv
             export(('hcurves/rlz-3', 'csv'), self.calc.datastore)
         self.assertIn('hcurves-rlzs', str(ctx.exception))
 
+    def test_resume(self):
+        # the calculation dies after a checkpoint, then it is resumed
+        kw = dict(concurrent_tasks='20', min_weight='1',
+                  checkpoint_interval='1E-9', max_sites_disagg='0')
+        save = Checkpoint.save
+
+        def die(ckp, pmaps):
+            save(ckp, pmaps)
+            if ckp.haz.data:  # a group was already saved
+                raise MemoryError
+        with unittest.mock.patch.object(Checkpoint, 'save', die), \
+                self.assertRaises(MemoryError):
+            self.run_calc(case_16.__file__, 'job.ini', **kw)
+        parent = self.calc.datastore
+        status = parent['checkpoint/grp_status'][:]
+        self.assertGreater((status == 2).sum(), 0)  # some complete groups
+        self.assertGreater((status == 1).sum(), 0)  # some partial groups
+        with unittest.mock.patch.dict(config.memory, limit=240):
+            self.assert_curves_ok(
+                ['hazard_curve-mean.csv',
+                 'quantile_curve-0.1.csv',
+                 'quantile_curve-0.9.csv'],
+                case_16.__file__, resume_calc_id=str(parent.calc_id), **kw)
+
+        # the calculation dies while saving a complete group
+        store_poes = Hazard.store_poes
+
+        def die(haz, grp_id, pmap):
+            if haz.data:  # a group was already saved
+                raise MemoryError
+            store_poes(haz, grp_id, pmap)
+        with unittest.mock.patch.object(Hazard, 'store_poes', die), \
+                self.assertRaises(MemoryError):
+            self.run_calc(case_16.__file__, 'job.ini', **kw)
+        parent = self.calc.datastore
+        status = parent['checkpoint/grp_status'][:]
+        self.assertEqual((status == 3).sum(), 1)  # the group is invalid
+        with unittest.mock.patch.dict(config.memory, limit=240):
+            self.assert_curves_ok(
+                ['hazard_curve-mean.csv',
+                 'quantile_curve-0.1.csv',
+                 'quantile_curve-0.9.csv'],
+                case_16.__file__, resume_calc_id=str(parent.calc_id), **kw)
+
+    def test_pmap_cache(self):
+        # the second calculation reads all the groups from the cache
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        kw = dict(pmap_cache_dir=cache_dir, max_sites_disagg='0')
+        self.run_calc(case_16.__file__, 'job.ini', **kw)
+        ngroups = len(self.calc.csm.src_groups)
+        self.assertEqual(len(os.listdir(cache_dir)), ngroups)
+        with unittest.mock.patch.dict(config.memory, limit=240):
+            self.assert_curves_ok(
+                ['hazard_curve-mean.csv',
+                 'quantile_curve-0.1.csv',
+                 'quantile_curve-0.9.csv'],
+                case_16.__file__, **kw)
+        self.assertEqual(len(self.calc.pmap_cache.cached), ngroups)
+
+        # a cache too small keeps nothing
+        self.run_calc(case_16.__file__, 'job.ini', pmap_cache_size='1E-6',
+                      **kw)
+        self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_reduction_fanin(self):
+        # the pmaps are composed by combiner tasks, with the same curves
+        with unittest.mock.patch.dict(config.memory, limit=240):
+            self.assert_curves_ok(
+                ['hazard_curve-mean.csv',
+                 'quantile_curve-0.1.csv',
+                 'quantile_curve-0.9.csv'],
+                case_16.__file__, concurrent_tasks='20', min_weight='1',
+                reduction_fanin='3')
+        tasks = self.calc.datastore.read_df('task_info', 'taskname')
+        self.assertIn(b'combine_pmaps', tasks.index)
+        self.assertFalse(os.path.exists(self.calc.params['pmaps_dir']))
+
+        # the pickled pmaps are removed also if the calculation fails
+        with unittest.mock.patch.object(
+                Hazard, 'store_poes', side_effect=MemoryError), \
+                self.assertRaises(MemoryError):
+            self.run_calc(case_16.__file__, 'job.ini', concurrent_tasks='20',
+                          min_weight='1', reduction_fanin='3')
+        self.assertFalse(os.path.exists(self.calc.params['pmaps_dir']))
+
     def test_case_17(self):  # oversampling
         # this is a test with 4 sources A and B with the same ID
         # sources A's are false duplicates, while the B's are true duplicates
@@ -469,6 +588,15 @@ hazard_uhs-std.csv
                           coordinate_bin_width="1.0",
                           num_epsilon_bins="6")
 
+    def test_task_duration(self):
+        # with a tiny task_duration the tasks return partial results
+        # and spawn subtasks; the curves must not change, even for the
+        # mutex sources
+        self.assert_curves_ok(['hazard_curve.csv'], case_27.__file__,
+                              task_duration='1E-9')
+        tasks = self.calc.datastore.read_df('task_info', 'taskname')
+        self.assertGreater(len(tasks.loc[b'classical']), 2)
+
     def test_case_28(self):  # North Africa
         # MultiPointSource with modify MFD logic tree
         self.assert_curves_ok([
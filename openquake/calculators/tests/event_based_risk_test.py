@@ -17,6 +17,7 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import os
 import logging
+import itertools
 from unittest import mock
 import numpy
 
@@ -27,7 +28,8 @@ from openquake.calculators.views import view, rst_table
 from openquake.calculators.tests import CalculatorTestCase, strip_calc_id
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
-from openquake.calculators.post_risk import PostRiskCalculator
+from openquake.calculators.post_risk import (
+    PostRiskCalculator, get_reagg_idxs, reagg_losses)
 from openquake.qa_tests_data.event_based_risk import (
     case_1, case_2, case_3, case_4, case_4a, case_5, case_6c, case_master,
     case_miriam, occupants, case_1f, case_1g, case_7a, recompute)
@@ -108,7 +110,7 @@ class EventBasedRiskTestCase(CalculatorTestCase):
 
         aw = extract(self.calc.datastore, 'agg_losses/structural')
         self.assertEqual(aw.stats, ['mean'])
-        numpy.testing.assert_allclose(aw.array, [687.9181])
+        numpy.testing.assert_allclose(aw.array, [687.9436])
 
         fnames = export(('agg_curves-stats', 'csv'), self.calc.datastore)
         for fname in fnames:
@@ -452,3 +454,21 @@ class EventBasedRiskTestCase(CalculatorTestCase):
         [fname] = export(('agg_losses-rlzs', 'csv'), prc.datastore)
         self.assertEqualFiles('expected/recomputed_losses.csv', fname,
                               delta=1E-5)
+
+        # compare the reaggregation with the old implementation based on
+        # itertools.product and pandas.groupby, with many small chunks
+        num_tags = prc.num_tags
+        shape = list(num_tags.values())
+        arr = numpy.arange(numpy.prod(shape)).reshape(shape)
+        ranges = [numpy.arange(n) if t == 'NAME_1' else [slice(None)]
+                  for t, n in num_tags.items()]
+        for i, idx in enumerate(itertools.product(*ranges)):
+            arr[idx] = i
+        idxs = get_reagg_idxs(num_tags, ['NAME_1'])
+        numpy.testing.assert_equal(idxs[:-1], arr.flatten())
+        alt = parent.read_df('agg_loss_table')
+        alt['agg_id'] = idxs[alt['agg_id'].to_numpy()]
+        expected = alt.groupby(['event_id', 'agg_id']).sum().reset_index()
+        got = reagg_losses(parent, idxs, oq.loss_names, chunksize=7)
+        for col in expected.columns:
+            numpy.testing.assert_allclose(got[col], expected[col], rtol=1E-6)
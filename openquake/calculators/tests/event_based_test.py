@@ -480,6 +480,23 @@ class EventBasedTestCase(CalculatorTestCase):
         tmp = gettemp(sio.getvalue())
         self.assertEqualFiles('expected/sitecol.csv', tmp)
 
+    def test_task_duration(self):
+        # the sample_ruptures tasks are split in subtasks receiving copies
+        # of the SourceGroup, with the same ruptures and events
+        fields = ['seed', 'source_id', 'et_id', 'n_occ', 'mag', 'hypo']
+        self.run_calc(case_23.__file__, 'job.ini')
+        rups = numpy.sort(self.calc.datastore['ruptures'][()], order='seed')
+        events = len(self.calc.datastore['events'])
+        tasks = self.calc.datastore.read_df('task_info', 'taskname')
+        ntasks = len(tasks.loc[b'sample_ruptures'])
+        self.run_calc(case_23.__file__, 'job.ini', task_duration='1E-9')
+        tasks = self.calc.datastore.read_df('task_info', 'taskname')
+        self.assertGreater(len(tasks.loc[b'sample_ruptures']), ntasks)
+        got = numpy.sort(self.calc.datastore['ruptures'][()], order='seed')
+        for field in fields:
+            numpy.testing.assert_equal(got[field], rups[field])
+        self.assertEqual(len(self.calc.datastore['events']), events)
+
     def test_case_24(self):
         # This is a test for shift_hypo = true - The expected results are the
         # same ones defined for the case_44 of the classical methodology
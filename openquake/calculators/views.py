@@ -593,9 +593,15 @@ def view_task_hazard(token, dstore):
     eff_ruptures = dstore['by_task/eff_ruptures'][taskno]
     eff_sites = dstore['by_task/eff_sites'][taskno]
     srcids = dstore['by_task/srcids'][taskno]
-    res = ('taskno=%d, eff_ruptures=%d, eff_sites=%d, duration=%d s\n'
-           'sources="%s"' % (taskno, eff_ruptures, eff_sites, rec['duration'],
-                             srcids))
+    if dstore['oqparam'].use_cost_model:  # the weight is a time
+        predicted = rec['weight']
+    else:  # assume the same time per unit of weight for all tasks
+        predicted = rec['weight'] * data['duration'].sum() / data[
+            'weight'].sum()
+    res = ('taskno=%d, eff_ruptures=%d, eff_sites=%d, predicted=%d s, '
+           'duration=%d s\nsources="%s"' % (
+               taskno, eff_ruptures, eff_sites, predicted, rec['duration'],
+               srcids))
     return res
 
 
@@ -924,10 +930,10 @@ def view_zero_losses(token, dstore):
     R = len(dstore['weights'])
     oq = dstore['oqparam']
     avg_gmf = dstore['avg_gmf'][0]
-    asset_df = dstore.read_df('assetcol/array', 'site_id')
-    for col in asset_df.columns:
-        if not col.startswith('value-'):
-            del asset_df[col]
+    names = dstore['assetcol/array'].dtype.names
+    asset_df = dstore.read_df(
+        'assetcol/array', 'site_id', fields=['site_id'] + [
+            name for name in names if name.startswith('value-')])
     values_df = asset_df.groupby(asset_df.index).sum()
     avglosses = dstore['avg_losses-rlzs'][:].sum(axis=1) / R  # shape (A, L)
     dic = dict(site_id=dstore['assetcol']['site_id'])
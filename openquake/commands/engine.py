@@ -85,6 +85,7 @@ def main(
         run=None,
         delete_calculation: int = None,
         hazard_calculation_id: int = None,
+        resume: int = None,
         list_outputs: int = None,
         show_log=None,
         export_output=None,
@@ -163,6 +164,18 @@ def main(
         pars['multi'] = multi
         run_jobs(job_inis, log_level, log_file, exports, **pars)
 
+    elif resume is not None:
+        # run again the job.ini of the failed calculation, reusing the
+        # work saved in its checkpoints
+        calc_id = get_job_id(resume)
+        with datastore.read(calc_id) as dstore:
+            job_ini = dstore['oqparam'].inputs['job_ini']
+        pars = dict(p.split('=', 1) for p in param.split(',')) if param else {}
+        pars['resume_calc_id'] = str(calc_id)
+        log_file = os.path.expanduser(log_file) \
+            if log_file is not None else None
+        run_jobs([job_ini], log_level, log_file, exports, **pars)
+
     # hazard
     elif list_hazard_calculations:
         for line in logs.dbcmd(
@@ -247,6 +260,9 @@ main.delete_calculation = dict(
     metavar='CALCULATION_ID')
 main.hazard_calculation_id = dict(
     abbrev='--hc', help='Use the given job as input for the next job')
+main.resume = dict(
+    abbrev='--resume', metavar='CALCULATION_ID',
+    help='Resume a failed classical calculation (pass again the --param)')
 main.list_outputs = dict(
     abbrev='--lo', help='List outputs for the specified calculation',
     metavar='CALCULATION_ID')
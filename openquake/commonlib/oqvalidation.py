@@ -53,7 +53,7 @@ ash_wet_amplification_factor:
 
 asset_correlation:
   Used in risk calculations to take into account asset correlation. Accepts
-  only the values 1 (full correlation) and 0 (no correlation).
+  values in the range [0, 1], from no correlation to full correlation.
   Example: *asset_correlation=1*.
   Default: 0
 
@@ -88,6 +88,14 @@ calculation_mode:
   Example: *calculation_mode=classical*
   Default: no default
 
+checkpoint_interval:
+  Used in classical calculations. If set, the partial probability maps
+  are saved in the datastore every given number of seconds, together with
+  the sources already computed, so that a failed calculation can be
+  resumed with `oq engine --resume <calc_id>`.
+  Example: *checkpoint_interval = 3600*.
+  Default: None
+
 collapse_gsim_logic_tree:
   INTERNAL
 
@@ -379,6 +387,20 @@ number_of_logic_tree_samples:
   Example: *number_of_logic_tree_samples = 0*.
   Default: no default
 
+pmap_cache_dir:
+  Used in classical calculations to cache the probability maps of the
+  source groups across calculations; a group is recomputed only if its
+  sources, GSIMs, sites or the relevant parameters changed. Relative paths
+  are resolved with respect to the directory of the job.ini.
+  Example: *pmap_cache_dir = /home/user/pmap_cache*.
+  Default: None
+
+pmap_cache_size:
+  Maximum size in MB of the *pmap_cache_dir*; the least recently used
+  entries are removed when it is exceeded.
+  Example: *pmap_cache_size = 10000*.
+  Default: 1024
+
 poes:
   Probabilities of Exceedance used to specify the hazard maps or hazard spectra
   to compute.
@@ -410,6 +432,13 @@ random_seed:
   Example: *random_seed = 1234*.
   Default: 42
 
+reduction_fanin:
+  Used in classical calculations. If greater than 1, the tasks store their
+  probability maps and combiner tasks compose them in groups of the given
+  size before sending them to the master.
+  Example: *reduction_fanin = 8*.
+  Default: 1
+
 reference_backarc:
   Used when there is no site model to specify a global backarc parameter,
   used in some GMPEs. Can be True or False
@@ -456,6 +485,12 @@ region_grid_spacing:
   Example: *region_grid_spacing = 10*.
   Default: None
 
+resume_calc_id:
+  Used in classical calculations. ID of a failed calculation with
+  checkpoints, set by the command `oq engine --resume`.
+  Example: *resume_calc_id = 1234*.
+  Default: None
+
 return_periods:
   Used in the computation of the loss curves.
   Example: *return_periods = 200 500 1000*.
@@ -569,6 +604,13 @@ steps_per_interval:
   Example: *steps_per_interval = 4*.
   Default: 1
 
+task_duration:
+  Used in classical and event based calculations. If set, the tasks taking
+  more than the given number of seconds return a partial result and send
+  the unprocessed sources to new tasks.
+  Example: *task_duration = 600*.
+  Default: None
+
 time_event:
   Used in scenario_risk calculations when the occupancy depend on the time.
   Valid choices are "day", "night", "transit".
@@ -585,6 +627,13 @@ uniform_hazard_spectra:
   Example: *uniform_hazard_spectra = true*.
   Default: False
 
+use_cost_model:
+  Used in classical calculations. If set, the sources are distributed
+  across the tasks according to their expected calculation times, as
+  estimated from the previous calculations of the user.
+  Example: *use_cost_model = true*.
+  Default: False
+
 vs30_tolerance:
   Used when amplification_method = convolution.
   Example: *vs30_tolerance = 20*.
@@ -685,6 +734,7 @@ class OqParam(valid.ParamSet):
     avg_losses = valid.Param(valid.boolean, True)
     base_path = valid.Param(valid.utf8, '.')
     calculation_mode = valid.Param(valid.Choice())  # -> get_oqparam
+    checkpoint_interval = valid.Param(valid.NoneOr(valid.positivefloat), None)
     collapse_gsim_logic_tree = valid.Param(valid.namelist, [])
     collapse_level = valid.Param(valid.Choice('0', '1', '2', '3'), 0)
     coordinate_bin_width = valid.Param(valid.positivefloat)
@@ -746,12 +796,15 @@ class OqParam(valid.ParamSet):
     number_of_logic_tree_samples = valid.Param(valid.positiveint, 0)
     num_epsilon_bins = valid.Param(valid.positiveint)
     num_rlzs_disagg = valid.Param(valid.positiveint, None)
+    pmap_cache_dir = valid.Param(valid.NoneOr(valid.utf8), None)
+    pmap_cache_size = valid.Param(valid.positivefloat, 1024)
     poes = valid.Param(valid.probabilities, [])
     poes_disagg = valid.Param(valid.probabilities, [])
     pointsource_distance = valid.Param(valid.MagDepDistance.new, None)
     ps_grid_spacing = valid.Param(valid.positivefloat, None)
     quantile_hazard_curves = quantiles = valid.Param(valid.probabilities, [])
     random_seed = valid.Param(valid.positiveint, 42)
+    reduction_fanin = valid.Param(valid.positiveint, 1)
     reference_depth_to_1pt0km_per_sec = valid.Param(
         valid.positivefloat, numpy.nan)
     reference_depth_to_2pt5km_per_sec = valid.Param(
@@ -764,6 +817,7 @@ class OqParam(valid.ParamSet):
     reference_backarc = valid.Param(valid.boolean, False)
     region = valid.Param(valid.wkt_polygon, None)
     region_grid_spacing = valid.Param(valid.positivefloat, None)
+    resume_calc_id = valid.Param(valid.NoneOr(valid.positiveint), None)
     risk_imtls = valid.Param(valid.intensity_measure_types_and_levels, {})
     risk_investigation_time = valid.Param(valid.positivefloat, None)
     rlz_index = valid.Param(valid.positiveints, None)
@@ -798,9 +852,11 @@ class OqParam(valid.ParamSet):
     # be generated in cases like Ecuador inside full South America
     min_weight = valid.Param(valid.positiveint, 200)  # used in classical
     max_weight = valid.Param(valid.positiveint, 1E6)  # used in classical
+    task_duration = valid.Param(valid.NoneOr(valid.positivefloat), None)
     time_event = valid.Param(str, None)
     truncation_level = valid.Param(valid.NoneOr(valid.positivefloat), None)
     uniform_hazard_spectra = valid.Param(valid.boolean, False)
+    use_cost_model = valid.Param(valid.boolean, False)
     vs30_tolerance = valid.Param(valid.positiveint, 0)
     width_of_mfd_bin = valid.Param(valid.positivefloat, None)
 
@@ -963,11 +1019,7 @@ class OqParam(valid.ParamSet):
 
         # checks for event_based_risk
         if (self.calculation_mode == 'event_based_risk' and
-                self.asset_correlation not in (0, 1)):
-            raise ValueError('asset_correlation != {0, 1} is no longer'
-                             ' supported in %s' % job_ini)
-        elif (self.calculation_mode == 'event_based_risk' and
-              not self.ground_motion_fields):
+                not self.ground_motion_fields):
             raise ValueError('ground_motion_fields must be set to true in %s'
                              % job_ini)
 
@@ -16,11 +16,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 import copy
+import hashlib
 import os.path
 import pickle
 import operator
 import logging
-import zlib
 import numpy
 
 from openquake.baselib import parallel, general
@@ -177,6 +177,17 @@ def _build_groups(full_lt, smdict):
     return groups
 
 
+def get_checksum(src):
+    """
+    :param src: a source object, before the splitting
+    :returns: a SHA1 digest of the source, ignoring the source_id,
+              et_id and samples attributes
+    """
+    dic = {k: v for k, v in vars(src).items()
+           if k not in 'source_id et_id samples'}
+    return hashlib.sha1(pickle.dumps(dic, protocol=4)).hexdigest()
+
+
 def reduce_sources(sources_with_same_id):
     """
     :param sources_with_same_id: a list of sources with the same source_id
@@ -184,9 +195,7 @@ def reduce_sources(sources_with_same_id):
     """
     out = []
     for src in sources_with_same_id:
-        dic = {k: v for k, v in vars(src).items()
-               if k not in 'source_id et_id samples'}
-        src.checksum = zlib.adler32(pickle.dumps(dic, protocol=4))
+        src.checksum = get_checksum(src)
     for srcs in general.groupby(
             sources_with_same_id, operator.attrgetter('checksum')).values():
         # duplicate sources: same id, same checksum
@@ -17,10 +17,11 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import csv
 import tempfile
 import unittest.mock as mock
 import unittest
-from io import BytesIO
+from io import BytesIO, StringIO
 
 from openquake.baselib import general, datastore
 from openquake.hazardlib import InvalidFile, site_amplification
@@ -462,6 +463,37 @@ Found case-duplicated fields [['ID', 'id']] in ''', str(ctx.exception))
             ass.location[1]
             ass.tags.get('geometry')
 
+    def test_csv_chunks(self):
+        # reading the CSV in chunks must give the same assets and tags
+        fname = os.path.join(os.path.dirname(case_16.__file__),
+                             'exposure.xml')
+        exp = asset.Exposure.read([fname])
+        with mock.patch.object(asset, 'CSV_CHUNKSIZE', 1000):
+            csvfile = os.path.join(os.path.dirname(fname), 'exposure_res.csv')
+            header, ranges = asset.split_csv(csvfile, 1000)
+            self.assertGreater(len(ranges), 1)
+            exp1 = asset.Exposure.read([fname])
+        self.assertEqual([a.asset_id for a in exp1.assets],
+                         [a.asset_id for a in exp.assets])
+        self.assertEqual([a.tagidxs for a in exp1.assets],
+                         [a.tagidxs for a in exp.assets])
+        self.assertEqual(exp1.tagcol.taxonomy, exp.tagcol.taxonomy)
+
+        # the chunks cannot break a quoted field containing newlines
+        lines = ['a%d,"multi\nline\n""%d"""\n' % (i, i) for i in range(20)]
+        csvfile = general.gettemp('id,descr\n' + ''.join(lines), suffix='.csv')
+        header, ranges = asset.split_csv(csvfile, 10)
+        self.assertGreater(len(ranges), 1)
+        with open(csvfile, newline='') as f:
+            expected = list(csv.reader(f))[1:]
+        rows = []
+        with open(csvfile, 'rb') as f:
+            for start, stop in ranges:
+                f.seek(start)
+                data = f.read(stop - start).decode('utf-8')
+                rows.extend(csv.reader(StringIO(data, newline="")))
+        self.assertEqual(rows, expected)
+
 
 class GetCompositeSourceModelTestCase(unittest.TestCase):
 
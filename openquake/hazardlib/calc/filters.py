@@ -240,6 +240,9 @@ def split_source(src):
             s.samples = src.samples
         if has_scaling_rate:
             s.scaling_rate = src.scaling_rate
+    if hasattr(src, 'checksum'):  # set in the engine by the source reader
+        for split in splits:
+            split.checksum = src.checksum
     for split in splits:
         if not split.num_ruptures:
             split.num_ruptures = split.count_ruptures()
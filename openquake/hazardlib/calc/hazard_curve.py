@@ -110,13 +110,16 @@ def classical(group, src_filter, gsims, param, monitor=Monitor()):
     param['maximum_distance'] = src_filter.integration_distance
     [trt] = trts  # there must be a single tectonic region type
     cmaker = ContextMaker(trt, gsims, param, monitor)
-    pmap, rup_data, calc_times = PmapMaker(cmaker, src_filter, group).make()
+    pmaker = PmapMaker(cmaker, src_filter, group)
+    pmap, rup_data, calc_times = pmaker.make()
     extra = {}
     extra['task_no'] = getattr(monitor, 'task_no', 0)
     extra['trt'] = trt
     extra['source_id'] = src.source_id
     extra['grp_id'] = src.grp_id
     extra['maxradius'] = maxradius
+    # sources not processed since the task_duration was exceeded
+    extra['remaining'] = pmaker.remaining
     group_probability = getattr(group, 'grp_probability', None)
     if src_mutex and group_probability:
         pmap *= group_probability
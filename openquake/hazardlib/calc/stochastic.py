@@ -21,13 +21,16 @@
 :func:`stochastic_event_set`.
 """
 import sys
+import copy
 import time
 import numpy
 from openquake.baselib import hdf5
 from openquake.baselib.general import AccumDict
 from openquake.baselib.performance import Monitor
+from openquake.baselib.parallel import split_remaining
 from openquake.baselib.python3compat import raise_
 from openquake.hazardlib.calc.filters import nofilter
+from openquake.hazardlib.sourceconverter import SourceGroup
 from openquake.hazardlib.source.rupture import BaseRupture, EBRupture
 from openquake.hazardlib.geo.mesh import surface_to_arrays
 
@@ -244,7 +247,8 @@ def sample_ruptures(sources, srcfilter, param, monitor=Monitor()):
     :param monitor:
         monitor instance
     :yields:
-        dictionaries with keys rup_array, calc_times
+        dictionaries with keys rup_array, calc_times and, if the
+        task_duration is exceeded, subtasks for the remaining sources
     """
     # AccumDict of arrays with 3 elements num_ruptures, num_sites, calc_time
     calc_times = AccumDict(accum=numpy.zeros(3, numpy.float32))
@@ -267,7 +271,18 @@ def sample_ruptures(sources, srcfilter, param, monitor=Monitor()):
         eff_ruptures = 0
         # AccumDict of arrays with 2 elements weight, calc_time
         calc_times = AccumDict(accum=numpy.zeros(3, numpy.float32))
-        for src, _ in srcfilter.filter(sources):
+        duration = param.get('task_duration')
+        tstart = time.time()
+        srcs = list(sources)
+        remaining = []  # sources not processed for lack of time
+
+        def gen_sources():
+            for i, src in enumerate(srcs):
+                if duration and i and time.time() - tstart > duration:
+                    remaining.extend(srcs[i:])
+                    return
+                yield src
+        for src, _ in srcfilter.filter(gen_sources()):
             nr = src.num_ruptures
             eff_ruptures += nr
             t0 = time.time()
@@ -287,3 +302,11 @@ def sample_ruptures(sources, srcfilter, param, monitor=Monitor()):
         rup_array = get_rup_array(eb_ruptures, srcfilter)
         yield AccumDict(dict(rup_array=rup_array, calc_times=calc_times,
                              eff_ruptures={trt: eff_ruptures}))
+        if remaining:  # send the unprocessed sources to new tasks
+            for block in split_remaining(
+                    srcs, remaining, duration, time.time() - tstart):
+                if isinstance(sources, SourceGroup):
+                    grp = copy.copy(sources)
+                    grp.sources = block
+                    block = grp
+                yield sample_ruptures, block, srcfilter, param
@@ -216,6 +216,7 @@ class ContextMaker(object):
         self.ctx_mon = monitor('make_contexts', measuremem=False)
         self.loglevels = DictArray(self.imtls) if self.imtls else {}
         self.shift_hypo = param.get('shift_hypo')
+        self.task_duration = param.get('task_duration')
         with warnings.catch_warnings():
             # avoid RuntimeWarning: divide by zero encountered in log
             warnings.simplefilter("ignore")
@@ -550,6 +551,10 @@ class PmapMaker(object):
         self.group = group
         self.src_mutex = getattr(group, 'src_interdep', None) == 'mutex'
         self.rup_indep = getattr(group, 'rup_interdep', None) != 'mutex'
+        # only groups with independent ruptures and no clusters can be
+        # computed in pieces and recomposed later on
+        self.splittable = self.task_duration and self.rup_indep and not (
+            getattr(group, 'cluster', False))
         self.fewsites = self.N <= cmaker.max_sites_disagg
         self.pne_mon = cmaker.mon('composing pnes', measuremem=False)
         # NB: if maxsites is too big or too small the performance of
@@ -605,9 +610,20 @@ class PmapMaker(object):
                 self.rupdata.append(ctx)
             yield ctx
 
+    def _gen_sources(self):
+        # yield the sources in the group; when the task_duration is
+        # exceeded stop and store the unprocessed sources in .remaining
+        sources = list(self.group)
+        for i, src in enumerate(sources):
+            if (self.splittable and i and
+                    time.time() - self.t0 > self.task_duration):
+                self.remaining = sources[i:]
+                return
+            yield src
+
     def _make_src_indep(self):
         # sources with the same ID
-        for src, sites in self.srcfilter.split(self.group):
+        for src, sites in self.srcfilter.split(self._gen_sources()):
             if self.fewsites:
                 sites = sites.complete
             t0 = time.time()
@@ -623,7 +639,7 @@ class PmapMaker(object):
         return ~self.pmap if self.rup_indep else self.pmap
 
     def _make_src_mutex(self):
-        for src, indices in self.srcfilter.filter(self.group):
+        for src, indices in self.srcfilter.filter(self._gen_sources()):
             t0 = time.time()
             sites = self.srcfilter.sitecol.filtered(indices)
             self.numctxs = 0
@@ -653,6 +669,8 @@ class PmapMaker(object):
         return dic
 
     def make(self):
+        self.t0 = time.time()
+        self.remaining = []  # sources not processed for lack of time
         self.rupdata = []
         imtls = self.cmaker.imtls
         L, G = imtls.size, len(self.gsims)
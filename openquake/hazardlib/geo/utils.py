@@ -30,6 +30,7 @@ from scipy.spatial import cKDTree
 import shapely.geometry
 
 from openquake.baselib.hdf5 import vstr
+from openquake.baselib.general import gen_slices
 from openquake.hazardlib.geo import geodetic
 
 U32 = numpy.uint32
@@ -40,6 +41,7 @@ EARTH_RADIUS = geodetic.EARTH_RADIUS
 spherical_to_cartesian = geodetic.spherical_to_cartesian
 SphericalBB = collections.namedtuple('SphericalBB', 'west east north south')
 MAX_EXTENT = 5000  # km, decided by M. Simionato
+ASSOC_CHUNKSIZE = 100_000  # points per kdtree query in the associations
 BASE32 = [ch.encode('ascii') for ch in '0123456789bcdefghjkmnpqrstuvwxyz']
 
 
@@ -101,6 +103,28 @@ class _GeographicObjects(object):
         min_dist, idx = self.kdtree.query(xyz)
         return self.objects[idx], min_dist
 
+    def query(self, lons, lats):
+        """
+        Find the closest objects to many points at once. The kdtree is
+        queried in chunks of ASSOC_CHUNKSIZE points, to bound the memory.
+
+        :param lons: N longitudes in degrees
+        :param lats: N latitudes in degrees
+        :returns: N distances in km and N indices of the closest objects
+        """
+        N = len(lons)
+        dists = numpy.zeros(N)
+        idxs = numpy.zeros(N, int)
+        for slc in gen_slices(0, N, ASSOC_CHUNKSIZE):
+            xyz = spherical_to_cartesian(lons[slc], lats[slc])
+            dists[slc], idxs[slc] = self.kdtree.query(xyz)
+        return dists, idxs
+
+    def _get(self, idxs):
+        if isinstance(self.objects, numpy.ndarray):
+            return self.objects[idxs]
+        return numpy.array([self.objects[idx] for idx in idxs])
+
     def assoc(self, sitecol, assoc_dist, mode):
         """
         :param sitecol: a (filtered) site collection
@@ -109,31 +133,34 @@ class _GeographicObjects(object):
         :returns: filtered site collection, filtered objects, discarded
         """
         assert mode in 'strict warn filter', mode
-        dic = {}
+        dists, idxs = self.query(sitecol.lons, sitecol.lats)
+        if assoc_dist is None:  # associate all
+            ok = numpy.ones(len(dists), bool)
+        else:  # associate within
+            ok = dists <= assoc_dist
+        far, = numpy.where(~ok)
         discarded = []
-        for sid, lon, lat in zip(sitecol.sids, sitecol.lons, sitecol.lats):
-            obj, distance = self.get_closest(lon, lat)
-            if assoc_dist is None:
-                dic[sid] = obj  # associate all
-            elif distance <= assoc_dist:
-                dic[sid] = obj  # associate within
-            elif mode == 'warn':
-                dic[sid] = obj  # associate outside
-                logging.warning(
-                    'The closest vs30 site (%.1f %.1f) is distant more than %d'
-                    ' km from site #%d (%.1f %.1f)', obj['lon'], obj['lat'],
-                    int(distance), sid, lon, lat)
-            elif mode == 'filter':
-                discarded.append(obj)
-            elif mode == 'strict':
-                raise SiteAssociationError(
-                    'There is nothing closer than %s km '
-                    'to site (%s %s)' % (assoc_dist, lon, lat))
-        if not dic:
+        if len(far) and mode == 'strict':
+            i = far[0]
+            raise SiteAssociationError(
+                'There is nothing closer than %s km '
+                'to site (%s %s)' % (assoc_dist, sitecol.lons[i],
+                                     sitecol.lats[i]))
+        elif len(far) and mode == 'warn':  # associate outside
+            i = far[dists[far].argmax()]
+            obj = self._get([idxs[i]])[0]
+            logging.warning(
+                'The closest vs30 site (%.1f %.1f) is distant more than %d'
+                ' km from site #%d (%.1f %.1f) [%d site(s) too distant]',
+                obj['lon'], obj['lat'], int(dists[i]), sitecol.sids[i],
+                sitecol.lons[i], sitecol.lats[i], len(far))
+            ok[:] = True
+        elif len(far):  # filter
+            discarded = list(self._get(idxs[far]))
+        if not ok.any():
             raise SiteAssociationError(
                 'No sites could be associated within %s km' % assoc_dist)
-        sids = sorted(dic)
-        return (sitecol.filtered(sids), numpy.array([dic[s] for s in sids]),
+        return (sitecol.filtered(sitecol.sids[ok]), self._get(idxs[ok]),
                 discarded)
 
     def assoc2(self, assets_by_site, assoc_dist, mode):
@@ -150,25 +177,27 @@ class _GeographicObjects(object):
         self.objects.filtered  # self.objects must be a SiteCollection
         asset_dt = numpy.dtype(
             [('asset_ref', vstr), ('lon', F32), ('lat', F32)])
+        lons, lats = numpy.array(
+            [assets[0].location for assets in assets_by_site]).T
+        dists, idxs = self.query(lons, lats)
+        ok = dists <= assoc_dist
+        far, = numpy.where(~ok)
+        if len(far) and mode == 'strict':
+            raise SiteAssociationError(
+                'There is nothing closer than %s km '
+                'to site (%s %s)' % (assoc_dist, lons[far[0]], lats[far[0]]))
         assets_by_sid = collections.defaultdict(list)
-        discarded = []
-        for assets in assets_by_site:
-            lon, lat = assets[0].location
-            obj, distance = self.get_closest(lon, lat)
-            if distance <= assoc_dist:
-                # keep the assets, otherwise discard them
-                assets_by_sid[obj['sids']].extend(assets)
-            elif mode == 'strict':
-                raise SiteAssociationError(
-                    'There is nothing closer than %s km '
-                    'to site (%s %s)' % (assoc_dist, lon, lat))
-            else:
-                discarded.extend(assets)
+        for sid, i in zip(self.objects.sids[idxs[ok]], numpy.where(ok)[0]):
+            # keep the assets, otherwise discard them
+            assets_by_sid[sid].extend(assets_by_site[i])
+        discarded = [asset for i in far for asset in assets_by_site[i]]
         sids = sorted(assets_by_sid)
         if not sids:
             raise SiteAssociationError(
                 'Could not associate any site to any assets within the '
                 'asset_hazard_distance of %s km' % assoc_dist)
+        logging.info('Associated the assets to the hazard sites, max distance'
+                     ' %.1f km', dists[ok].max())
         assets_by_site = [
             sorted(assets_by_sid[sid], key=operator.attrgetter('ordinal'))
             for sid in sids]
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import unittest.mock
 import collections
 
 import numpy
@@ -438,4 +439,22 @@ class PlaneFit(unittest.TestCase):
         self.assertAlmostEqual(self.c[-1], -sum(par*pnt), 2)
 
 
+class GeographicObjectsTestCase(unittest.TestCase):
+    def test_query(self):
+        # the bulk query in chunks gives the same results as get_closest
+        rng = numpy.random.RandomState(42)
+        dt = [('lon', float), ('lat', float)]
+        objs = numpy.zeros(50, dt)
+        objs['lon'] = rng.uniform(10, 11, 50)
+        objs['lat'] = rng.uniform(45, 46, 50)
+        geos = utils._GeographicObjects(objs)
+        lons, lats = rng.uniform(10, 11, 7), rng.uniform(45, 46, 7)
+        with unittest.mock.patch.object(utils, 'ASSOC_CHUNKSIZE', 3):
+            dists, idxs = geos.query(lons, lats)
+        for lon, lat, dist, idx in zip(lons, lats, dists, idxs):
+            obj, distance = geos.get_closest(lon, lat)
+            self.assertEqual(obj, objs[idx])
+            self.assertAlmostEqual(distance, dist)
+
+
 # NB: utils.assoc is tested in the engine
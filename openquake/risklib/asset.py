@@ -19,12 +19,13 @@ import operator
 import itertools
 import logging
 import csv
+import io
 import os
 import numpy
 import pandas
-from shapely import wkt, geometry
+from shapely import wkt, geometry, prepared
 
-from openquake.baselib import hdf5, general
+from openquake.baselib import hdf5, general, parallel
 from openquake.baselib.node import Node, context
 from openquake.baselib.python3compat import encode, decode
 from openquake.hazardlib import valid, nrml, geo, InvalidFile
@@ -33,9 +34,11 @@ from openquake.risklib import countries
 U8 = numpy.uint8
 U32 = numpy.uint32
 F32 = numpy.float32
+F64 = numpy.float64
 U64 = numpy.uint64
 TWO16 = 2 ** 16
 TWO32 = 2 ** 32
+CSV_CHUNKSIZE = 64 * 1024 ** 2  # split the exposure CSV files in 64 MB
 by_taxonomy = operator.attrgetter('taxonomy')
 ae = numpy.testing.assert_equal
 
@@ -434,14 +437,23 @@ class AssetCollection(object):
         """
         return self.array['taxonomy']
 
+    def get_offsets(self):
+        """
+        :returns: an array of tot_sites + 1 offsets, such that the assets
+                  on the site `sid` are in array[offsets[sid]:offsets[sid+1]]
+        """
+        counts = numpy.bincount(
+            self.array['site_id'], minlength=self.tot_sites)
+        offsets = numpy.zeros(len(counts) + 1, U32)
+        offsets[1:] = numpy.cumsum(counts)
+        return offsets
+
     def assets_by_site(self):
         """
-        :returns: numpy array of lists with the assets by each site
+        :returns: a list of arrays with the assets by each site
         """
-        assets_by_site = [[] for sid in range(self.tot_sites)]
-        for i, ass in enumerate(self.array):
-            assets_by_site[ass['site_id']].append(self[i])
-        return numpy.array(assets_by_site)
+        # the array is sorted by site_id, so the assets by site are views
+        return numpy.split(self.array, self.get_offsets()[1:-1])
 
     # used in the extract API
     def aggregateby(self, tagnames, array):
@@ -577,7 +589,8 @@ class AssetCollection(object):
                  'fields': ' '.join(self.fields),
                  'tagnames': encode(self.tagnames),
                  'nbytes': self.array.nbytes}
-        return dict(array=self.array, tagcol=self.tagcol), attrs
+        return dict(array=self.array, offsets=self.get_offsets(),
+                    tagcol=self.tagcol), attrs
 
     def __fromh5__(self, dic, attrs):
         self.occupancy_periods = attrs['occupancy_periods']
@@ -585,18 +598,30 @@ class AssetCollection(object):
         self.tot_sites = attrs['tot_sites']
         self.fields = attrs['fields'].split()
         self.nbytes = attrs['nbytes']
-        self.array = dic['array'][()]
+        # the array is read lazily, only the pages used are loaded
+        self.array = hdf5.memmap(dic['array'])
         self.tagcol = dic['tagcol']
 
     def __repr__(self):
         return '<%s with %d asset(s)>' % (self.__class__.__name__, len(self))
 
 
+def _compact_dt(values):
+    # float32 if the values can be stored without loss of precision,
+    # otherwise float64
+    arr = numpy.array(values, F64)
+    return F32 if (arr.astype(F32) == arr).all() else F64
+
+
 def build_asset_array(assets_by_site, tagnames=(), time_event=None):
     """
     :param assets_by_site: a list of lists of assets
     :param tagnames: a list of tag names
-    :returns: an array `assetcol`
+    :returns: an array `assetcol` sorted by (site_id, taxonomy)
+
+    The array is compact: the values are stored as float32 when this can
+    be done without loss of precision and the tag indices are stored with
+    the smallest unsigned integer type able to contain them.
     """
     for assets in assets_by_site:
         if len(assets):
@@ -619,48 +644,44 @@ def build_asset_array(assets_by_site, tagnames=(), time_event=None):
     # 'occupants_night', 'occupants_transit']
     retro = ['retrofitted'] if first_asset._retrofitted else []
     float_fields = loss_types + retro
-    int_fields = [(str(name), U32) for name in tagnames
+    int_fields = [str(name) for name in tagnames
                   if name not in ('id', 'site_id')]
     tagi = {str(name): i for i, name in enumerate(tagnames)}
-    asset_dt = numpy.dtype(
-        [('id', (numpy.string_, valid.ASSET_ID_LENGTH)),
-         ('ordinal', U32), ('lon', F32), ('lat', F32),
-         ('site_id', U32), ('number', F32), ('area', F32)] + [
-             (str(name), float) for name in float_fields] + int_fields)
-    num_assets = sum(len(assets) for assets in assets_by_site)
-    assetcol = numpy.zeros(num_assets, asset_dt)
-    asset_ordinal = 0
-    fields = set(asset_dt.fields)
+    taxi = tagi.get('taxonomy', 0)
+    # build the array column by column
+    cols = general.AccumDict(accum=[])
     for sid, assets_ in enumerate(assets_by_site):
-        for asset in assets_:
-            asset.ordinal = asset_ordinal
-            record = assetcol[asset_ordinal]
-            asset_ordinal += 1
-            for field in fields:
-                if field == 'id':
-                    value = asset.asset_id
-                elif field == 'ordinal':
-                    value = asset.ordinal
-                elif field == 'number':
-                    value = asset.number
-                elif field == 'area':
-                    value = asset.area
-                elif field == 'site_id':
-                    value = sid
-                elif field == 'lon':
-                    value = asset.location[0]
-                elif field == 'lat':
-                    value = asset.location[1]
-                elif field.startswith('occupants_'):
+        # the assets are sorted by (site_id, taxonomy), so that the
+        # assets of a site with the same taxonomy are contiguous
+        for asset in sorted(assets_, key=lambda a: a.tagidxs[taxi]):
+            asset.ordinal = len(cols['ordinal'])
+            cols['id'].append(asset.asset_id)
+            cols['ordinal'].append(asset.ordinal)
+            cols['lon'].append(asset.location[0])
+            cols['lat'].append(asset.location[1])
+            cols['site_id'].append(sid)
+            cols['number'].append(asset.number)
+            cols['area'].append(asset.area)
+            for field in float_fields:
+                if field.startswith('occupants_'):
                     value = asset.values[field]
                 elif field == 'retrofitted':
                     value = asset.retrofitted()
-                elif field in tagnames:
-                    value = asset.tagidxs[tagi[field]]
                 else:
-                    name, lt = field.split('-')
-                    value = asset.value(lt, time_event)
-                record[field] = value
+                    value = asset.value(field[6:], time_event)
+                cols[field].append(value)
+            for field in int_fields:
+                cols[field].append(asset.tagidxs[tagi[field]])
+    asset_dt = numpy.dtype(
+        [('id', (numpy.string_, valid.ASSET_ID_LENGTH)),
+         ('ordinal', U32), ('lon', F32), ('lat', F32),
+         ('site_id', U32), ('number', F32), ('area', F32)] + [
+             (name, _compact_dt(cols[name])) for name in float_fields] + [
+             (name, numpy.min_scalar_type(max(cols[name])))
+             for name in int_fields])
+    assetcol = numpy.zeros(len(cols['ordinal']), asset_dt)
+    for field, values in cols.items():
+        assetcol[field] = values
     return assetcol, ' '.join(occupancy_periods)
 
 
@@ -815,6 +836,46 @@ def assets2array(asset_nodes, fields, retrofitted, ignore_missing_costs):
     return array
 
 
+def split_csv(fname, chunksize):
+    """
+    :param fname: path to a CSV file with a header
+    :param chunksize: approximate size of the chunks in bytes
+    :returns: the header line and a list of byte ranges aligned to the
+              records (a quoted field can contain newlines)
+    """
+    with open(fname, 'rb') as f:
+        header = f.readline().decode('utf-8-sig')
+        start = f.tell()
+        ranges = []
+        while True:
+            data = f.read(chunksize)
+            if not data:
+                break
+            line = f.readline()  # move to the end of the line
+            nquotes = data.count(b'"') + line.count(b'"')
+            while nquotes % 2 and line:  # inside a quoted field
+                line = f.readline()
+                nquotes += line.count(b'"')
+            ranges.append((start, f.tell()))
+            start = f.tell()
+    return header, ranges
+
+
+def read_csv_chunk(fname, header, start, stop, conv, rename, monitor):
+    """
+    :returns: a pair (start, array of assets in the range start:stop)
+    """
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start).decode('utf-8')
+    fileobj = io.StringIO(header + data)
+    fileobj.name = '%s[%d:%d]' % (fname, start, stop)
+    array = hdf5.read_csv(fileobj, conv, rename).array
+    array['lon'] = numpy.round(array['lon'], 5)
+    array['lat'] = numpy.round(array['lat'], 5)
+    return start, array
+
+
 class Exposure(object):
     """
     A class to read the exposure from XML/CSV files
@@ -894,15 +955,15 @@ class Exposure(object):
         if tagcol:
             exposure.tagcol = tagcol
         if assetnodes:
-            array = assets2array(
+            arrays = [assets2array(
                 assetnodes, exposure._csv_header(),
                 exposure.retrofitted or calculation_mode == 'classical_bcr',
-                ignore_missing_costs)
+                ignore_missing_costs)]
         else:
-            array = exposure._read_csv()
+            arrays = exposure._read_csv()
         param['relevant_cost_types'] = set(exposure.cost_types['name']) - set(
             ['occupants'])
-        exposure._populate_from(array, param, check_dupl)
+        exposure._populate_from(arrays, param, check_dupl)
         if param['region'] and param['out_of_region']:
             logging.info('Discarded %d assets outside the region',
                          param['out_of_region'])
@@ -947,7 +1008,7 @@ class Exposure(object):
 
     def _read_csv(self):
         """
-        :yields: asset nodes
+        :yields: one array of assets per CSV file
         """
         expected_header = set(self._csv_header('', ''))
         for fname in self.datafiles:
@@ -973,24 +1034,74 @@ class Exposure(object):
         for field in self.occupancy_periods.split():
             conv[field] = float
             rename[field] = 'occupants_' + field
+        dist = ('no' if os.environ.get('OQ_DISTRIBUTE') == 'no'
+                else 'processpool')  # the files are on the local disk
         for fname in self.datafiles:
-            array = hdf5.read_csv(fname, conv, rename).array
-            array['lon'] = numpy.round(array['lon'], 5)
-            array['lat'] = numpy.round(array['lat'], 5)
-            yield from array
-
-    def _populate_from(self, asset_array, param, check_dupl):
-        asset_refs = set()
-        for idx, asset in enumerate(asset_array):
-            asset_id = asset['id']
-            # check_dupl is False only in oq prepare_site_model since
-            # in that case we are only interested in the asset locations
-            if check_dupl and asset_id in asset_refs:
-                raise nrml.DuplicatedID(asset_id)
-            asset_refs.add(param['asset_prefix'] + asset_id)
-            self._add_asset(idx, asset, param)
-
-    def _add_asset(self, idx, asset, param):
+            header, ranges = split_csv(fname, CSV_CHUNKSIZE)
+            allargs = [(fname, header, start, stop, conv, rename)
+                       for start, stop in ranges]
+            if len(allargs) > 1:  # parse the chunks in parallel
+                smap = parallel.Starmap(read_csv_chunk, allargs, dist,
+                                        progress=logging.debug)
+                arrays = dict(smap)
+                yield numpy.concatenate([arrays[s] for s, _ in ranges])
+            elif allargs:
+                yield read_csv_chunk(*allargs[0], monitor=None)[1]
+
+    def _populate_from(self, asset_arrays, param, check_dupl):
+        arrays = [arr for arr in asset_arrays if len(arr)]
+        if not arrays:
+            return
+        # check_dupl is False only in oq prepare_site_model since
+        # in that case we are only interested in the asset locations
+        if check_dupl:
+            ids = numpy.concatenate([arr['id'] for arr in arrays])
+            uniq, first = numpy.unique(ids, return_index=True)
+            if len(uniq) < len(ids):
+                dupl = numpy.ones(len(ids), bool)
+                dupl[first] = False
+                raise nrml.DuplicatedID(ids[dupl][0])
+        region = param['region'] and prepared.prep(param['region'])
+        offset = 0
+        # NB: the Asset objects are still built one per row in the master,
+        # since get_mesh_assets_by_site and the AssetCollection need them;
+        # only the parsing and the checks are done on the whole arrays
+        for array in arrays:
+            idxs = numpy.arange(offset, offset + len(array))
+            offset += len(array)
+            if region:
+                ok = numpy.array([
+                    region.contains(geometry.Point(lon, lat))
+                    for lon, lat in zip(array['lon'], array['lat'])])
+                param['out_of_region'] += len(array) - ok.sum()
+                array, idxs = array[ok], idxs[ok]
+            tagidxs = self._get_tagidxs(array, param['asset_prefix'])
+            for idx, asset, tidxs in zip(idxs, array, tagidxs.tolist()):
+                self._add_asset(idx, asset, tidxs, param)
+
+    def _get_tagidxs(self, array, prefix):
+        # returns the tag indices of the assets as an array of shape (N, T);
+        # the tags are added to the TagCollection in order of appearance
+        tagnames = self.tagcol.tagnames
+        tagidxs = numpy.zeros((len(array), len(tagnames)), U32)
+        for t, tagname in enumerate(tagnames):
+            if tagname in ('exposure', 'country'):
+                tagidxs[:, t] = self.tagcol.add(tagname, prefix)
+                continue
+            uniq, first, inv = numpy.unique(
+                array[tagname], return_index=True, return_inverse=True)
+            idxs = numpy.zeros(len(uniq), U32)
+            for i in numpy.argsort(first):
+                tagvalue = uniq[i]
+                if tagvalue == '?' and tagname != 'taxonomy':
+                    continue  # missing tag
+                elif tagvalue in '?*':
+                    raise ValueError('Invalid tagvalue="%s"' % tagvalue)
+                idxs[i] = self.tagcol.add(tagname, tagvalue)
+            tagidxs[:, t] = idxs[inv]
+        return tagidxs
+
+    def _add_asset(self, idx, asset, tagidxs, param):
         values = {}
         try:
             retrofitted = asset['retrofitted']
@@ -998,20 +1109,8 @@ class Exposure(object):
             retrofitted = None
         asset_id = asset['id']
         prefix = param['asset_prefix']
-        # FIXME: in case of an exposure split in CSV files the line number
-        # is None because param['fname'] points to the .xml file :-(
-        taxonomy = asset['taxonomy']
         number = asset['number']
         location = asset['lon'], asset['lat']
-        if param['region'] and not geometry.Point(*location).within(
-                param['region']):
-            param['out_of_region'] += 1
-            return
-        dic = {tagname: asset[tagname] for tagname in self.tagcol.tagnames
-               if tagname not in ('country', 'exposure') and
-               asset[tagname] != '?'}
-        dic['taxonomy'] = taxonomy
-        idxs = self.tagcol.add_tags(dic, prefix)
         tot_occupants = 0
         num_occupancies = 0
         for name in asset.dtype.names:
@@ -1042,8 +1141,8 @@ class Exposure(object):
             area = asset['area']
         except ValueError:
             area = 1
-        ass = Asset(prefix + asset_id, idx, idxs, number, location, values,
-                    area, retrofitted, self.cost_calculator)
+        ass = Asset(prefix + asset_id, idx, tagidxs, number, location,
+                    values, area, retrofitted, self.cost_calculator)
         self.assets.append(ass)
 
     def get_mesh_assets_by_site(self):
@@ -16,36 +16,42 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
-import logging
 import numpy
 
 from openquake.baselib import hdf5
 from openquake.baselib.general import group_array, AccumDict
 from openquake.risklib import scientific
+from openquake.risklib.scientific import pairwise
+from openquake.risklib.riskmodels import get_values
 
 U32 = numpy.uint32
 F32 = numpy.float32
+TWO32 = 2 ** 32
 
 
-def get_assets_by_taxo(assets, tempname=None):
+def get_assets_by_taxo(assets, epsgetter=None):
     """
     :param assets: an array of assets
-    :param tempname: hdf5 file where the epsilons are (or None)
-    :returns: assets_by_taxo with attributes eps and idxs
+    :param epsgetter: an :class:`EpsilonGetter` instance (or None)
+    :returns: assets_by_taxo with attributes epsgetter and idxs
     """
-    assets_by_taxo = AccumDict(group_array(assets, 'taxonomy'))
+    taxos = assets['taxonomy']
+    if len(taxos) and (taxos[1:] >= taxos[:-1]).all():
+        # fast lane for assets sorted by taxonomy, as it happens for the
+        # assets on a site coming from an AssetCollection: the groups are
+        # contiguous views and no reordering is needed
+        bounds = numpy.concatenate(
+            [[0], numpy.flatnonzero(taxos[1:] != taxos[:-1]) + 1,
+             [len(taxos)]])
+        assets_by_taxo = AccumDict({taxos[start]: assets[start:stop]
+                                    for start, stop in pairwise(bounds)})
+        assets_by_taxo.idxs = slice(None)
+    else:
+        assets_by_taxo = AccumDict(group_array(assets, 'taxonomy'))
+        assets_by_taxo.idxs = numpy.argsort(numpy.concatenate([
+            a['ordinal'] for a in assets_by_taxo.values()]))
     assets_by_taxo.assets = assets
-    assets_by_taxo.idxs = numpy.argsort(numpy.concatenate([
-        a['ordinal'] for a in assets_by_taxo.values()]))
-    assets_by_taxo.eps = {}
-    if tempname is None:  # no epsilons
-        return assets_by_taxo
-    # otherwise read the epsilons and group them by taxonomy
-    with hdf5.File(tempname, 'r') as h5:
-        dset = h5['epsilon_matrix']
-        for taxo, assets in assets_by_taxo.items():
-            lst = [dset[aid] for aid in assets['ordinal']]
-            assets_by_taxo.eps[taxo] = numpy.array(lst)
+    assets_by_taxo.epsgetter = epsgetter
     return assets_by_taxo
 
 
@@ -83,10 +89,26 @@ def get_output(crmodel, assets_by_taxo, haz, rlzi=None):
     if rlzi is not None:
         dic['rlzi'] = rlzi
     for lt in crmodel.loss_types:
+        vtable = None if hasattr(haz, 'array') else crmodel.get_vtable(lt)
+        if vtable:  # fast lane, compute all the taxonomies at once
+            assets = assets_by_taxo.assets
+            if assets_by_taxo.epsgetter:
+                epsilons = assets_by_taxo.epsgetter(assets['ordinal'], eids)
+            else:  # no CoVs
+                epsilons = ()
+            gmvs_by_imt = {}
+            for imt in numpy.unique(vtable.imts):
+                dat = data[alias.get(imt, imt)]
+                gmvs_by_imt[imt] = (dat.to_numpy() if hasattr(dat, 'to_numpy')
+                                    else numpy.array(dat))
+            ratios = vtable(assets['taxonomy'], gmvs_by_imt, epsilons)
+            rm = crmodel[next(iter(crmodel))]
+            dic[lt] = ratios * get_values(lt, assets, rm.time_event)[:, None]
+            continue
         ls = []
         for taxonomy, assets_ in assets_by_taxo.items():
-            if len(assets_by_taxo.eps):
-                epsilons = assets_by_taxo.eps[taxonomy][:, eids]
+            if assets_by_taxo.epsgetter:
+                epsilons = assets_by_taxo.epsgetter(assets_['ordinal'], eids)
             else:  # no CoVs
                 epsilons = ()
             arrays = []
@@ -124,13 +146,14 @@ class RiskInput(object):
             aids.append(asset['ordinal'])
         self.aids = numpy.array(aids, numpy.uint32)
 
-    def gen_outputs(self, crmodel, monitor, tempname=None, haz=None):
+    def gen_outputs(self, crmodel, monitor, epsgetter=None, haz=None):
         """
         Group the assets per taxonomy and compute the outputs by using the
         underlying riskmodels. Yield one output per realization.
 
         :param crmodel: a CompositeRiskModel instance
         :param monitor: a monitor object used to measure the performance
+        :param epsgetter: an :class:`EpsilonGetter` instance (or None)
         """
         self.monitor = monitor
         hazard_getter = self.hazard_getter
@@ -142,7 +165,7 @@ class RiskInput(object):
             # small arrays are passed (one per realization) instead of
             # a long array with all realizations; ebrisk does the right
             # thing since it calls get_output directly
-            assets_by_taxo = get_assets_by_taxo(self.assets, tempname)
+            assets_by_taxo = get_assets_by_taxo(self.assets, epsgetter)
             if hasattr(haz, 'groupby'):  # DataFrame
                 for (sid, rlz), df in haz.groupby(['sid', 'rlz']):
                     yield get_output(crmodel, assets_by_taxo, df, rlz)
@@ -156,53 +179,52 @@ class RiskInput(object):
             self.__class__.__name__, sid, len(self.aids))
 
 
-# used in scenario_risk
-def make_eps(asset_array, num_samples, seed, correlation):
+class EpsilonGetter(object):
     """
-    :param asset_array: an array of assets
-    :param int num_samples: the number of ruptures
-    :param int seed: a random seed
-    :param float correlation: the correlation coefficient
-    :returns: epsilons matrix of shape (num_assets, num_samples)
+    Callable returning the epsilons for given asset ordinals and event IDs.
+    The epsilons are generated on the fly with a counter-based generator,
+    so that they are the same on every worker and nothing has to be stored.
+    A nonzero `asset_correlation` is managed by adding a component shared
+    by all the assets affected by the same event.
+
+    :param master_seed: the master seed of the calculation
+    :param asset_correlation: a number in the range [0, 1]
     """
-    assets_by_taxo = group_array(asset_array, 'taxonomy')
-    eps = numpy.zeros((len(asset_array), num_samples), numpy.float32)
-    for taxonomy, assets in assets_by_taxo.items():
-        shape = (len(assets), num_samples)
-        logging.info('Building %s epsilons for taxonomy %s', shape, taxonomy)
-        zeros = numpy.zeros(shape)
-        epsilons = scientific.make_epsilons(zeros, seed, correlation)
-        for asset, epsrow in zip(assets, epsilons):
-            eps[asset['ordinal']] = epsrow
-    return eps
-
-
-def cache_epsilons(dstore, oq, assetcol, crmodel, E):
+    def __init__(self, master_seed, asset_correlation):
+        self.master_seed = master_seed
+        self.asset_correlation = asset_correlation or 0
+
+    def __call__(self, aids, eids):
+        """
+        :param aids: an array of A asset ordinals
+        :param eids: an array of E event IDs
+        :returns: an array of epsilons of shape (A, E)
+        """
+        rho = self.asset_correlation
+        if rho == 1:  # the same epsilons for all assets
+            eps = scientific.counter_normal(
+                self.master_seed, [TWO32 - 1], eids)
+            return numpy.repeat(eps, len(aids), axis=0)
+        eps = scientific.counter_normal(self.master_seed, aids, eids)
+        if rho:
+            common = scientific.counter_normal(
+                self.master_seed, [TWO32 - 1], eids)
+            eps = numpy.sqrt(1 - rho) * eps + numpy.sqrt(rho) * common
+        return eps
+
+    def __repr__(self):
+        return '<%s seed=%d, correlation=%s>' % (
+            self.__class__.__name__, self.master_seed, self.asset_correlation)
+
+
+def get_epsgetter(oq, crmodel):
     """
-    Do nothing if there are no coefficients of variation of ignore_covs is
-    set. Otherwise, generate an epsilon matrix of shape (A, E) and save it
-    in the cache file, by returning the path to it.
+    :returns: None if there are no coefficients of variation or ignore_covs
+              is set, otherwise an :class:`EpsilonGetter` instance
     """
     if oq.ignore_covs or not crmodel.covs or 'LN' not in crmodel.distributions:
         return
-    A = len(assetcol)
-    logging.info('Storing the epsilon matrix in %s', dstore.tempname)
-    if oq.calculation_mode == 'scenario_risk':
-        eps = make_eps(assetcol.array, E, oq.master_seed, oq.asset_correlation)
-    else:  # event based
-        if oq.asset_correlation:
-            numpy.random.seed(oq.master_seed)
-            eps = numpy.array([numpy.random.normal(size=E)] * A)
-        else:
-            seeds = oq.master_seed + numpy.arange(E)
-            eps = numpy.zeros((A, E), F32)
-            for i, seed in enumerate(seeds):
-                numpy.random.seed(seed)
-                eps[:, i] = numpy.random.normal(size=A)
-    with hdf5.File(dstore.tempname, 'w') as cache:
-        cache['sitecol'] = dstore['sitecol']
-        cache['epsilon_matrix'] = eps
-    return dstore.tempname
+    return EpsilonGetter(oq.master_seed, oq.asset_correlation)
 
 
 def str2rsi(key):
@@ -282,14 +282,30 @@ class RiskModel(object):
             a composite array (loss, poe) of shape (A, C)
         """
         n = len(assets)
-        vf = self.risk_functions[loss_type, 'vulnerability']
-        lratios = self.loss_ratios[loss_type]
-        imls = self.hazard_imtls[vf.imt]
+        lratios, poes = self.classical_poes(loss_type, hazard_curve)
         values = get_values(loss_type, assets)
-        lrcurves = numpy.array(
-            [scientific.classical(vf, imls, hazard_curve, lratios)] * n)
+        lrcurves = numpy.array([[lratios, poes]] * n)
         return rescale(lrcurves, values)
 
+    def classical_poes(self, loss_type, hazard_curves):
+        """
+        :param loss_type: the loss type considered
+        :param hazard_curves: an array of hazard curves of shape (..., H)
+        :returns: the C loss ratios and the PoEs of shape (..., C)
+
+        The loss ratio exceedance matrix is computed only once per loss type
+        and then applied to all the hazard curves with a matrix product.
+        """
+        vf = self.risk_functions[loss_type, 'vulnerability']
+        lratios = self.loss_ratios[loss_type]
+        lrems = vars(self).setdefault('_lrem', {})
+        if loss_type not in lrems:
+            lrems[loss_type] = vf.loss_ratio_exceedance_matrix(lratios)
+        lrem = lrems[loss_type]
+        poes = scientific.classical_poes(
+            lrem, vf.mean_imls(), self.hazard_imtls[vf.imt], hazard_curves)
+        return lratios, poes
+
     def classical_bcr(self, loss_type, assets, hazard, eids=None, eps=None):
         """
         :param loss_type: the loss type
@@ -384,17 +400,24 @@ class RiskModel(object):
 
         where N is the number of points and D the number of damage states.
         """
+        damage = self.classical_fractions(loss_type, hazard_curve)
+        return assets['number'][:, None] * damage
+
+    def classical_fractions(self, loss_type, hazard_curves):
+        """
+        :param loss_type: the loss type
+        :param hazard_curves: an array of hazard curves of shape (..., H)
+        :returns: the damage distribution of a single building, (..., D)
+        """
         ffl = self.risk_functions[loss_type, 'fragility']
         hazard_imls = self.hazard_imtls[ffl.imt]
         debug = False  # assets['id'] == b'a5' to debug case_master
         rtime = self.risk_investigation_time or self.investigation_time
-        damage = scientific.classical_damage(
-            ffl, hazard_imls, hazard_curve,
+        return scientific.classical_damage(
+            ffl, hazard_imls, hazard_curves,
             investigation_time=self.investigation_time,
             risk_investigation_time=rtime,
             steps_per_interval=self.steps_per_interval, debug=debug)
-        res = numpy.array([a['number'] * damage for a in assets])
-        return res
 
 
 # NB: the approach used here relies on the convention of having the
@@ -694,6 +717,44 @@ class CompositeRiskModel(collections.abc.Mapping):
             weights.append(weight)
         return rmodels, weights
 
+    def get_vtable(self, loss_type):
+        """
+        :param loss_type: a loss type
+        :returns: a VulnerabilityTable or None if the vulnerability
+                  functions cannot be vectorized (i.e. for the PMF and Beta
+                  distributions, which are using a random generator)
+        """
+        try:
+            return self._vtables[loss_type]
+        except AttributeError:
+            self._vtables = {}
+        except KeyError:
+            pass
+        self._vtables[loss_type] = None
+        vfs, vidx, branches = [], {}, []
+        for items in self.tmap[loss_type]:
+            brs = []
+            for riskid, weight in items:
+                if riskid == '?':  # the taxonomy with index 0
+                    continue
+                rm = self._riskmodels[riskid]
+                meth = getattr(rm, rm.calcmode, None)
+                vf = rm.risk_functions.get((loss_type, 'vulnerability'))
+                if (getattr(meth, '__func__', None) is not
+                        RiskModel.event_based_risk or vf is None or
+                        type(vf) is not scientific.VulnerabilityFunction or
+                        vf.distribution_name != 'LN' and vf.covs.any()):
+                    return
+                if riskid not in vidx:
+                    vidx[riskid] = len(vfs)
+                    vfs.append(vf)
+                brs.append((vidx[riskid], weight))
+            branches.append(brs)
+        if vfs:
+            self._vtables[loss_type] = scientific.VulnerabilityTable(
+                vfs, branches)
+        return self._vtables[loss_type]
+
     def __iter__(self):
         return iter(sorted(self._riskmodels))
 
@@ -29,13 +29,14 @@ from functools import lru_cache
 import numpy
 import pandas
 from numpy.testing import assert_equal
-from scipy import interpolate, stats, random
+from scipy import interpolate, special, stats, random
 
 from openquake.baselib.general import CallableDict, AccumDict
 from openquake.hazardlib.stats import compute_stats2
 
 F64 = numpy.float64
 F32 = numpy.float32
+U64 = numpy.uint64
 U32 = numpy.uint32
 U16 = numpy.uint16
 
@@ -473,6 +474,107 @@ class VulnerabilityModel(dict):
             self.__class__.__name__, self.lossCategory, sorted(self))
 
 
+class VulnerabilityTable(object):
+    """
+    A set of V discrete vulnerability functions for the same loss type,
+    stacked into padded arrays of shape (V, P), P being the maximum number
+    of intensity levels. The loss ratios for all the assets on a site are
+    computed with a single vectorized interpolation per IMT, including
+    the average on the branches of the taxonomy mapping.
+
+    :param vfs: a list of V VulnerabilityFunction instances
+    :param branches: a list of lists [(vf index, weight), ...] per taxonomy
+    """
+    def __init__(self, vfs, branches):
+        V = len(vfs)
+        P = max(len(vf.imls) for vf in vfs)
+        self.imts = numpy.array([vf.imt for vf in vfs])
+        # the padding repeats the last point, so that the rows stay sorted
+        self.imls = numpy.zeros((V, P))
+        self.mlrs = numpy.zeros((V, P))
+        self.covs = numpy.zeros((V, P))
+        self.npoints = numpy.zeros(V, U32)
+        for v, vf in enumerate(vfs):
+            n = len(vf.imls)
+            self.npoints[v] = n
+            for arr, values in ((self.imls, vf.imls),
+                                (self.mlrs, vf.mean_loss_ratios),
+                                (self.covs, vf.covs)):
+                arr[v, :n] = values
+                arr[v, n:] = values[-1]
+        # offset of each row, so that the flattened imls are sorted
+        self.offsets = numpy.arange(V) * (self.imls.max() + 1.)
+        self.flat = (self.imls + self.offsets[:, None]).flatten()
+        T = len(branches)
+        B = max(len(brs) for brs in branches)
+        self.rows = numpy.zeros((T, B), U32)
+        self.weights = numpy.zeros((T, B))
+        for t, brs in enumerate(branches):
+            for b, (v, weight) in enumerate(brs):
+                self.rows[t, b] = v
+                self.weights[t, b] = weight
+
+    def interpolate(self, vidxs, gmvs):
+        """
+        :param vidxs: V' indices of vulnerability functions
+        :param gmvs: E ground motion values for the IMT of the functions
+        :returns: interpolated loss ratios and covs of shape (V', E)
+
+        The gmvs are clipped to the maximum IML and the loss ratios and
+        covs are zero below the minimum IML.
+        """
+        P = self.imls.shape[1]
+        imls = self.imls[vidxs]  # shape (V', P)
+        npoints = self.npoints[vidxs]
+        gmvs = numpy.minimum(gmvs, imls[numpy.arange(len(vidxs)),
+                                        npoints - 1][:, None])  # (V', E)
+        ok = gmvs >= imls[:, [0]]
+        pos = numpy.searchsorted(
+            self.flat, gmvs + self.offsets[vidxs, None], 'right') - 1
+        # index k of the interval imls[k] <= gmv <= imls[k + 1]
+        k = numpy.clip(pos - vidxs[:, None] * P, 0, npoints[:, None] - 2)
+        rows = vidxs[:, None]
+        x0, x1 = self.imls[rows, k], self.imls[rows, k + 1]
+        frac = (gmvs - x0) / (x1 - x0)
+        means = self.mlrs[rows, k] + frac * (
+            self.mlrs[rows, k + 1] - self.mlrs[rows, k])
+        covs = self.covs[rows, k] + frac * (
+            self.covs[rows, k + 1] - self.covs[rows, k])
+        return numpy.where(ok, means, 0.), numpy.where(ok, covs, 0.)
+
+    def __call__(self, taxonomies, gmvs_by_imt, epsilons=()):
+        """
+        :param taxonomies: A taxonomy indices
+        :param gmvs_by_imt: a dictionary imt -> E ground motion values
+        :param epsilons: an array of shape (A, E) or an empty tuple
+        :returns: an array of loss ratios of shape (A, E)
+        """
+        rows = self.rows[taxonomies]  # shape (A, B)
+        weights = self.weights[taxonomies]  # shape (A, B)
+        vidxs, inv = numpy.unique(rows, return_inverse=True)
+        inv = inv.reshape(rows.shape)
+        E = len(next(iter(gmvs_by_imt.values())))
+        means = numpy.zeros((len(vidxs), E))
+        covs = numpy.zeros((len(vidxs), E))
+        for imt in numpy.unique(self.imts[vidxs]):
+            idx, = numpy.where(self.imts[vidxs] == imt)
+            means[idx], covs[idx] = self.interpolate(
+                vidxs[idx], gmvs_by_imt[imt])
+        ratios = numpy.zeros((len(rows), E))
+        for b in range(rows.shape[1]):
+            lrs = means[inv[:, b]]  # shape (A, E)
+            if len(epsilons):  # lognormal sampling
+                cvs = covs[inv[:, b]]
+                lrs = lrs / numpy.sqrt(1 + cvs ** 2) * numpy.exp(
+                    epsilons * numpy.sqrt(numpy.log(cvs ** 2 + 1)))
+            ratios += weights[:, b, None] * lrs
+        return ratios
+
+    def __repr__(self):
+        return '<%s with %d functions>' % (
+            self.__class__.__name__, len(self.imts))
+
+
 # ############################## fragility ############################### #
 
 class FragilityFunctionContinuous(object):
@@ -772,6 +874,42 @@ def make_epsilons(matrix, seed, correlation):
         means_vector, covariance_matrix, samples).transpose()
 
 
+def _splitmix64(x):
+    # the SplitMix64 finalizer, a bijective hash on uint64 arrays;
+    # numpy integer arithmetic wraps around, which is what we want
+    x = x + U64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> U64(30))) * U64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> U64(27))) * U64(0x94D049BB133111EB)
+    return x ^ (x >> U64(31))
+
+
+def counter_normal(seed, aids, eids):
+    """
+    Counter-based generator of standard normal numbers: the number
+    associated to the triple (seed, aid, eid) does not depend on the other
+    aids and eids, so it can be regenerated on any worker without storing
+    anything.
+
+    :param seed: a non-negative integer
+    :param aids: an array of A asset ordinals
+    :param eids: an array of E event IDs
+    :returns: an array of shape (A, E) of 32 bit floats
+
+    >>> counter_normal(42, [0, 1], [5, 7])
+    array([[ 0.2628968 , -0.92860603],
+           [-0.00304649, -1.0638828 ]], dtype=float32)
+    >>> counter_normal(42, [1], [7])
+    array([[-1.0638828]], dtype=float32)
+    """
+    aids = numpy.array(aids, U64)
+    eids = numpy.array(eids, U64)
+    keys = _splitmix64((U64(seed) << U64(32)) + aids)
+    bits = _splitmix64(keys[:, None] + _splitmix64(eids)[None, :])
+    # take the upper 53 bits to build a uniform number in the open (0, 1)
+    uniform = ((bits >> U64(11)).astype(F64) + .5) / 2. ** 53
+    return special.ndtri(uniform).astype(F32)
+
+
 @DISTRIBUTIONS.add('LN')
 class LogNormalDistribution(Distribution):
     """
@@ -934,7 +1072,7 @@ def classical_damage(
     :param hazard_imls:
         Intensity Measure Levels
     :param hazard_poes:
-        hazard curve
+        hazard curve, or an array of hazard curves of shape (..., H)
     :param investigation_time:
         hazard investigation time
     :param risk_investigation_time:
@@ -943,7 +1081,10 @@ def classical_damage(
         steps per interval
     :returns:
         an array of M probabilities of occurrence where M is the numbers
-        of damage states.
+        of damage states, with shape (..., M) for many hazard curves.
+
+    The fragility functions are evaluated only once on the IMLs and
+    all the hazard curves are convolved with a single matrix product.
     """
     if steps_per_interval > 1:  # interpolate
         imls = numpy.array(fragility_functions._interp_imls)
@@ -956,16 +1097,18 @@ def classical_damage(
         imls = hazard_imls
         poes = numpy.array(hazard_poes)
     afe = annual_frequency_of_exceedence(poes, investigation_time)
-    annual_frequency_of_occurrence = pairwise_diff(
-        pairwise_mean([afe[0]] + list(afe) + [afe[-1]]))
-    poes_per_damage_state = []
-    for ff in fragility_functions:
-        fx = annual_frequency_of_occurrence @ ff(imls)
-        if debug:
-            print(fx)
-        poe_per_damage_state = 1. - numpy.exp(-fx * risk_investigation_time)
-        poes_per_damage_state.append(poe_per_damage_state)
-    poos = pairwise_diff([1] + poes_per_damage_state + [0])
+    afe = numpy.concatenate([afe[..., :1], afe, afe[..., -1:]], axis=-1)
+    means = (afe[..., :-1] + afe[..., 1:]) / 2
+    annual_frequency_of_occurrence = means[..., :-1] - means[..., 1:]
+    ffs = numpy.array([ff(imls) for ff in fragility_functions])  # (D-1, I)
+    fx = annual_frequency_of_occurrence @ ffs.T
+    if debug:
+        print(fx)
+    poes_per_damage_state = 1. - numpy.exp(-fx * risk_investigation_time)
+    shp = poes_per_damage_state.shape[:-1] + (1,)
+    poes = numpy.concatenate(
+        [numpy.ones(shp), poes_per_damage_state, numpy.zeros(shp)], axis=-1)
+    poos = poes[..., :-1] - poes[..., 1:]
     return poos
 
 #
@@ -991,23 +1134,32 @@ def classical(vulnerability_function, hazard_imls, hazard_poes, loss_ratios):
     assert len(hazard_imls) == len(hazard_poes), (
         len(hazard_imls), len(hazard_poes))
     vf = vulnerability_function
-    imls = vf.mean_imls()
     lrem = vf.loss_ratio_exceedance_matrix(loss_ratios)
+    poes = classical_poes(lrem, vf.mean_imls(), hazard_imls, hazard_poes)
+    return numpy.array([loss_ratios, poes])
+
 
+def classical_poes(lrem, mean_imls, hazard_imls, hazard_poes):
+    """
+    :param lrem: a loss ratio exceedance matrix of shape (C, I)
+    :param mean_imls: the I + 1 mean IMLs of the vulnerability function
+    :param hazard_imls: the H intensity measure levels of the hazard
+    :param hazard_poes: an array of hazard curves of shape (..., H)
+    :returns: the PoEs of the C loss ratios, with shape (..., C)
+
+    The hazard curves are interpolated on the mean IMLs and the
+    probabilities of occurrence are multiplied by the LREM, so that
+    all the curves are computed with a single matrix product.
+    """
     # saturate imls to hazard imls
-    min_val, max_val = hazard_imls[0], hazard_imls[-1]
-    numpy.putmask(imls, imls < min_val, min_val)
-    numpy.putmask(imls, imls > max_val, max_val)
+    imls = numpy.clip(mean_imls, hazard_imls[0], hazard_imls[-1])
 
-    # interpolate the hazard curve
+    # interpolate the hazard curves
     poes = interpolate.interp1d(hazard_imls, hazard_poes)(imls)
 
     # compute the poos
-    pos = pairwise_diff(poes)
-    lrem_po = numpy.empty(lrem.shape)
-    for idx, po in enumerate(pos):
-        lrem_po[:, idx] = lrem[:, idx] * po  # column * po
-    return numpy.array([loss_ratios, lrem_po.sum(axis=1)])
+    pos = poes[..., :-1] - poes[..., 1:]
+    return pos @ lrem.T
 
 
 # used in classical_risk only
@@ -1068,8 +1220,8 @@ def conditional_loss_ratio(loss_ratios, poes, probability):
 def insured_losses(losses, deductible, insured_limit):
     """
     :param losses: an array of ground-up loss ratios
-    :param float deductible: the deductible limit in fraction form
-    :param float insured_limit: the insured limit in fraction form
+    :param deductible: the deductible limit in fraction form
+    :param insured_limit: the insured limit in fraction form
 
     Compute insured losses for the given asset and losses, from the point
     of view of the insurance company. For instance:
@@ -1080,11 +1232,15 @@ def insured_losses(losses, deductible, insured_limit):
     - if the loss is 3 (< 5) the company does not pay anything
     - if the loss is 20 the company pays 20 - 5 = 15
     - if the loss is 101 the company pays 100 - 5 = 95
+
+    The deductible and the limit can also be arrays broadcastable to the
+    losses, for instance of shape (A, 1) for losses of shape (A, E):
+
+    >>> insured_losses(numpy.array([[3, 20], [3, 20]]), [[5], [1]], 10)
+    array([[0, 5],
+           [2, 9]])
     """
-    return numpy.piecewise(
-        losses,
-        [losses < deductible, losses > insured_limit],
-        [0, insured_limit - deductible, lambda x: x - deductible])
+    return numpy.clip(losses, deductible, insured_limit) - deductible
 
 
 def insured_loss_curve(curve, deductible, insured_limit):
@@ -1167,13 +1323,47 @@ def loss_maps(curves, conditional_loss_poes):
     loss_maps_dt = numpy.dtype([('poe-%s' % poe, F32)
                                 for poe in conditional_loss_poes])
     loss_maps = numpy.zeros(curves.shape, loss_maps_dt)
-    for idx, curve in numpy.ndenumerate(curves):
-        for poe in conditional_loss_poes:
-            loss_maps['poe-%s' % poe][idx] = conditional_loss_ratio(
-                curve['losses'], curve['poes'], poe)
+    for poe in conditional_loss_poes:
+        loss_maps['poe-%s' % poe] = conditional_loss_ratios(
+            curves['losses'], curves['poes'], poe)
     return loss_maps
 
 
+def conditional_loss_ratios(loss_ratios, poes, probability):
+    """
+    Vectorized version of :func:`conditional_loss_ratio`.
+
+    :param loss_ratios: an array of non-decreasing loss ratios (..., C)
+    :param poes: an array of non-increasing PoEs of shape (..., C)
+    :param probability: the probability used to interpolate the curves
+    :returns: an array of loss ratios of shape (...)
+
+    >>> conditional_loss_ratios([[.1, .2, .3], [.1, .2, .3]],
+    ...                         [[.8, .6, .2], [.8, .4, .4]], .4)
+    array([0.25, 0.3 ])
+    """
+    loss_ratios = numpy.asarray(loss_ratios, float)
+    poes = numpy.asarray(poes, float)
+    C = poes.shape[-1]
+    assert C >= 3, loss_ratios
+    # index j of the interval poes[j] > probability > poes[j + 1]
+    j = numpy.clip(C - 1 - (poes <= probability).sum(axis=-1), 0, C - 2)
+    j = j[..., None]
+    x1 = numpy.take_along_axis(poes, j, -1)[..., 0]
+    x2 = numpy.take_along_axis(poes, j + 1, -1)[..., 0]
+    y1 = numpy.take_along_axis(loss_ratios, j, -1)[..., 0]
+    y2 = numpy.take_along_axis(loss_ratios, j + 1, -1)[..., 0]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        res = (y2 - y1) / (x2 - x1) * (probability - x1) + y1
+    eq = poes == probability
+    res = numpy.where(eq.any(axis=-1),
+                      numpy.where(eq, loss_ratios, -numpy.inf).max(axis=-1),
+                      res)
+    res = numpy.where(probability < poes[..., -1], loss_ratios[..., -1], res)
+    res = numpy.where(probability > poes[..., 0], 0., res)
+    return numpy.where(numpy.isnan(poes).all(axis=-1), numpy.nan, res)
+
+
 def broadcast(func, composite_array, *args):
     """
     Broadcast an array function over a composite array
@@ -1332,27 +1522,62 @@ def losses_by_period(losses, return_periods, num_events=None, eff_time=None):
             % (num_events, num_losses))
     if eff_time is None:
         eff_time = return_periods[-1]
-    losses = numpy.sort(losses)
-    # num_losses < num_events: just add zeros
-    num_zeros = num_events - num_losses
-    if num_zeros:
-        newlosses = numpy.zeros(shp + (num_events,), losses.dtype)
-        newlosses[..., num_events-num_losses:num_events] = losses
-        losses = newlosses
-    periods = eff_time / numpy.arange(num_events, 0., -1)
-    num_left = sum(1 for rp in return_periods if rp < periods[0])
-    num_right = sum(1 for rp in return_periods if rp > periods[-1])
-    rperiods = [rp for rp in return_periods if periods[0] <= rp <= periods[-1]]
-    curve = numpy.zeros(shp + (len(return_periods),), losses.dtype)
-    logr, logp = numpy.log(rperiods), numpy.log(periods)
-    for idx, _ in numpy.ndenumerate(losses[..., 0]):
-        tup = idx + (slice(num_left, P-num_right),)
-        curve[tup] = numpy.interp(logr, logp, losses[idx])
-        tup = idx + (slice(P-num_right, None),)
-        curve[tup] = numpy.nan
+    ranks, weights, left, right = period_ranks(
+        return_periods, [num_events], eff_time)
+    # positions in the sorted losses, negative for the padding zeros
+    pos = ranks[0] - (num_events - num_losses)
+    # extract only the order statistics needed, without a full sort
+    kth = numpy.unique(pos[pos >= 0])
+    losses = numpy.partition(losses, kth) if len(kth) else losses
+    vals = numpy.where(pos >= 0, losses[..., numpy.maximum(pos, 0)], 0)
+    curve = numpy.zeros(shp + (P,), losses.dtype)
+    curve[:] = vals[..., 0] + weights[0] * (vals[..., 1] - vals[..., 0])
+    curve[..., left[0]] = 0
+    curve[..., right[0]] = numpy.nan
     return curve
 
 
+def period_ranks(return_periods, num_events, eff_time):
+    """
+    The loss for the return period `rp` is obtained by interpolating in
+    log space the sorted losses (padded with zeros up to `num_events`)
+    associated to the periods `eff_time / (num_events - j)`, j being the
+    rank. Since the periods are known in closed form, the ranks needed
+    can be computed without looking at the losses.
+
+    :param return_periods: P ordered return periods
+    :param num_events: S numbers of events (one per group of losses)
+    :param eff_time: investigation_time * ses_per_logic_tree_path
+    :returns:
+        ranks of shape (S, P, 2), interpolation weights of shape (S, P)
+        and two boolean arrays of shape (S, P) for the return periods
+        below the minimum period (zero losses) and above eff_time (NaN)
+
+    >>> ranks, weights, left, right = period_ranks([1, 5, 20], [10], 10)
+    >>> ranks
+    array([[[0, 1],
+            [8, 9],
+            [9, 9]]])
+    >>> right
+    array([[False, False,  True]])
+    """
+    rps = numpy.array(return_periods, float)
+    ne = numpy.array(num_events, int)[:, None]  # shape (S, 1)
+    # the rank j such that periods[j] <= rp < periods[j + 1]
+    j = numpy.floor(ne - eff_time / rps).astype(int)
+    j = numpy.clip(j, 0, ne - 1)
+    j1 = numpy.minimum(j + 1, ne - 1)
+    logp0 = numpy.log(eff_time / (ne - j))
+    logp1 = numpy.log(eff_time / (ne - j1))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        weights = numpy.where(
+            j1 > j, (numpy.log(rps) - logp0) / (logp1 - logp0), 0)
+    weights = numpy.clip(weights, 0, 1)
+    left = rps < eff_time / ne
+    right = numpy.repeat([rps > eff_time], len(ne), axis=0)
+    return numpy.stack([j, j1], axis=-1), weights, left, right
+
+
 class LossCurvesMapsBuilder(object):
     """
     Build losses curves and maps for all loss types at the same time.
@@ -1418,6 +1643,37 @@ class LossCurvesMapsBuilder(object):
         return losses_by_period(
             losses, self.return_periods, self.num_events[rlzi], self.eff_time)
 
+    # used in post_risk
+    def build_curves_segments(self, losses, offsets, rlzs):
+        """
+        Build the loss curves for S groups of losses at once.
+
+        :param losses: an array of shape (L, N) with S nonempty segments
+        :param offsets: an array of S + 1 offsets
+        :param rlzs: an array of S realization indices
+        :returns: an array of shape (S, L, P)
+        """
+        num_events = [self.num_events[r] for r in rlzs]
+        counts = numpy.diff(offsets)
+        num_zeros = numpy.array(num_events) - counts
+        if (num_zeros < 0).any():
+            raise ValueError('There are not enough events to compute the '
+                             'loss curves')
+        ranks, weights, left, right = period_ranks(
+            self.return_periods, num_events, self.eff_time)
+        pos = ranks - num_zeros[:, None, None]  # shape (S, P, 2)
+        losses = numpy.array(losses)  # copy, it is partitioned in place
+        for s, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:])):
+            kth = numpy.unique(pos[s][pos[s] >= 0])
+            if len(kth):
+                losses[:, start:stop].partition(kth)
+        idx = offsets[:-1, None, None] + numpy.maximum(pos, 0)
+        vals = numpy.where(pos >= 0, losses[:, idx], 0)  # (L, S, P, 2)
+        curves = vals[..., 0] + weights * (vals[..., 1] - vals[..., 0])
+        curves[:, left] = 0
+        curves[:, right] = numpy.nan
+        return curves.transpose(1, 0, 2).astype(losses.dtype)
+
 
 class AggLossTable(AccumDict):
     """
@@ -1425,7 +1681,7 @@ class AggLossTable(AccumDict):
     types (primary + secondary).
     :param aggkey: a dictionary tuple -> integer
     :param loss_types: a list of primary loss types
-    :param sec_losses: a list of SecondaryLosses (can be empty)
+    :param sec_losses: a list of SecondaryLoss instances (can be empty)
     """
     @classmethod
     def new(cls, aggkey, loss_types, sec_losses=()):
@@ -1446,11 +1702,6 @@ class AggLossTable(AccumDict):
         eids = out.eids
         assets = out.assets
 
-        # initialize secondary losses outputs, if any
-        for sec_loss in self.sec_losses:
-            for k in sec_loss.outputs:
-                setattr(out, k, numpy.zeros((len(assets), len(eids))))
-
         # populate outputs
         if aggby == ['id']:
             idxs = [self.aggkey[o1, ] for o1 in assets['ordinal'] + 1]
@@ -1460,18 +1711,17 @@ class AggLossTable(AccumDict):
             idxs = [self.aggkey[tuple(rec)] for rec in assets[aggby]]
         else:
             idxs = []
-        for a, asset in enumerate(out.assets):
-            lt_losses = []
-            for lti, lt in enumerate(out.loss_types):
-                ls = out[lt][a]
-                if minimum_loss[lt]:
-                    ls[ls < minimum_loss[lt]] = 0
-                lt_losses.append((lt, ls))
-
-            # secondary outputs, if any
-            for sec_loss in self.sec_losses:
-                for k, o in sec_loss.compute(asset, lt_losses, eids).items():
-                    out[k][a] = o
+        lt_losses = []
+        for lt in out.loss_types:
+            ls = out[lt]  # shape (A, E)
+            if minimum_loss[lt]:
+                ls[ls < minimum_loss[lt]] = 0
+            lt_losses.append((lt, ls))
+
+        # secondary outputs, if any, computed for all the assets at once
+        for sec_loss in self.sec_losses:
+            for k, o in sec_loss.compute(assets, lt_losses, eids).items():
+                setattr(out, k, o)
 
         # aggregation
         K = len(self.aggkey) - 1
@@ -1501,9 +1751,25 @@ class AggLossTable(AccumDict):
         return pandas.DataFrame(out)
 
 
-# must have attribute .outputs and method .compute(asset, losses, loss_type)
-# returning a dictionary sec_key -> sec_losses
-class InsuredLosses(object):
+class SecondaryLoss(object):
+    """
+    Base class for the secondary losses, which are computed starting from
+    the primary losses of a block of assets, all at once.
+    Subclasses must define the list of `outputs` and the method `compute`.
+    """
+    outputs = []
+
+    def compute(self, assets, lt_losses, eids):
+        """
+        :param assets: an array of A asset records
+        :param lt_losses: a list of pairs (loss_type, losses of shape (A, E))
+        :param eids: an array of E event IDs
+        :returns: a dictionary output -> array of shape (A, E)
+        """
+        raise NotImplementedError
+
+
+class InsuredLosses(SecondaryLoss):
     """
     There is an insured loss for each loss type in the policy dictionary.
     """
@@ -1512,21 +1778,21 @@ class InsuredLosses(object):
         self.policy_dict = policy_dict
         self.outputs = [lt + '_ins' for lt in policy_dict]
 
-    def compute(self, asset, lt_losses, eids):
+    def compute(self, assets, lt_losses, eids):
         """
-        :param asset: an asset record
-        :param lt_losses: a list of pairs (loss_type, E losses)
+        :param assets: an array of A asset records
+        :param lt_losses: a list of pairs (loss_type, losses of shape (A, E))
         :param eids: an array of E event IDs
-        :returns: a dictionary loss_type_ins -> E insured losses
+        :returns: a dictionary loss_type_ins -> insured losses of shape (A, E)
         """
         res = {}
-        policy_idx = asset[self.policy_name]
+        policy_idx = assets[self.policy_name]
         for lt, losses in lt_losses:
             if lt in self.policy_dict:
-                avalue = asset['value-' + lt]
-                ded, lim = self.policy_dict[lt][policy_idx]
+                avalues = assets['value-' + lt]
+                ded, lim = self.policy_dict[lt][policy_idx].T  # shape (2, A)
                 res[lt + '_ins'] = insured_losses(
-                    losses, ded * avalue, lim * avalue)
+                    losses, (ded * avalues)[:, None], (lim * avalues)[:, None])
         return res
 
 
@@ -197,3 +197,30 @@ class ClassicalTestCase(unittest.TestCase):
         for loss, poe in expected_curve:
             numpy.testing.assert_allclose(
                 poe, actual_poes_interp(loss), atol=0.005)
+
+    def test_classical_poes_many_curves(self):
+        # computing many curves with a single matrix product must give
+        # the same result as computing one curve at the time
+        hazard_imls = [0.01, 0.08, 0.17, 0.26, 0.36, 0.55, 0.7]
+        hazard_curves = numpy.array([
+            [0.99, 0.96, 0.89, 0.82, 0.7, 0.4, 0.01],
+            [0.9, 0.8, 0.5, 0.3, 0.1, 0.05, 0.],
+            [0.5, 0.4, 0.3, 0.2, 0.1, 0.05, 0.01]])
+        vf = scientific.VulnerabilityFunction(
+            'VF', 'PGA', [0.1, 0.2, 0.4, 0.6], [0.05, 0.08, 0.2, 0.4],
+            [0.5, 0.3, 0.2, 0.1], "LN")
+        vf.seed = 42
+        vf.init()
+        ratios = tuple(vf.mean_loss_ratios_with_steps(2))
+        lrem = vf.loss_ratio_exceedance_matrix(ratios)
+        poes = scientific.classical_poes(
+            lrem, vf.mean_imls(), hazard_imls, hazard_curves)
+        self.assertEqual(poes.shape, (3, len(ratios)))
+        for curve, poe in zip(hazard_curves, poes):
+            numpy.testing.assert_allclose(
+                scientific.classical(vf, hazard_imls, curve, ratios)[1], poe)
+        # the loss maps computed on all the curves at once
+        numpy.testing.assert_allclose(
+            scientific.conditional_loss_ratios([ratios] * 3, poes, 0.3),
+            [scientific.conditional_loss_ratio(ratios, poe, 0.3)
+             for poe in poes])
@@ -20,7 +20,7 @@ import unittest
 import pickle
 
 import numpy
-from openquake.risklib import scientific
+from openquake.risklib import scientific, riskinput
 
 aaae = numpy.testing.assert_array_almost_equal
 
@@ -386,6 +386,75 @@ class LogNormalDistributionTestCase(unittest.TestCase):
         numpy.testing.assert_allclose([0., 0., 0.1, 0.10228396], samples)
 
 
+class EpsilonGetterTestCase(unittest.TestCase):
+    def test_reproducible(self):
+        # the epsilons for a given (asset, event) do not depend on the
+        # other assets and events requested
+        epsgetter = riskinput.EpsilonGetter(42, 0)
+        eps = epsgetter(numpy.arange(10), numpy.arange(100))
+        self.assertEqual(eps.shape, (10, 100))
+        self.assertEqual(eps.dtype, numpy.float32)
+        numpy.testing.assert_equal(eps[[3, 7]][:, [5, 50]],
+                                   epsgetter([3, 7], [5, 50]))
+
+    def test_correlation(self):
+        aids = numpy.arange(50)
+        eids = numpy.arange(5000)
+        for rho in (0, 0.37, 1):
+            eps = riskinput.EpsilonGetter(42, rho)(aids, eids)
+            coeffs = numpy.corrcoef(eps)[numpy.triu_indices(len(aids), 1)]
+            numpy.testing.assert_allclose(coeffs.mean(), rho, atol=.01)
+            numpy.testing.assert_allclose(eps.std(axis=1), 1, atol=.05)
+
+
+class VulnerabilityTableTestCase(unittest.TestCase):
+    def test_same_as_functions(self):
+        vf1 = scientific.VulnerabilityFunction(
+            'vf1', 'PGA', [0.005, 0.007, 0.0098, 0.0137, 0.0192, 0.0269],
+            [0.01, 0.1, 0.3, 0.5, 0.6, 1.0], [0.3, 0.1, 0.3, 0.0, 0.3, 0.1])
+        vf2 = scientific.VulnerabilityFunction(
+            'vf2', 'SA(0.3)', [0.01, 0.1, 0.5], [0.05, 0.2, 0.8], [0, 0, 0])
+        vf3 = scientific.VulnerabilityFunction(
+            'vf3', 'PGA', [0.006, 0.02], [0.1, 0.7], [0.2, 0.4])
+        for vf in (vf1, vf2, vf3):
+            vf.seed = 42
+            vf.init()
+        # taxonomy 0 -> vf1, taxonomy 1 -> vf2, taxonomy 2 -> 0.4 vf1 + 0.6 vf3
+        vtable = scientific.VulnerabilityTable(
+            [vf1, vf2, vf3], [[(0, 1)], [(1, 1)], [(0, .4), (2, .6)]])
+        gmvs = {'PGA': numpy.array([0.001, 0.006, 0.01, 0.02, 0.5]),
+                'SA(0.3)': numpy.array([0.005, 0.02, 0.1, 0.3, 1.])}
+        eps = scientific.counter_normal(42, [0, 1, 2], numpy.arange(5))
+        taxonomies = numpy.array([0, 1, 2])
+        aaae(vtable(taxonomies, gmvs),
+             [vf1(gmvs['PGA'], None), vf2(gmvs['SA(0.3)'], None),
+              .4 * vf1(gmvs['PGA'], None) + .6 * vf3(gmvs['PGA'], None)])
+        aaae(vtable(taxonomies, gmvs, eps),
+             [vf1(gmvs['PGA'], eps[0]), vf2(gmvs['SA(0.3)'], eps[1]),
+              .4 * vf1(gmvs['PGA'], eps[2]) + .6 * vf3(gmvs['PGA'], eps[2])],
+             decimal=6)
+
+
+class LossCurvesTestCase(unittest.TestCase):
+    def test_segments(self):
+        # building the curves for many groups at once must give the same
+        # result as building them one group at the time
+        builder = scientific.LossCurvesMapsBuilder(
+            [], numpy.array([1, 2, 5, 10, 20, 50, 100, 200]), None,
+            [.5, .5], {0: 40, 1: 25}, 100, 1)
+        counts = [3, 40, 1, 25, 7]
+        rlzs = [0, 0, 1, 1, 0]
+        offsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+        losses = numpy.random.RandomState(42).lognormal(
+            size=(2, offsets[-1])).astype(numpy.float32)
+        curves = builder.build_curves_segments(losses, offsets, rlzs)
+        self.assertEqual(curves.shape, (5, 2, 8))
+        for s, rlz in enumerate(rlzs):
+            aaae(curves[s], builder.build_curves(
+                losses[:, offsets[s]:offsets[s + 1]], rlz), decimal=5)
+        self.assertTrue(numpy.isnan(curves[:, :, -1]).all())
+
+
 class VulnerabilityLossRatioStepsTestCase(unittest.TestCase):
     IMT = 'PGA'
 
@@ -606,6 +675,19 @@ class InsuredLossesTestCase(unittest.TestCase):
                                       0.1, 0.5).mean()
         numpy.testing.assert_allclose((m1 * l1 + m2 * l2) / (l1 + l2), m)
 
+    def test_block_of_assets(self):
+        # two policies with (deductible, limit) as fractions of the value
+        policy_dict = {'structural': numpy.array([[.1, .5], [0, .2]])}
+        assets = numpy.array([(0, 100.), (1, 200.), (0, 10.)],
+                             [('policy', numpy.uint32),
+                              ('value-structural', float)])
+        losses = numpy.array([[5, 20, 60], [5, 20, 60], [5, 20, 60]])
+        ins = scientific.InsuredLosses('policy', policy_dict)
+        res = ins.compute(assets, [('structural', losses)], [0, 1, 2])
+        self.assertEqual(list(res), ['structural_ins'])
+        numpy.testing.assert_allclose(
+            res['structural_ins'], [[0, 10, 40], [5, 20, 40], [4, 4, 4]])
+
 
 class InsuredLossCurveTestCase(unittest.TestCase):
     def test_curve(self):
@@ -717,3 +799,15 @@ class ClassicalDamageTestCase(unittest.TestCase):
             fragility_functions, hazard_imls, hazard_poes,
             investigation_time, risk_investigation_time)
         aaae(poos, [0.56652127, 0.12513401, 0.1709355, 0.06555033, 0.07185889])
+
+        # many hazard curves at once, shape (2, 3, H)
+        curves = numpy.array([[hazard_poes, hazard_poes / 2,
+                               hazard_poes / 3]] * 2)
+        poos = scientific.classical_damage(
+            fragility_functions, hazard_imls, curves,
+            investigation_time, risk_investigation_time)
+        self.assertEqual(poos.shape, (2, 3, 5))
+        for r in range(3):
+            aaae(poos[1, r], scientific.classical_damage(
+                fragility_functions, hazard_imls, curves[1, r],
+                investigation_time, risk_investigation_time))